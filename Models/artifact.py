@@ -0,0 +1,386 @@
+from bisect import bisect_left, bisect_right
+from array import array
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+from Models.knowledge_base import FACT_TYPES, TIMED_PREDICATES
+from Models.query import TimeRange, time_minutes
+
+ARTIFACT_PATH = "../Assignment/Models/models.bin"
+MAGIC = b"NLPMODEL"
+# Increased with every change of the layout, an artifact of another version is rebuilt
+FORMAT_VERSION = 1
+# Magic, format version and length of the JSON directory which follows
+HEADER = struct.Struct("<8sII")
+ALIGNMENT = 8
+
+
+def sources_fingerprint(sources):
+    fingerprint = []
+    for path in sources:
+        try:
+            stat = os.stat(path)
+            fingerprint.append([path, stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            fingerprint.append([path, None, None])
+    return fingerprint
+
+
+def string_slot(blob, mask):
+    # First slot of a string in the hash table of the string table
+    return zlib.crc32(blob) & mask
+
+
+def index_key(ids, positions, string_count):
+    # The string ids at the positions folded into one integer, e.g. (city, time) -> city * string_count + time
+    key = 0
+    for position in positions:
+        key = key * string_count + ids[position]
+    return key
+
+
+def write_artifact(path, knowledge_base, tables, sources):
+    """
+    Write the models as one binary file: a sorted table of every string, the facts as columns of string ids,
+    the indexes as sorted keys with the offsets of their rows, and the small tables as rows of string ids.
+    The file is written next to path and moved over it, readers never see half an artifact.
+    :param knowledge_base: the BusKnowledgeBase to store
+    :param tables: dict name -> list of rows, each a tuple of strings, e.g. the relations of relations.txt
+    :param sources: paths of the text files the artifact is made from, an artifact older than them is rebuilt
+    """
+    # Taken first, a source which changes while it is read makes the artifact out of date at once
+    fingerprint = sources_fingerprint(sources)
+    strings = set()
+    for rows in tables.values():
+        for row in rows:
+            strings.update(row)
+    for facts in knowledge_base.facts.values():
+        for fact in facts:
+            strings.update(fact)
+    strings = sorted(strings)
+    string_ids = {string: idx for idx, string in enumerate(strings)}
+    string_count = len(strings)
+
+    sections = {}
+    blobs = [string.encode("utf-8") for string in strings]
+    offsets = array("Q", [0])
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    sections["strings.offsets"] = offsets
+    sections["strings.blob"] = array("B", b"".join(blobs))
+    # Open addressing table of id + 1 (0 is an empty slot), at most half full
+    size = 1
+    while size < 2 * len(blobs):
+        size *= 2
+    slots = array("I", bytes(4 * size))
+    for idx, blob in enumerate(blobs):
+        slot = string_slot(blob, size - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (size - 1)
+        slots[slot] = idx + 1
+    sections["strings.hash"] = slots
+    table_widths = {}
+    for name, rows in tables.items():
+        table_widths[name] = len(rows[0]) if rows else 1
+        sections["table." + name] = array("I", [string_ids[string] for row in rows for string in row])
+    sections["cities"] = array("I", [string_ids[city] for city in knowledge_base.cities])
+
+    predicates = {}
+    for predicate, fact_type in FACT_TYPES.items():
+        facts = knowledge_base.facts[predicate]
+        rows = [tuple(string_ids[value] for value in fact) for fact in facts]
+        for position in range(len(fact_type._fields)):
+            sections[f"facts.{predicate}.{position}"] = array("I", [row[position] for row in rows])
+        for positions in fact_type.indexes:
+            postings = {}
+            for row_id, row in enumerate(rows):
+                postings.setdefault(index_key(row, positions, string_count), []).append(row_id)
+            name = f"index.{predicate}.{'-'.join(str(position) for position in positions)}"
+            keys = sorted(postings)
+            sections[name + ".keys"] = array("Q", keys)
+            offsets = array("I", [0])
+            index_rows = array("I")
+            for key in keys:
+                index_rows.extend(postings[key])
+                offsets.append(len(index_rows))
+            sections[name + ".offsets"] = offsets
+            sections[name + ".rows"] = index_rows
+        if predicate in TIMED_PREDICATES:
+            minutes = array("H", [time_minutes(fact.time) for fact in facts])
+            sections[f"minutes.{predicate}"] = minutes
+            # Rows sorted by time, for all cities and for each city
+            by_time = sorted(range(len(rows)), key=lambda row_id: minutes[row_id])
+            sections[f"window.{predicate}.all.rows"] = array("I", by_time)
+            sections[f"window.{predicate}.all.minutes"] = array("H", [minutes[row_id] for row_id in by_time])
+            by_city = {}
+            for row_id in by_time:
+                by_city.setdefault(rows[row_id][1], []).append(row_id)
+            cities = sorted(by_city)
+            offsets = array("I", [0])
+            window_rows = array("I")
+            for city in cities:
+                window_rows.extend(by_city[city])
+                offsets.append(len(window_rows))
+            sections[f"window.{predicate}.keys"] = array("I", cities)
+            sections[f"window.{predicate}.offsets"] = offsets
+            sections[f"window.{predicate}.rows"] = window_rows
+            sections[f"window.{predicate}.minutes"] = array("H", [minutes[row_id] for row_id in window_rows])
+        predicates[predicate] = len(rows)
+
+    # Offsets of the sections from the end of the directory, each aligned for its type
+    directory = {"byteorder": sys.byteorder, "sources": fingerprint, "strings": string_count,
+                 "tables": table_widths, "predicates": predicates, "sections": {}}
+    position = 0
+    for name, values in sections.items():
+        position += -position % ALIGNMENT
+        length = len(values) * values.itemsize
+        directory["sections"][name] = [position, length, values.typecode]
+        position += length
+    directory_bytes = json.dumps(directory, ensure_ascii=False).encode("utf-8")
+    directory_bytes += b" " * (-(HEADER.size + len(directory_bytes)) % ALIGNMENT)
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(directory_bytes)))
+            file.write(directory_bytes)
+            position = 0
+            for name, values in sections.items():
+                offset = directory["sections"][name][0]
+                file.write(b"\0" * (offset - position))
+                values.tofile(file)
+                position = offset + directory["sections"][name][1]
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class StringTable:
+    """
+    The sorted strings of an artifact, read from the mapped file when asked for,
+    with a hash table from a string to its id
+    """
+
+    def __init__(self, offsets, blob, slots):
+        self.offsets = offsets
+        self.blob = blob
+        self.slots = slots
+        self._strings = {}
+        self._ids = {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        string = self._strings.get(idx)
+        if string is None:
+            string = self._strings[idx] = str(self.blob[self.offsets[idx]:self.offsets[idx + 1]], "utf-8")
+        return string
+
+    def find(self, string):
+        """
+        :return: the id of the string, None if the artifact does not have it
+        """
+        idx = self._ids.get(string)
+        if idx is None:
+            blob = string.encode("utf-8")
+            mask = len(self.slots) - 1
+            slot = string_slot(blob, mask)
+            while True:
+                idx = self.slots[slot] - 1
+                if idx < 0:
+                    return None
+                if self.blob[self.offsets[idx]:self.offsets[idx + 1]] == blob:
+                    break
+                slot = (slot + 1) & mask
+            self._ids[string] = idx
+        return idx
+
+
+class ModelArtifact:
+    """
+    A compiled artifact mapped into memory, its sections are read in place
+    """
+
+    def __init__(self, path=ARTIFACT_PATH):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, length = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(path + " is not a model artifact")
+        self.directory = json.loads(str(self._map[HEADER.size:HEADER.size + length], "utf-8"))
+        self._data = memoryview(self._map)[HEADER.size + length:]
+        self.strings = StringTable(self.section("strings.offsets"), self.section("strings.blob"),
+                                   self.section("strings.hash"))
+
+    def is_current(self, sources):
+        # Same layout, same byte order and made from the sources as they are now
+        return self.version == FORMAT_VERSION and self.directory["byteorder"] == sys.byteorder \
+            and self.directory["sources"] == sources_fingerprint(sources)
+
+    def section(self, name):
+        offset, length, typecode = self.directory["sections"][name]
+        return self._data[offset:offset + length].cast(typecode)
+
+    def table(self, name):
+        """
+        :return: the rows of a small table, each a tuple of strings
+        """
+        width = self.directory["tables"][name]
+        ids = self.section("table." + name)
+        return [tuple(self.strings[idx] for idx in ids[start:start + width]) for start in range(0, len(ids), width)]
+
+    def knowledge_base(self):
+        return MappedKnowledgeBase(self)
+
+
+def open_artifact(path=ARTIFACT_PATH, sources=()):
+    """
+    :return: the ModelArtifact, None if it is missing, damaged or older than one of the sources
+    """
+    try:
+        artifact = ModelArtifact(path)
+        if artifact.is_current(sources):
+            return artifact
+    except (OSError, ValueError, KeyError, struct.error):
+        pass
+    return None
+
+
+class MappedFacts:
+    # The facts of one predicate, made from the mapped columns when asked for
+    def __init__(self, knowledge_base, predicate):
+        self.knowledge_base = knowledge_base
+        self.predicate = predicate
+
+    def __len__(self):
+        return len(self.knowledge_base.columns[self.predicate][0])
+
+    def __getitem__(self, row_id):
+        if row_id < 0:
+            row_id += len(self)
+        if not 0 <= row_id < len(self):
+            raise IndexError(row_id)
+        return self.knowledge_base.fact(self.predicate, row_id)
+
+
+class MappedKnowledgeBase:
+    """
+    The knowledge base of an artifact, with the lookups of BusKnowledgeBase.
+    Nothing is loaded up front, a lookup searches the mapped indexes and only makes the facts it returns.
+    """
+
+    def __init__(self, artifact):
+        self.strings = artifact.strings
+        self.string_count = len(self.strings)
+        self.columns = {predicate: [artifact.section(f"facts.{predicate}.{position}")
+                                    for position in range(len(fact_type._fields))]
+                        for predicate, fact_type in FACT_TYPES.items()}
+        # predicate -> positions -> (sorted keys, offsets, rows), see index_key
+        self.indexes = {}
+        for predicate, fact_type in FACT_TYPES.items():
+            self.indexes[predicate] = {}
+            for positions in fact_type.indexes:
+                name = f"index.{predicate}.{'-'.join(str(position) for position in positions)}"
+                self.indexes[predicate][positions] = (artifact.section(name + ".keys"),
+                                                      artifact.section(name + ".offsets"),
+                                                      artifact.section(name + ".rows"))
+        self.minutes = {predicate: artifact.section("minutes." + predicate) for predicate in TIMED_PREDICATES}
+        # predicate -> (city ids, offsets, rows, minutes) and (rows, minutes) of all cities, sorted by time
+        self.windows = {predicate: tuple(artifact.section(f"window.{predicate}.{part}")
+                                         for part in ["keys", "offsets", "rows", "minutes"])
+                        for predicate in TIMED_PREDICATES}
+        self.all_windows = {predicate: (artifact.section(f"window.{predicate}.all.rows"),
+                                        artifact.section(f"window.{predicate}.all.minutes"))
+                            for predicate in TIMED_PREDICATES}
+        self.facts = {predicate: MappedFacts(self, predicate) for predicate in FACT_TYPES}
+        self.trains = self.facts["TRAIN"]
+        self.dtimes = self.facts["DTIME"]
+        self.atimes = self.facts["ATIME"]
+        self.run_times = self.facts["RUN-TIME"]
+        self.cities = dict.fromkeys(self.strings[idx] for idx in artifact.section("cities"))
+
+    def fact(self, predicate, row_id):
+        return FACT_TYPES[predicate](*(self.strings[column[row_id]] for column in self.columns[predicate]))
+
+    def __len__(self):
+        return sum(len(facts) for facts in self.facts.values())
+
+    @property
+    def train_names(self):
+        return [fact.train for fact in self.trains]
+
+    def _rows(self, index, key):
+        keys, offsets, rows = index
+        idx = bisect_left(keys, key)
+        if idx == len(keys) or keys[idx] != key:
+            return rows[0:0]
+        return rows[offsets[idx]:offsets[idx + 1]]
+
+    def _window_rows(self, predicate, city_id, time_range):
+        if city_id is None:
+            rows, minutes = self.all_windows[predicate]
+        else:
+            keys, offsets, rows, minutes = self.windows[predicate]
+            idx = bisect_left(keys, city_id)
+            if idx == len(keys) or keys[idx] != city_id:
+                return rows[0:0]
+            rows = rows[offsets[idx]:offsets[idx + 1]]
+            minutes = minutes[offsets[idx]:offsets[idx + 1]]
+        low, high = 0, len(minutes)
+        if time_range.start is not None:
+            low = (bisect_left if time_range.include_start else bisect_right)(minutes, time_range.start)
+        if time_range.end is not None:
+            high = (bisect_right if time_range.include_end else bisect_left)(minutes, time_range.end)
+        return rows[low:high]
+
+    def time_window(self, predicate, city, time_range):
+        """
+        The facts of a city whose time is in the window, see BusKnowledgeBase.time_window
+        """
+        city_id = self.strings.find(city) if city is not None else None
+        if city is not None and city_id is None:
+            return []
+        return [self.fact(predicate, row_id) for row_id in self._window_rows(predicate, city_id, time_range)]
+
+    def lookup(self, predicate, args, stats=None):
+        """
+        Find the facts matching a pattern, see BusKnowledgeBase.lookup
+        """
+        ids = []
+        time_range = None
+        for position, arg in enumerate(args):
+            if isinstance(arg, TimeRange):
+                time_range = arg
+                arg = None
+            idx = self.strings.find(arg) if arg is not None else None
+            if arg is not None and idx is None:
+                # A value the timetable does not have
+                return []
+            ids.append(idx)
+        if time_range is not None and ids[0] is None:
+            candidates = self._window_rows(predicate, ids[1], time_range)
+            if stats is not None:
+                stats["candidates"] = stats.get("candidates", 0) + len(candidates)
+            return [self.fact(predicate, row_id) for row_id in candidates]
+        columns = self.columns[predicate]
+        candidates = range(len(columns[0]))
+        # The smallest row list among the indexes whose positions are all bound
+        for positions, index in self.indexes[predicate].items():
+            if all(ids[position] is not None for position in positions):
+                found = self._rows(index, index_key(ids, positions, self.string_count))
+                if len(found) < len(candidates):
+                    candidates = found
+        if stats is not None:
+            stats["candidates"] = stats.get("candidates", 0) + len(candidates)
+        bound = [(columns[position], idx) for position, idx in enumerate(ids) if idx is not None]
+        minutes = self.minutes[predicate] if time_range is not None else None
+        return [self.fact(predicate, row_id) for row_id in candidates
+                if all(column[row_id] == idx for column, idx in bound)
+                and (minutes is None or minutes[row_id] in time_range)]
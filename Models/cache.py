@@ -0,0 +1,98 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+
+
+class AnswerCache:
+    """
+    Bounded LRU cache of answers with an optional time to live.
+    Everything is dropped when one of the watched files changes.
+    """
+
+    def __init__(self, max_size=4096, ttl=None, watched_files=(), check_interval=1.0):
+        """
+        :param max_size: most entries kept, the least recently used one goes first
+        :param ttl: seconds an entry stays valid, None to keep it until it is evicted
+        :param watched_files: files the answers depend on, e.g. data.txt
+        :param check_interval: seconds between two checks of the watched files
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.watched_files = list(watched_files)
+        self.check_interval = check_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = self._files_fingerprint()
+        self._last_check = time.monotonic()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def _files_fingerprint(self):
+        fingerprint = []
+        for path in self.watched_files:
+            try:
+                stat = os.stat(path)
+                fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                fingerprint.append((path, None, None))
+        return tuple(fingerprint)
+
+    def check_files(self):
+        """
+        Clear the cache if a watched file changed since the last check
+        :return: True if the cache was cleared
+        """
+        fingerprint = self._files_fingerprint()
+        with self._lock:
+            self._last_check = time.monotonic()
+            if fingerprint == self._fingerprint:
+                return False
+            self._fingerprint = fingerprint
+        self.invalidate()
+        return True
+
+    def invalidate(self):
+        # Drop every entry, e.g. when the models were reloaded
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def get(self, key):
+        if time.monotonic() - self._last_check >= self.check_interval:
+            self.check_files()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires is not None and time.monotonic() >= expires:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0, "evictions": self.evictions,
+                "expirations": self.expirations, "invalidations": self.invalidations}
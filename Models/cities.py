@@ -0,0 +1,55 @@
+CITY_CODES_PATH = "../Assignment/Models/city_codes.txt"
+
+
+class CityTable:
+    """
+    City names as segmented words, their codes in data.txt and the names printed in the answers
+    """
+
+    def __init__(self, rows):
+        """
+        :param rows: list of (word, code, display name), e.g. ("hồ_chí_minh", "HCMC", "Hồ Chí Minh")
+        """
+        self.rows = []
+        self.codes = {}
+        self.names = {}
+        for word, code, name in rows:
+            self.rows.append((word, code, name))
+            self.codes.setdefault(word, code)
+            self.names.setdefault(code, name)
+
+    def encode(self, word):
+        # None for a word which is not a city
+        return self.codes.get(word)
+
+    def decode(self, code):
+        # None for a value which is not a city code
+        return self.names.get(code)
+
+    @classmethod
+    def from_file(cls, path=CITY_CODES_PATH):
+        # Each line is "word,CODE,Display name"
+        rows = []
+        with open(path, 'r') as file:
+            for line in file.read().splitlines():
+                if line.strip() == "":
+                    continue
+                word, code, name = line.split(",", 2)
+                rows.append((word.strip(), code.strip(), name.strip()))
+        return cls(rows)
+
+
+_city_table = None
+
+
+def get_city_table():
+    # city_codes.txt is only read on first use
+    global _city_table
+    if _city_table is None:
+        _city_table = CityTable.from_file()
+    return _city_table
+
+
+def set_city_table(city_table):
+    global _city_table
+    _city_table = city_table
@@ -0,0 +1,324 @@
+import struct
+
+from Models.segmentation_cache import SEGMENTER_PATH
+
+VOCAB_PATH = SEGMENTER_PATH + "vi-vocab"
+RDR_PATH = SEGMENTER_PATH + "wordsegmenter.rdr"
+# Longest word looked up in the vocabulary, in syllables, as in RDRsegmenter
+MAX_WORD_SYLLABLES = 4
+# Split off the start and the end of a token, as the VnCoreNLP tokenizer does with "huế?"
+PUNCTUATION = "?!.,;:\"'()[]{}…"
+# What the rules know of a syllable, in the order of the context of RDRsegmenter
+FEATURES = ["prevWord2", "prevTag2", "prevWord1", "prevTag1", "word", "tag", "nextWord1", "nextTag1", "nextWord2",
+            "nextTag2"]
+FEATURE_INDEX = {feature: idx for idx, feature in enumerate(FEATURES)}
+
+_END = ""
+
+
+def read_vocabulary(path=VOCAB_PATH):
+    """
+    Read vi-vocab, a Java serialized HashSet<String> of the words of several syllables, e.g. "xe buýt"
+    :return: list of the words
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    # Stream header, the class description of java.util.HashSet and no superclass
+    if data[:6] != b"\xac\xed\x00\x05\x73\x72":
+        raise ValueError(path + " is not a serialized Java object")
+    name_length = struct.unpack_from(">H", data, 6)[0]
+    if data[8:8 + name_length] != b"java.util.HashSet":
+        raise ValueError(path + " is not a serialized HashSet")
+    # serialVersionUID, flags, no fields, end of the description, no superclass
+    pos = 8 + name_length + 8 + 1 + 2 + 2
+    # Block data of the capacity, load factor and size
+    if data[pos] != 0x77:
+        raise ValueError(path + " has no HashSet size")
+    size = struct.unpack_from(">i", data, pos + 2 + 8)[0]
+    pos += 2 + data[pos + 1]
+    words = []
+    for _ in range(size):
+        kind = data[pos]
+        if kind == 0x74:
+            length = struct.unpack_from(">H", data, pos + 1)[0]
+            pos += 3
+        elif kind == 0x7c:
+            length = struct.unpack_from(">Q", data, pos + 1)[0]
+            pos += 9
+        else:
+            raise ValueError(path + " has an element which is not a string")
+        # Java writes modified UTF-8, the same as UTF-8 for Vietnamese
+        words.append(data[pos:pos + length].decode("utf-8", "surrogatepass"))
+        pos += length
+    return words
+
+
+class VocabularyTrie:
+    """
+    Words of several syllables in a trie of syllables, and every syllable of the words
+    """
+
+    def __init__(self, words=()):
+        self.root = {}
+        self.syllables = set()
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        # "xe buýt" or "xe_buýt", a word of one syllable only adds the syllable
+        syllables = word.replace("_", " ").split()
+        self.syllables.update(syllables)
+        if len(syllables) < 2:
+            return
+        node = self.root
+        for syllable in syllables:
+            node = node.setdefault(syllable, {})
+        node[_END] = True
+
+    def longest(self, syllables, start, limit=MAX_WORD_SYLLABLES):
+        """
+        :return: the number of syllables of the longest word starting at start, 1 if there is none
+        """
+        node = self.root
+        best = 1
+        for idx in range(start, min(len(syllables), start + limit)):
+            node = node.get(syllables[idx])
+            if node is None:
+                break
+            if _END in node:
+                best = idx - start + 1
+        return best
+
+
+class RuleNode:
+    __slots__ = ("condition", "conclusion", "depth", "parent", "children", "exceptions")
+
+    def __init__(self, condition, conclusion, depth, parent=None):
+        # condition is a tuple of (feature index, value), all of them must hold
+        self.condition = condition
+        self.conclusion = conclusion
+        self.depth = depth
+        self.parent = parent
+        self.children = []
+        # The children as a RuleChain, None for a leaf
+        self.exceptions = None
+
+
+class RuleChain:
+    """
+    The exceptions of a rule, in order: the first one which holds fires.
+    Each rule is indexed on one of its tests, so only the rules whose test holds are checked.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        # feature index -> value -> positions of the rules indexed on that test
+        self.index = {}
+        for position, node in enumerate(nodes):
+            feature, value = node.condition[0]
+            self.index.setdefault(feature, {}).setdefault(value, []).append(position)
+
+    def first(self, context):
+        candidates = []
+        for feature, values in self.index.items():
+            candidates.extend(values.get(context[feature], ()))
+        for position in sorted(candidates):
+            node = self.nodes[position]
+            if all(context[feature] == value for feature, value in node.condition):
+                return node
+        return None
+
+
+class RuleTree:
+    """
+    The Single Classification Ripple Down Rules of wordsegmenter.rdr, which correct the B/I tags of the
+    initial segmentation. The last rule which holds on the path from the root decides.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def fire(self, context):
+        """
+        :param context: the values of FEATURES for one syllable
+        :return: the RuleNode which decides, the root if no rule holds
+        """
+        fired = self.root
+        chain = self.root.exceptions
+        while chain is not None:
+            node = chain.first(context)
+            if node is None:
+                break
+            fired = node
+            chain = node.exceptions
+        return fired
+
+    @classmethod
+    def from_file(cls, path=RDR_PATH):
+        # One rule per line, e.g. '\tobject.prevWord1 == "quận" and object.word == "huyện" : object.conclusion = "I"',
+        # the tabs give the depth, a rule is an exception of the last rule less deep before it
+        with open(path, 'r', encoding="utf-8") as file:
+            lines = file.read().splitlines()
+        root = current = RuleNode((), "NN", 0)
+        for line in lines[1:]:
+            depth = len(line) - len(line.lstrip("\t"))
+            if line.strip() == "":
+                continue
+            condition_text, conclusion_text = line.strip().split(" : ", 1)
+            condition = []
+            for test in condition_text.split(" and "):
+                feature, value = test[len("object."):].split(" == ", 1)
+                condition.append((FEATURE_INDEX[feature], value[1:-1]))
+            if depth > current.depth:
+                parent = current
+            else:
+                while current.depth > depth:
+                    current = current.parent
+                parent = current.parent
+            node = RuleNode(tuple(condition), conclusion_text.split(" = ", 1)[1][1:-1], depth, parent)
+            parent.children.append(node)
+            current = node
+        nodes = [root]
+        while nodes:
+            node = nodes.pop()
+            if node.children:
+                node.exceptions = RuleChain(node.children)
+                nodes.extend(node.children)
+        return cls(root)
+
+
+def split_tokens(line):
+    # Whitespace separated tokens, with the punctuation at their ends as tokens of their own
+    tokens = []
+    for token in line.split():
+        start, end = 0, len(token)
+        while start < end and token[start] in PUNCTUATION:
+            tokens.append(token[start])
+            start += 1
+        trailing = []
+        while end > start and token[end - 1] in PUNCTUATION:
+            end -= 1
+            trailing.append(token[end])
+        if start < end:
+            tokens.append(token[start:end])
+        tokens.extend(reversed(trailing))
+    return tokens
+
+
+class DictionarySegmenter:
+    """
+    Word segmenter in this process, without the JVM. As RDRsegmenter in VnCoreNLP, each syllable starts the longest
+    word of vi-vocab found there, then the rules of wordsegmenter.rdr correct the result.
+    The confidence of a sentence is the share of its syllables which are known, words of a lower confidence
+    should be segmented by VnCoreNLP, see try_tokenize.
+    """
+
+    def __init__(self, vocab_path=VOCAB_PATH, rules_path=RDR_PATH, extra_words=(), min_confidence=1.0):
+        """
+        :param rules_path: wordsegmenter.rdr, None to keep the longest words without the rules
+        :param extra_words: words of the questions missing from vi-vocab, e.g. the cities of city.txt
+        :param min_confidence: lowest confidence try_tokenize accepts
+        """
+        self.trie = VocabularyTrie(read_vocabulary(vocab_path))
+        for word in extra_words:
+            self.trie.add(word)
+        self.rules = RuleTree.from_file(rules_path) if rules_path is not None else None
+        self.min_confidence = min_confidence
+
+    def add_words(self, words):
+        # Words added to the domain files after loading, e.g. a new city
+        for word in words:
+            self.trie.add(word)
+
+    def segment(self, line):
+        """
+        :return: the words of one sentence, e.g. ["xe_buýt", "nào", "đến", "huế", "?"], and its confidence
+        """
+        tokens = split_tokens(line)
+        syllables = [token.lower() for token in tokens]
+        tags = []
+        known = letters = 0
+        idx = 0
+        while idx < len(tokens):
+            length = 1
+            if tokens[idx].isalpha():
+                letters += 1
+                known += syllables[idx] in self.trie.syllables
+                length = self.trie.longest(syllables, idx)
+                if length > 1:
+                    letters += length - 1
+                    known += length - 1
+            tags.append("B")
+            tags.extend(["I"] * (length - 1))
+            idx += length
+        if self.rules is not None:
+            tags = self.correct(syllables, tags)
+        words = []
+        for token, tag in zip(tokens, tags):
+            if tag == "I" and words:
+                words[-1] += "_" + token
+            else:
+                words.append(token)
+        return words, known / letters if letters else 1.0
+
+    def correct(self, syllables, tags):
+        # The tag of each syllable after the rules, which see the tags of the initial segmentation
+        size = len(syllables)
+        padded_syllables = ["", ""] + syllables + ["", ""]
+        padded_tags = ["", ""] + tags + ["", ""]
+        corrected = []
+        for idx in range(size):
+            context = []
+            for offset in range(idx, idx + 5):
+                context.append(padded_syllables[offset])
+                context.append(padded_tags[offset])
+            fired = self.rules.fire(context)
+            corrected.append(fired.conclusion if fired.depth > 0 else tags[idx])
+        return corrected
+
+    def tokenize(self, text):
+        """
+        :return: one sentence for each line of the text, as VnCoreNLP gives them
+        """
+        return [self.segment(line)[0] for line in text.split("\n") if line.strip() != ""]
+
+    def try_tokenize(self, text):
+        """
+        :return: the sentences as tokenize gives them, None if one of them is below min_confidence
+        """
+        sentences = []
+        for line in text.split("\n"):
+            if line.strip() == "":
+                continue
+            words, confidence = self.segment(line)
+            if confidence < self.min_confidence:
+                return None
+            sentences.append(words)
+        return sentences
+
+    def close(self):
+        pass
+
+
+def read_domain_words():
+    # The words of the grammar and the cities, which vi-vocab does not all have.
+    # Imported here, the parser imports the segmenter
+    from Models.parser import RELATIONS_PATH, CITY_PATH
+    words = []
+    with open(RELATIONS_PATH, 'r') as file:
+        for line in file:
+            words.extend(line.split()[1:])
+    with open(CITY_PATH, 'r') as file:
+        words.extend(file.read().split())
+    return words
+
+
+_dictionary_segmenter = None
+
+
+def get_dictionary_segmenter():
+    # vi-vocab and the rules are only read on first use
+    global _dictionary_segmenter
+    if _dictionary_segmenter is None:
+        _dictionary_segmenter = DictionarySegmenter(extra_words=read_domain_words())
+    return _dictionary_segmenter
@@ -0,0 +1,285 @@
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from heapq import merge
+from itertools import chain
+
+from Models.query import TimeRange, time_minutes
+
+DATA_PATH = "../Assignment/Models/data.txt"
+
+
+class Fact:
+    # Text form as written in data.txt
+    __slots__ = ()
+    # Argument positions with a hash index, alone or together
+    indexes = [(0,)]
+
+    def __str__(self):
+        return "(" + " ".join((self.predicate,) + tuple(self)) + ")"
+
+
+class TrainFact(Fact, namedtuple("TrainFact", ["train"])):
+    # (TRAIN B1)
+    __slots__ = ()
+    predicate = "TRAIN"
+
+
+class DepartFact(Fact, namedtuple("DepartFact", ["train", "city", "time"])):
+    # (DTIME B1 HCMC 10:00HR)
+    __slots__ = ()
+    predicate = "DTIME"
+    indexes = [(0,), (1,), (2,), (1, 2)]
+
+
+class ArriveFact(Fact, namedtuple("ArriveFact", ["train", "city", "time"])):
+    # (ATIME B1 HUE 19:00HR)
+    __slots__ = ()
+    predicate = "ATIME"
+    indexes = [(0,), (1,), (2,), (1, 2)]
+
+
+class RunTimeFact(Fact, namedtuple("RunTimeFact", ["train", "source", "destination", "time"])):
+    # (RUN-TIME B1 HCMC HUE 9:00HR)
+    __slots__ = ()
+    predicate = "RUN-TIME"
+    indexes = [(0,), (1,), (2,), (1, 2)]
+
+
+FACT_TYPES = {fact_type.predicate: fact_type for fact_type in [TrainFact, DepartFact, ArriveFact, RunTimeFact]}
+# Facts whose time can be asked as a window, e.g. (ATIME ?tr HUE <20:00HR)
+TIMED_PREDICATES = ["DTIME", "ATIME"]
+
+
+class BusKnowledgeBase:
+    """
+    Timetable facts parsed once from data.txt, with hash indexes for lookups.
+    Each fact type lists the argument positions it is indexed on, so a lookup with any of them bound
+    only looks at the facts sharing those values, however large the timetable is.
+    """
+
+    def __init__(self):
+        # predicate -> facts in order of data.txt
+        self.facts = {predicate: [] for predicate in FACT_TYPES}
+        self.trains = self.facts["TRAIN"]
+        self.dtimes = self.facts["DTIME"]
+        self.atimes = self.facts["ATIME"]
+        self.run_times = self.facts["RUN-TIME"]
+        # predicate -> positions -> values at those positions -> facts, every list keeps the order of data.txt
+        self.indexes = {predicate: {positions: {} for positions in fact_type.indexes}
+                        for predicate, fact_type in FACT_TYPES.items()}
+        # predicate -> city (None for all of them) -> (minutes, facts) sorted by time, built on first use
+        self.sorted_times = {}
+        # City codes in order of first appearance
+        self.cities = {}
+
+    def add(self, fact):
+        self.facts[fact.predicate].append(fact)
+        for positions, index in self.indexes[fact.predicate].items():
+            index.setdefault(tuple(fact[position] for position in positions), []).append(fact)
+        if isinstance(fact, (DepartFact, ArriveFact)):
+            self.cities.setdefault(fact.city)
+            self.sorted_times.pop(fact.predicate, None)
+        elif isinstance(fact, RunTimeFact):
+            self.cities.setdefault(fact.source)
+            self.cities.setdefault(fact.destination)
+
+    def __len__(self):
+        return sum(len(facts) for facts in self.facts.values())
+
+    @property
+    def train_names(self):
+        return [fact.train for fact in self.trains]
+
+    def time_window(self, predicate, city, time_range):
+        """
+        The facts of a city whose time is in the window, by binary search of the sorted times
+        :param predicate: DTIME or ATIME
+        :param city: the city code, None for every city
+        :param time_range: the TimeRange
+        :return: list of the facts, in order of time
+        """
+        if predicate not in self.sorted_times:
+            by_city = {}
+            for fact in sorted(self.facts[predicate], key=lambda item: time_minutes(item.time)):
+                for key in [None, fact.city]:
+                    minutes, facts = by_city.setdefault(key, ([], []))
+                    minutes.append(time_minutes(fact.time))
+                    facts.append(fact)
+            self.sorted_times[predicate] = by_city
+        minutes, facts = self.sorted_times[predicate].get(city, ([], []))
+        low, high = 0, len(minutes)
+        if time_range.start is not None:
+            low = (bisect_left if time_range.include_start else bisect_right)(minutes, time_range.start)
+        if time_range.end is not None:
+            high = (bisect_right if time_range.include_end else bisect_left)(minutes, time_range.end)
+        return facts[low:high]
+
+    def lookup(self, predicate, args, stats=None):
+        """
+        Find the facts matching a pattern, using the most selective index
+        :param predicate: TRAIN, DTIME, ATIME or RUN-TIME
+        :param args: the arguments of the fact, None where any value is allowed, a TimeRange for a window of times
+        :param stats: dict whose "candidates" count is increased by the number of facts examined
+        :return: list of the matching facts, in order of data.txt, or of time for a window of any train
+        """
+        time_range = args[2] if predicate in TIMED_PREDICATES and isinstance(args[2], TimeRange) else None
+        if time_range is not None:
+            if args[0] is None:
+                # The window is cut from the sorted times of the city, nothing is left to check
+                candidates = self.time_window(predicate, args[1], time_range)
+                if stats is not None:
+                    stats["candidates"] = stats.get("candidates", 0) + len(candidates)
+                return candidates
+            # A named train has fewer facts than any window, its times are checked one by one
+            args = args[:2] + (None,)
+        candidates = self.facts[predicate]
+        # The smallest list among the indexes whose positions are all bound
+        for positions, index in self.indexes[predicate].items():
+            if all(args[position] is not None for position in positions):
+                found = index.get(tuple(args[position] for position in positions), [])
+                if len(found) < len(candidates):
+                    candidates = found
+        if stats is not None:
+            stats["candidates"] = stats.get("candidates", 0) + len(candidates)
+        return [fact for fact in candidates if all(arg is None or arg == value for arg, value in zip(args, fact))
+                and (time_range is None or time_minutes(fact.time) in time_range)]
+
+    @staticmethod
+    def parse_fact(line):
+        """
+        Parse one line of data.txt, e.g. (DTIME B1 HCMC 10:00HR)
+        :param line: the line to parse
+        :return: the fact record, None for blank lines
+        """
+        parts = line.strip()[1:-1].split()
+        if not parts:
+            return None
+        if parts[0] == "TRAIN":
+            return TrainFact(parts[1])
+        elif parts[0] == "DTIME":
+            return DepartFact(parts[1], parts[2], parts[3])
+        elif parts[0] == "ATIME":
+            return ArriveFact(parts[1], parts[2], parts[3])
+        elif parts[0] == "RUN-TIME":
+            return RunTimeFact(parts[1], parts[2], parts[3], parts[4])
+        raise ValueError("Unknown fact: " + line)
+
+    @classmethod
+    def from_lines(cls, lines):
+        knowledge_base = cls()
+        for line in lines:
+            fact = cls.parse_fact(line)
+            if fact is not None:
+                knowledge_base.add(fact)
+        return knowledge_base
+
+    @classmethod
+    def from_layers(cls, layers):
+        # One knowledge base of the facts of several, those of the first ones first as in data.txt
+        knowledge_base = cls()
+        for layer in layers:
+            for facts in layer.facts.values():
+                for fact in facts:
+                    knowledge_base.add(fact)
+        knowledge_base.cities = {}
+        for layer in layers:
+            knowledge_base.cities.update(layer.cities)
+        return knowledge_base
+
+    @classmethod
+    def from_file(cls, path=DATA_PATH):
+        with open(path, 'r') as file:
+            return cls.from_lines(file)
+
+
+def by_time(fact):
+    return time_minutes(fact.time)
+
+
+class LayeredFacts:
+    # The facts of one predicate in every layer, read through rather than copied
+    def __init__(self, layers):
+        self.layers = layers
+
+    def __len__(self):
+        return sum(len(facts) for facts in self.layers)
+
+    def __iter__(self):
+        return chain.from_iterable(self.layers)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        for facts in self.layers:
+            if 0 <= idx < len(facts):
+                return facts[idx]
+            idx -= len(facts)
+        raise IndexError(idx)
+
+
+class LayeredKnowledgeBase:
+    """
+    Facts appended to data.txt after a knowledge base was loaded, indexed on their own and looked up after it.
+    The loaded knowledge base and the layers of earlier appends are shared, not copied, and never change,
+    so the knowledge bases of earlier snapshots keep answering as they did.
+    """
+
+    def __init__(self, base, *appended):
+        """
+        :param base: the BusKnowledgeBase or MappedKnowledgeBase loaded before
+        :param appended: BusKnowledgeBase of the facts which follow those of base in data.txt, one for each layer
+        """
+        self.base = base
+        self.appended = list(appended)
+        layers = [base] + self.appended
+        self.cities = {}
+        for layer in layers:
+            self.cities.update(layer.cities)
+        self.facts = {predicate: LayeredFacts([layer.facts[predicate] for layer in layers])
+                      for predicate in FACT_TYPES}
+        self.trains = self.facts["TRAIN"]
+        self.dtimes = self.facts["DTIME"]
+        self.atimes = self.facts["ATIME"]
+        self.run_times = self.facts["RUN-TIME"]
+
+    def __len__(self):
+        return len(self.base) + sum(len(layer) for layer in self.appended)
+
+    @property
+    def train_names(self):
+        return [fact.train for fact in self.trains]
+
+    def time_window(self, predicate, city, time_range):
+        # Every window is sorted by time, the facts of the earlier layers go first at the same time as in data.txt
+        return list(merge(self.base.time_window(predicate, city, time_range),
+                          *(layer.time_window(predicate, city, time_range) for layer in self.appended),
+                          key=by_time))
+
+    def lookup(self, predicate, args, stats=None):
+        """
+        Find the facts matching a pattern in every layer, see BusKnowledgeBase.lookup
+        """
+        found = self.base.lookup(predicate, args, stats)
+        appended = [layer.lookup(predicate, args, stats) for layer in self.appended]
+        if not any(appended):
+            return found
+        if predicate in TIMED_PREDICATES and isinstance(args[2], TimeRange) and args[0] is None:
+            return list(merge(found, *appended, key=by_time))
+        return list(chain(found, *appended))
+
+
+_knowledge_base = None
+
+
+def get_knowledge_base():
+    # The timetable is only read on first use, later calls share it
+    global _knowledge_base
+    if _knowledge_base is None:
+        _knowledge_base = BusKnowledgeBase.from_file(DATA_PATH)
+    return _knowledge_base
+
+
+def set_knowledge_base(knowledge_base):
+    # Share another knowledge base, e.g. the one of a compiled artifact
+    global _knowledge_base
+    _knowledge_base = knowledge_base
@@ -0,0 +1,91 @@
+from collections import namedtuple
+
+
+class Wh(namedtuple("Wh", ["kind"])):
+    # The value asked for by the question, NAME or TIME
+    __slots__ = ()
+
+    def __str__(self):
+        return "<WH t1 " + self.kind + ">"
+
+
+WH_NAME = Wh("NAME")
+WH_TIME = Wh("TIME")
+
+
+# A slot holds a constant (city, bus name, time) or the WH asked for
+def is_wh(value):
+    return isinstance(value, Wh)
+
+
+class Agent(namedtuple("Agent", ["name"], defaults=[None])):
+    # <TRAIN t1 <WH t1 NAME>> or <TRAIN t1 <NAME t1 "b1">>, name is None if the bus was not named
+    __slots__ = ()
+
+    def __str__(self):
+        if self.name is None:
+            return "<TRAIN t1 >"
+        if is_wh(self.name):
+            return "<TRAIN t1 " + str(self.name) + ">"
+        return "<TRAIN t1 <NAME t1 \"" + self.name + "\">>"
+
+
+class Place(namedtuple("Place", ["city"])):
+    # <CITY t1<NAME t1 huế>> or <CITY t1<WH t1 NAME>>
+    __slots__ = ()
+
+    def __str__(self):
+        if is_wh(self.city):
+            return "<CITY t1" + str(self.city) + ">"
+        return "<CITY t1<NAME t1 " + self.city + ">>"
+
+
+class Source(Place):
+    __slots__ = ()
+
+
+class Destination(Place):
+    __slots__ = ()
+
+
+class TimePoint(namedtuple("TimePoint", ["time"])):
+    # <TIME t1 8:30> or <TIME t1 <WH t1 TIME>>
+    __slots__ = ()
+
+    def __str__(self):
+        return "<TIME t1 " + str(self.time) + ">"
+
+
+class Leave(TimePoint):
+    __slots__ = ()
+
+
+class Arrive(TimePoint):
+    __slots__ = ()
+
+
+class RunTime(TimePoint):
+    __slots__ = ()
+
+
+class LogicalForm(namedtuple("LogicalForm", ["verb", "agent", "source", "leave", "destination", "arrive", "run_time",
+                                             "question_type"],
+                             defaults=[None, None, None, None, None, None, "WH-QUERY"])):
+    """
+    Logical form of a WH question, one optional part for each role of the verb
+    """
+    __slots__ = ()
+
+    def parts(self):
+        # (role name, part) in the order of the output file
+        return [(name, part) for name, part in [("AGENT", self.agent), ("SOURCE", self.source),
+                                                ("LEAVE", self.leave), ("DESTINATION", self.destination),
+                                                ("ARRIVE", self.arrive), ("RUN-TIME", self.run_time)]
+                if part is not None]
+
+    def to_dict(self):
+        # The dict form written to output_d.txt, e.g. {'WH-QUERY': {'đi': {'AGENT': '<TRAIN t1 <WH t1 NAME>>'}}}
+        return {self.question_type: {self.verb: {name: str(part) for name, part in self.parts()}}}
+
+    def __str__(self):
+        return str(self.to_dict())
@@ -0,0 +1,165 @@
+from collections import deque, namedtuple
+from contextlib import contextmanager, nullcontext
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+
+# What the hooks receive: the time of one stage, a counter increment, or a sampled profile
+StageEvent = namedtuple("StageEvent", ["stage", "wall", "cpu"])
+CountEvent = namedtuple("CountEvent", ["name", "value"])
+ProfileEvent = namedtuple("ProfileEvent", ["profile", "memory"])
+
+_NO_STAGE = nullcontext()
+
+
+def no_stage(name):
+    # Stand-in for Metrics.stage when the metrics are off
+    return _NO_STAGE
+
+
+class Histogram:
+    """
+    The last window values of a measure, for percentiles of the recent requests
+    """
+
+    def __init__(self, window=10000):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.values.append(value)
+        self.count += 1
+        self.total += value
+
+    def percentile(self, fraction):
+        if not self.values:
+            return 0.0
+        values = sorted(self.values)
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+
+    def summary(self):
+        # Milliseconds
+        return {"p50": self.percentile(0.5) * 1000, "p95": self.percentile(0.95) * 1000,
+                "p99": self.percentile(0.99) * 1000, "mean": self.total / self.count * 1000 if self.count else 0.0}
+
+
+class Metrics:
+    """
+    Wall and CPU time of each stage, counters, and profiles of a sampled fraction of the questions.
+    Hooks are functions called with every StageEvent, CountEvent and ProfileEvent, e.g. to send them to a monitor.
+    """
+
+    def __init__(self, window=10000, profile_rate=0.0, trace_memory=False, profiles_kept=20):
+        """
+        :param window: values kept in each histogram
+        :param profile_rate: fraction of the questions run under cProfile, 0 to never profile
+        :param trace_memory: also take a tracemalloc snapshot of the profiled questions
+        :param profiles_kept: number of the last profiles kept in memory
+        """
+        self.window = window
+        self.profile_rate = profile_rate
+        self.trace_memory = trace_memory
+        self.profiles = deque(maxlen=profiles_kept)
+        self.hooks = []
+        self.wall = {}
+        self.cpu = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def _emit(self, event):
+        for hook in self.hooks:
+            hook(event)
+
+    @contextmanager
+    def stage(self, name):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def record(self, stage, wall, cpu):
+        with self._lock:
+            if stage not in self.wall:
+                self.wall[stage] = Histogram(self.window)
+                self.cpu[stage] = Histogram(self.window)
+            self.wall[stage].add(wall)
+            self.cpu[stage].add(cpu)
+        self._emit(StageEvent(stage, wall, cpu))
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        self._emit(CountEvent(name, value))
+
+    def sample(self, questions=1):
+        """
+        :param questions: number of questions answered in the block, e.g. a batch is profiled as a whole
+        as often as one of its questions would be
+        :return: a context manager which profiles its block for a profile_rate fraction of the questions
+        """
+        if self.profile_rate <= 0 or random.random() >= 1 - (1 - min(self.profile_rate, 1.0)) ** questions:
+            return _NO_STAGE
+        return self._profile()
+
+    @contextmanager
+    def _profile(self):
+        profiler = cProfile.Profile()
+        # tracemalloc is process wide, only one question traces the memory at a time
+        trace_memory = self.trace_memory and not tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is running in this thread
+            profiler = None
+        try:
+            yield
+        finally:
+            profile = memory = None
+            if profiler is not None:
+                profiler.disable()
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(20)
+                profile = stream.getvalue()
+            if trace_memory:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                memory = [str(statistic) for statistic in snapshot.statistics("lineno")[:10]]
+            event = ProfileEvent(profile, memory)
+            self.profiles.append(event)
+            self._emit(event)
+
+    def stats(self):
+        """
+        :return: dict with the wall and CPU percentiles (ms) and the count of each stage, and the counters
+        """
+        with self._lock:
+            stages = {stage: {"count": self.wall[stage].count, "wall": self.wall[stage].summary(),
+                              "cpu": self.cpu[stage].summary()} for stage in self.wall}
+            return {"stages": stages, "counters": dict(self.counters), "profiles": len(self.profiles)}
+
+    def report(self):
+        # The stats as a table, for the end of a run
+        stats = self.stats()
+        lines = [f"{'STAGE':<20} {'count':>8} {'wall p50':>10} {'p95':>10} {'p99':>10} {'cpu p50':>10}  (ms)"]
+        for stage, values in stats["stages"].items():
+            wall, cpu = values["wall"], values["cpu"]
+            lines.append(f"{stage:<20} {values['count']:>8} {wall['p50']:>10.3f} {wall['p95']:>10.3f} "
+                         f"{wall['p99']:>10.3f} {cpu['p50']:>10.3f}")
+        for name, value in stats["counters"].items():
+            lines.append(f"{name}: {value}")
+        return "\n".join(lines)
@@ -0,0 +1,276 @@
+import re
+from collections import namedtuple
+
+EQUIVALENT_PATH = "../Assignment/Models/equivalent.txt"
+
+# Rules which come before the synonyms of equivalent.txt
+FIXED_RULES = [
+    ("chuyến xe buýt", "xe buýt"),
+    ("chuyến xe bus", "xe buýt"),
+    ("chuyến xe", "xe buýt"),
+    ("chuyến buýt", "xe buýt"),
+    ("chuyến bus", "xe buýt"),
+    ("bus", "buýt"),
+    ("city", ""),
+    ("giờ", "hr"),
+]
+
+_END = ""
+
+
+class PhraseNormalizer:
+    """
+    Rewrite phrases into their normal form in one left to right pass.
+    The phrases are kept in a character trie, at each position the longest phrase wins,
+    so the cost depends on the sentence length, not on the number of phrases.
+    """
+
+    def __init__(self, rules):
+        """
+        :param rules: list of (phrase, normal form), the first rule of a phrase wins
+        """
+        self.trie = {}
+        for phrase, normal_text in rules:
+            if phrase == "":
+                continue
+            node = self.trie
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node.setdefault(_END, normal_text)
+
+    def __call__(self, text):
+        return self.normalize(text)
+
+    def normalize(self, text):
+        parts = []
+        last = idx = 0
+        length = len(text)
+        while idx < length:
+            # A phrase only starts and ends at word boundaries
+            if idx == 0 or not text[idx - 1].isalpha():
+                node = self.trie
+                end = idx
+                match = None
+                while end < length and text[end] in node:
+                    node = node[text[end]]
+                    end += 1
+                    if _END in node and (end == length or not text[end].isalpha()):
+                        match = (end, node[_END])
+                if match is not None:
+                    parts.append(text[last:idx])
+                    parts.append(match[1])
+                    idx = last = match[0]
+                    continue
+            idx += 1
+        parts.append(text[last:])
+        return "".join(parts)
+
+    @staticmethod
+    def read_rules(path=EQUIVALENT_PATH):
+        # Each line is "rough text 1,rough text 2->normal text"
+        rules = []
+        with open(path, 'r') as file:
+            for line in file.read().splitlines():
+                if "->" not in line:
+                    continue
+                rough_texts, normal_text = line.split("->")
+                for text_part in rough_texts.split(','):
+                    rules.append((text_part, normal_text))
+        return rules
+
+    @classmethod
+    def from_file(cls, path=EQUIVALENT_PATH):
+        return cls(FIXED_RULES + cls.read_rules(path))
+
+
+_normalizer = None
+
+
+def get_normalizer():
+    # equivalent.txt is only read on first use
+    global _normalizer
+    if _normalizer is None:
+        _normalizer = PhraseNormalizer.from_file()
+    return _normalizer
+
+
+def set_normalizer(normalizer):
+    global _normalizer
+    _normalizer = normalizer
+
+
+# Hours which move to the afternoon or the evening after each period word, e.g. 9 giờ tối -> 21:00
+PERIOD_SHIFTS = {
+    "sáng": range(0),
+    "trưa": range(1, 5),
+    "chiều": range(1, 12),
+    "tối": range(1, 12),
+    "đêm": range(6, 12),
+    "khuya": range(6, 12),
+}
+# Periods where 12 giờ is midnight
+MIDNIGHT_PERIODS = ["đêm", "khuya"]
+
+# A time in the normalized question, the canonical H:MM (or window, see read_time_window) and where its token is
+TimeExpression = namedtuple("TimeExpression", ["time", "start", "end"])
+
+# Words before a time which make it a window of times: before, after, and từ <time> đến <time>
+WINDOW_PREFIX = re.compile(r"(?<!\w)(trước|sau|từ)\s+$")
+WINDOW_BETWEEN = re.compile(r"\s+đến\s+")
+PREPOSITION = re.compile(r"(?<!\w)(từ|đến)(?!\w)")
+# The one word a window is written as, so the segmenter keeps it whole, e.g. trước_20:00 or từ_8:00_đến_10:00
+WINDOW_WORD = re.compile(r"(?:(?P<side>trước|sau)_(?P<time>\d{1,2}:\d{2}))|(?:từ_(?P<start>\d{1,2}:\d{2})_đến_(?P<end>\d{1,2}:\d{2}))")
+
+
+def read_time_window(word):
+    """
+    :param word: a word of the segmented question, e.g. trước_20:00, sau_18:00 or từ_8:00_đến_10:00
+    :return: the window as written in the logical form, <20:00, >18:00 or 8:00..10:00, None for other words
+    """
+    match = WINDOW_WORD.fullmatch(word)
+    if match is None:
+        return None
+    if match.group("side") is not None:
+        return ("<" if match.group("side") == "trước" else ">") + match.group("time")
+    return match.group("start") + ".." + match.group("end")
+
+
+def time_bounds(time):
+    # The first and last minute of a time or a window of the logical form, None for an open end
+    def minutes(text):
+        hour, minute = text.split(":")
+        return int(hour) * 60 + int(minute)
+    if time.startswith("<"):
+        return None, minutes(time[1:]) - 1
+    if time.startswith(">"):
+        return minutes(time[1:]) + 1, None
+    if ".." in time:
+        start, end = time.split("..")
+        return minutes(start), minutes(end)
+    return minutes(time), minutes(time)
+
+
+def intersect_times(time, other):
+    """
+    Both times of one departure or arrival hold, e.g. "sau 18 giờ và trước 21 giờ"
+    :param time: a time or a window of the logical form, e.g. 20:00, <20:00, >18:00 or 8:00..10:00
+    :return: the times in both, in the same form, e.g. >18:00 and <21:00 give 18:01..20:59.
+    A window which ends before it starts, such as 21:00..20:00, when there are none
+    """
+    def text(minutes):
+        return str(minutes // 60) + ":" + str(minutes % 60).zfill(2)
+    (start, end), (other_start, other_end) = time_bounds(time), time_bounds(other)
+    start = other_start if start is None else start if other_start is None else max(start, other_start)
+    end = other_end if end is None else end if other_end is None else min(end, other_end)
+    if start is None:
+        return "<" + text(end + 1)
+    if end is None:
+        return ">" + text(start - 1)
+    if start == end:
+        return text(start)
+    return text(start) + ".." + text(end)
+
+
+class TimeNormalizer:
+    """
+    Rewrite the time expressions of a question into the H:MM form of the timetable in one pass,
+    e.g. "9 hr rưỡi tối" -> "21:30 hr", "10 hr sáng" -> "10:00 hr", "18:30 hr" -> "18:30 hr".
+    A window of times becomes one word after "lúc", e.g. "đến huế trước 20:00" -> "đến huế lúc trước_20:00 hr",
+    "từ 8 hr đến 10 hr" -> "lúc từ_8:00_đến_10:00 hr". The window belongs to the "từ" or "đến" before it,
+    without one it is a departure time.
+    Runs after the PhraseNormalizer, which has turned "giờ" into "hr".
+    """
+
+    def __init__(self, period_shifts=PERIOD_SHIFTS):
+        self.period_shifts = period_shifts
+        periods = "|".join(sorted((re.escape(period) for period in period_shifts), key=len, reverse=True))
+        self.pattern = re.compile(
+            r"(?<![\w:])(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?"
+            r"(?:\s*(?P<hr>hr)\b(?:\s+(?:(?P<half>rưỡi)|(?P<minutes>\d{1,2})(?:\s+phút)?))?)?"
+            r"(?:\s+(?P<period>" + periods + r"))?(?!\w)")
+
+    def canonical_time(self, match, bare=False):
+        """
+        :param bare: take a bare hour or H:MM as a time, as in "trước 20" or "từ 8 đến 10:30"
+        :return: the H:MM of a match of the pattern, None if it is not a time or not a valid one
+        """
+        hr, period = match.group("hr"), match.group("period")
+        # Elsewhere a bare number is not a time, a bare H:MM is left as it is
+        if hr is None and period is None and not bare:
+            return None
+        hour = int(match.group("hour"))
+        minute = match.group("minute") or match.group("minutes")
+        minute = 30 if match.group("half") else int(minute or 0)
+        if period is not None:
+            if hour in self.period_shifts[period]:
+                hour += 12
+            elif hour == 12 and period in MIDNIGHT_PERIODS:
+                hour = 0
+        if hour > 24 or minute > 59:
+            return None
+        return str(hour) + ":" + str(minute).zfill(2)
+
+    def find(self, text):
+        """
+        Normalize the times of the text
+        :return: the new text and the TimeExpression of each time, with its span in the new text
+        """
+        parts = []
+        expressions = []
+        last = length = 0
+        matches = list(self.pattern.finditer(text))
+        idx = 0
+        while idx < len(matches):
+            match = matches[idx]
+            idx += 1
+            start, end = match.start(), match.end()
+            time = window = None
+            prefix = WINDOW_PREFIX.search(text, last, start)
+            if prefix is not None and prefix.group(1) != "từ":
+                time = self.canonical_time(match, bare=True)
+                if time is not None:
+                    window = ("<" if prefix.group(1) == "trước" else ">") + time
+            elif prefix is not None and idx < len(matches) \
+                    and WINDOW_BETWEEN.fullmatch(text, end, matches[idx].start()):
+                time, until = self.canonical_time(match, bare=True), self.canonical_time(matches[idx], bare=True)
+                if time is not None and until is not None:
+                    window = time + ".." + until
+                    end = matches[idx].end()
+                    idx += 1
+            if window is not None:
+                start = prefix.start()
+                # The grammar only relates a time to a preposition through "lúc"
+                lead = "lúc " if PREPOSITION.search(text, 0, start) else "từ lúc "
+                word = lead + ("trước_" + time if window[0] == "<" else "sau_" + time if window[0] == ">"
+                               else "từ_" + window.replace("..", "_đến_"))
+            else:
+                time = self.canonical_time(match)
+                if time is None:
+                    continue
+                lead = ""
+                word = window = time
+            parts.append(text[last:start])
+            length += start - last
+            # The grammar relates the time to the "hr" which follows it
+            parts.append(word + " hr")
+            expressions.append(TimeExpression(window, length + len(lead), length + len(word)))
+            length += len(word) + 3
+            last = end
+        parts.append(text[last:])
+        return "".join(parts), expressions
+
+    def normalize(self, text):
+        return self.find(text)[0]
+
+    def __call__(self, text):
+        return self.normalize(text)
+
+
+_time_normalizer = None
+
+
+def get_time_normalizer():
+    global _time_normalizer
+    if _time_normalizer is None:
+        _time_normalizer = TimeNormalizer()
+    return _time_normalizer
@@ -0,0 +1,125 @@
+import threading
+import time
+
+OUTPUT_PATH = "../Assignment/Output/"
+# a: parsing, b: arcs, c: grammar relation, d: logical form, e: procedure form, f: answers
+STAGES = ["a", "b", "c", "d", "e", "f"]
+
+
+class _StageStream:
+    # File-like object for print(..., file=...), writes go to the buffer of the sink
+    def __init__(self, sink, stage):
+        self.sink = sink
+        self.stage = stage
+
+    def write(self, text):
+        self.sink.write(self.stage, text)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class OutputSink:
+    """
+    The output files of a run, opened once and written through buffers.
+    A stage's buffer is written out when it grows over buffer_size or every flush_interval seconds.
+    """
+
+    def __init__(self, path=OUTPUT_PATH, stages=STAGES, mode='w', buffer_size=64 * 1024, flush_interval=1.0):
+        """
+        :param path: folder of the output_<stage>.txt files
+        :param stages: stages to write, the output of the others is dropped
+        :param mode: 'w' to start the files again, 'a' to add to them
+        """
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._files = {}
+        self._buffers = {}
+        self._sizes = {}
+        self._streams = {}
+        for stage in stages:
+            if stage not in STAGES:
+                raise ValueError("Unknown output stage: " + str(stage))
+            self._files[stage] = open(path + "output_" + stage + ".txt", mode)
+            self._buffers[stage] = []
+            self._sizes[stage] = 0
+            self._streams[stage] = _StageStream(self, stage)
+        self._last_flush = time.monotonic()
+
+    def enabled(self, stage):
+        return stage in self._files
+
+    def stream(self, stage):
+        """
+        :return: a file-like object for the stage, None if the stage is turned off
+        """
+        return self._streams.get(stage)
+
+    def write(self, stage, text):
+        if stage not in self._files:
+            return
+        with self._lock:
+            self._buffers[stage].append(text)
+            self._sizes[stage] += len(text)
+            if self._sizes[stage] >= self.buffer_size:
+                self._write_out(stage)
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_all()
+
+    def _write_out(self, stage):
+        if self._buffers[stage]:
+            self._files[stage].write("".join(self._buffers[stage]))
+            self._buffers[stage] = []
+            self._sizes[stage] = 0
+
+    def _flush_all(self):
+        for stage in self._files:
+            self._write_out(stage)
+            self._files[stage].flush()
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flush_all()
+
+    def close(self):
+        with self._lock:
+            if not self._files:
+                return
+            self._flush_all()
+            for file in self._files.values():
+                file.close()
+            self._files = {}
+            self._streams = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class MemorySink:
+    """
+    Keeps the output of the stages in memory, e.g. in a worker process until the parent writes it
+    """
+
+    def __init__(self, stages=STAGES):
+        self._buffers = {stage: [] for stage in stages}
+        self._streams = {stage: _StageStream(self, stage) for stage in stages}
+
+    def enabled(self, stage):
+        return stage in self._buffers
+
+    def stream(self, stage):
+        return self._streams.get(stage)
+
+    def write(self, stage, text):
+        if stage in self._buffers:
+            self._buffers[stage].append(text)
+
+    def getvalues(self):
+        # stage -> text written so far
+        return {stage: "".join(parts) for stage, parts in self._buffers.items()}
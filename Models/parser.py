@@ -1,13 +1,33 @@
-from vncorenlp import VnCoreNLP
 import os
 import re
-
-pathToJar = "../Assignment/VnCoreNLP-1.1.1.jar"
-annotator = VnCoreNLP(pathToJar, annotators="wseg", max_heap_size='-Xmx2g')
+import sys
+import threading
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+from itertools import islice
+
+from Models.artifact import open_artifact, write_artifact, ARTIFACT_PATH
+from Models.cache import AnswerCache
+from Models.cities import CityTable, get_city_table, set_city_table, CITY_CODES_PATH
+from Models.knowledge_base import BusKnowledgeBase, get_knowledge_base, set_knowledge_base, DATA_PATH
+from Models.normalizer import PhraseNormalizer, FIXED_RULES, get_normalizer, set_normalizer, get_time_normalizer, \
+    read_time_window, intersect_times, EQUIVALENT_PATH
+from Models.output import MemorySink, STAGES
+from Models.segmenter import get_segmenter
+from Models.metrics import Metrics, no_stage
+from Models.logical_form import LogicalForm, Agent, Source, Destination, Leave, Arrive, RunTime, WH_NAME, WH_TIME, \
+    is_wh
+from Models.query import evaluate, compile_plan, time_term, Goal, Line, Procedure
+
+RELATIONS_PATH = "../Assignment/Models/relations.txt"
+CITY_PATH = "../Assignment/Models/city.txt"
+BUS_NAME_PATH = "../Assignment/Models/BusName.txt"
 
 
 class Relation:
     # A relation arc of left -> right
+    __slots__ = ("left", "right", "relation_name")
+
     def __init__(self, left, relation_name, right):
         self.left = left
         self.right = right
@@ -21,13 +41,215 @@ class Relation:
 
 
 class Configuration:
+    # The buffer is the words from cursor on, moving the cursor replaces copying the list
+    __slots__ = ("stack", "words", "cursor", "arcs", "arc_pairs", "dependents")
+
     def __init__(self, stack, buffer, arcs):
         self.stack = stack
-        self.buffer = buffer
+        # Interned, so the many lookups of a word compare it by identity
+        self.words = [sys.intern(word) for word in buffer]
+        self.cursor = 0
         self.arcs = arcs
+        # (left, right) of the arcs already made, for constant time checks
+        self.arc_pairs = set((arc.left, arc.right) for arc in arcs)
+        # Words which already have a head
+        self.dependents = set(arc.right for arc in arcs)
+
+    @property
+    def buffer(self):
+        # The words not read yet, as a new list
+        return self.words[self.cursor:]
+
+    def buffer_empty(self):
+        return self.cursor >= len(self.words)
+
+    def front(self):
+        return self.words[self.cursor]
+
+    def advance(self):
+        self.cursor += 1
+
+    def add_arc(self, arc):
+        self.arcs.append(arc)
+        self.arc_pairs.add((arc.left, arc.right))
+        self.dependents.add(arc.right)
+
+    def has_head(self, word):
+        return word in self.dependents
+
+
+class Grammar:
+    """
+    The relations of relations.txt, compiled into hash indexes
+    """
+
+    def __init__(self, relations, city_set):
+        # (head, dependent) -> (line number, relation), the first line wins as in a scan of the file
+        self.relations = {}
+        # Reverse indexes: word -> relations where it is the head / the dependent
+        self.by_head = {}
+        self.by_dependent = {}
+        for idx, relation in enumerate(relations):
+            if (relation.left, relation.right) in self.relations:
+                continue
+            self.relations[(relation.left, relation.right)] = (idx, relation)
+            self.by_head.setdefault(relation.left, []).append(relation)
+            self.by_dependent.setdefault(relation.right, []).append(relation)
+        self.city_set = set(city_set)
+        self._oracle = None
+
+    def find(self, w_i, w_j):
+        """
+        Find the relation between two words, in either direction
+        :return: (relation, True) for w_i -> w_j, (relation, False) for w_j -> w_i, None if unrelated
+        """
+        right = self.relations.get((w_i, w_j))
+        left = self.relations.get((w_j, w_i))
+        if right is not None and (left is None or right[0] < left[0]):
+            return right[1], True
+        if left is not None:
+            return left[1], False
+        return None
+
+    def oracle(self):
+        # The transition table of this grammar, compiled on first use
+        if self._oracle is None:
+            self._oracle = ParsingOracle(self)
+        return self._oracle
+
+    @staticmethod
+    def read_relations(relations_path=RELATIONS_PATH):
+        relations = []
+        with open(relations_path, 'r') as file1:
+            for line1 in file1:
+                if line1.strip() == "":
+                    continue
+                relate, left_val, right_val = line1.split()
+                relations.append(Relation(left_val, relate, right_val))
+        return relations
+
+    @staticmethod
+    def read_cities(city_path=CITY_PATH):
+        with open(city_path, 'r') as file2:
+            return file2.read().splitlines()
+
+    @classmethod
+    def from_files(cls, relations_path=RELATIONS_PATH, city_path=CITY_PATH):
+        return cls(cls.read_relations(relations_path), cls.read_cities(city_path))
+
+
+_grammar = None
+
+
+def get_grammar():
+    # relations.txt and city.txt are only read on first use
+    global _grammar
+    if _grammar is None:
+        _grammar = Grammar.from_files()
+    return _grammar
+
+
+_bus_names = None
+
+
+def read_bus_names(path=BUS_NAME_PATH):
+    with open(path, 'r') as file:
+        return file.read().splitlines()
+
+
+def get_bus_names():
+    # BusName.txt is only read on first use
+    global _bus_names
+    if _bus_names is None:
+        _bus_names = set(read_bus_names())
+    return _bus_names
+
+
+# Everything read from the files of Models, the version changes with every swap_models
+ModelSnapshot = namedtuple("ModelSnapshot", ["version", "knowledge_base", "grammar", "bus_names", "normalizer",
+                                             "city_table"])
+
+# The latest snapshot, made from the getters on first use
+_models = None
+_models_version = 0
+_models_lock = threading.Lock()
+# The snapshot of the questions being answered by each thread, see pinned_models
+_pinned = threading.local()
+
+
+def check_cities(grammar, city_table):
+    # A city of city.txt without a code would be asked for as any city, so the models are not used
+    missing = sorted(city for city in grammar.city_set if city_table.encode(city) is None)
+    if missing:
+        raise ValueError("cities of " + CITY_PATH + " without a code in " + CITY_CODES_PATH + ": " + ", ".join(missing))
+
+
+def current_models():
+    """
+    :return: the ModelSnapshot pinned by the questions this thread is answering, else the latest one
+    """
+    global _models
+    snapshot = getattr(_pinned, "snapshot", None)
+    if snapshot is not None:
+        return snapshot
+    snapshot = _models
+    if snapshot is None:
+        with _models_lock:
+            check_cities(get_grammar(), get_city_table())
+            snapshot = _models = ModelSnapshot(_models_version, get_knowledge_base(), get_grammar(), get_bus_names(),
+                                               get_normalizer(), get_city_table())
+    return snapshot
+
+
+@contextmanager
+def pinned_models():
+    """
+    Answer the questions of this block with the models of now, a swap_models during the block
+    only applies to the questions after it
+    """
+    if getattr(_pinned, "snapshot", None) is not None:
+        # Already pinned by an outer block
+        yield _pinned.snapshot
+        return
+    _pinned.snapshot = current_models()
+    try:
+        yield _pinned.snapshot
+    finally:
+        _pinned.snapshot = None
+
+
+def swap_models(knowledge_base=None, grammar=None, bus_names=None, normalizer=None, city_table=None):
+    """
+    Install reloaded models at once, the ones left None are kept.
+    The cached answers are dropped, the questions already being answered finish with the old models.
+    Nothing is installed, and ValueError is raised, if a city of the grammar would be left without a code.
+    :return: the new ModelSnapshot
+    """
+    global _grammar, _bus_names, _models, _models_version
+    with _models_lock:
+        check_cities(grammar if grammar is not None else get_grammar(),
+                     city_table if city_table is not None else get_city_table())
+        if knowledge_base is not None:
+            set_knowledge_base(knowledge_base)
+        if grammar is not None:
+            _grammar = grammar
+        if bus_names is not None:
+            _bus_names = set(bus_names)
+        if normalizer is not None:
+            set_normalizer(normalizer)
+        if city_table is not None:
+            set_city_table(city_table)
+        _models_version += 1
+        _models = ModelSnapshot(_models_version, get_knowledge_base(), get_grammar(), get_bus_names(),
+                                get_normalizer(), get_city_table())
+    if answer_cache is not None:
+        answer_cache.invalidate()
+    return _models
 
 
 class Token():
+    __slots__ = ("type", "word", "children")
+
     def __init__(self, word, type):
         self.type = type
         self.word = word
@@ -59,114 +281,292 @@ class Token():
                 return ""
 
 
+TRACE_OFF = "off"
+TRACE_SUMMARY = "summary"
+TRACE_FULL = "full"
+TRACE_LEVELS = [TRACE_OFF, TRACE_SUMMARY, TRACE_FULL]
+
+# Trace level used by parsing when none is given
+default_trace_level = TRACE_OFF
+
+
+def set_trace_level(level):
+    global default_trace_level
+    if level not in TRACE_LEVELS:
+        raise ValueError("Unknown trace level: " + str(level))
+    default_trace_level = level
+
+
+class ParseTrace:
+    """
+    The derivation of one sentence.
+    Transitions are kept as small events, the table is only formatted by render.
+    """
+
+    def __init__(self, words, level=TRACE_FULL):
+        self.level = level
+        self.words = list(words)
+        # (transition name, action label, arc added or None)
+        self.events = []
+        self.counts = {}
+
+    def record(self, transition, label, arc=None):
+        if self.level == TRACE_OFF:
+            return
+        self.counts[transition] = self.counts.get(transition, 0) + 1
+        if self.level == TRACE_FULL:
+            self.events.append((transition, label, arc))
+
+    @staticmethod
+    def _row(label, stack, buffer, arcs):
+        return f"{label:<25}  {'[' + ', '.join(item for item in stack) + ']':<40} {'[' + ', '.join(item for item in buffer) + ']':<100} {'[' + ', '.join(str(arc) for arc in arcs) + ']'}"
+
+    def render(self, final_arcs=None):
+        """
+        The text written to output_a.txt
+        :param final_arcs: arcs of the finished parse, shown by the summary
+        """
+        if self.level == TRACE_OFF:
+            return ""
+        if self.level == TRACE_SUMMARY:
+            counts = ", ".join(name + " " + str(count) for name, count in self.counts.items())
+            line = f"{len(self.words)} words, {sum(self.counts.values())} transitions ({counts})"
+            if final_arcs is not None:
+                line += ": " + ", ".join(str(arc) for arc in final_arcs)
+            return line + "\n"
+        # Replay the transitions to get the configuration after each of them
+        stack = ['root']
+        buffer_idx = 0
+        arcs = []
+        rows = [f"{'ACTION ':<25}  {'STACK':<40} {'BUFFER':<100} {'ARCS'}",
+                self._row("", stack, self.words, arcs)]
+        for transition, label, arc in self.events:
+            if transition == "left_arc":
+                stack.pop()
+            elif transition == "right_arc_star":
+                buffer_idx += 1
+            elif transition in ["right_arc", "shift"]:
+                stack.append(self.words[buffer_idx])
+                buffer_idx += 1
+            elif transition == "reduce":
+                stack.pop()
+            if arc is not None:
+                arcs.append(arc)
+            rows.append(self._row(label, stack, self.words[buffer_idx:], arcs))
+        return "\n".join(rows) + "\n\n\n"
+
+
 class Transition:
 
     @staticmethod
-    def left_arc(conf, relation, file=None):
+    def left_arc(conf, relation, trace=None):
         """
         Add dependency relation (w_j, relation, w_i), pop stack
         :param conf: the current configuration, it has 3 elements: stack, buffer, arcs
         :param relation: the relation to be added
+        :param trace: the ParseTrace recording the derivation, if any
         """
         # Precondition: Neither the buffer nor the stack is empty
-        if not conf.buffer or not conf.stack:
+        if conf.buffer_empty() or not conf.stack:
             return -1
         # Precondition: The word on top of the stack is not the root
         elif not conf.stack[-1]:
             return -1
 
-        w_j = conf.buffer[0]
+        w_j = conf.front()
         w_i = conf.stack.pop()
 
-        conf.arcs.append(Relation(w_j, relation, w_i))
-        print(
-            f"{'Left arc ' + relation:<25}  {'[' + ', '.join(item for item in conf.stack) + ']':<40} {'[' + ', '.join(item for item in conf.buffer) + ']':<100} {'[' + ', '.join(str(arc) for arc in conf.arcs) + ']'}",
-            file=file)
+        conf.add_arc(Relation(w_j, relation, w_i))
+        if trace is not None:
+            trace.record("left_arc", "Left arc " + relation, conf.arcs[-1])
 
     @staticmethod
-    def right_arc_star(conf, relation, file=None):
+    def right_arc_star(conf, relation, trace=None):
         """
         Add dependency relation (w_i, relation, w_j), reduce buffer
         :param conf: the current configuration, it has 3 elements: stack, buffer, arcs
         :param relation: the relation to be added
+        :param trace: the ParseTrace recording the derivation, if any
         """
-        w_j = conf.buffer[0]
+        w_j = conf.front()
         w_i = conf.stack[-1]
 
-        conf.buffer = conf.buffer[1:]
-        conf.arcs.append(Relation(w_i, relation, w_j))
-        print(
-            f"{'Right arc star ' + relation:<25}  {'[' + ', '.join(item for item in conf.stack) + ']':<40} {'[' + ', '.join(item for item in conf.buffer) + ']':<100} {'[' + ', '.join(str(arc) for arc in conf.arcs) + ']'}",
-            file=file)
+        conf.advance()
+        conf.add_arc(Relation(w_i, relation, w_j))
+        if trace is not None:
+            trace.record("right_arc_star", "Right arc star " + relation, conf.arcs[-1])
 
     @staticmethod
-    def right_arc(conf, relation, file=None):
+    def right_arc(conf, relation, trace=None):
         """
         Add dependency relation (w_i, relation, w_j), append stack, reduce buffer
         :param conf: the current configuration, it has 3 elements: stack, buffer, arcs
         :param relation: the relation to be added
+        :param trace: the ParseTrace recording the derivation, if any
         """
         # Precondition: Neither the buffer nor the stack is empty
-        if not conf.buffer or not conf.stack:
+        if conf.buffer_empty() or not conf.stack:
             return -1
         w_i = conf.stack[-1]
-        w_j = conf.buffer[0]
+        w_j = conf.front()
         conf.stack.append(w_j)
-        conf.buffer = conf.buffer[1:]
-        conf.arcs.append(Relation(w_i, relation, w_j))
-        print(
-            f"{'Right arc ' + relation:<25}  {'[' + ', '.join(item for item in conf.stack) + ']':<40} {'[' + ', '.join(item for item in conf.buffer) + ']':<100} {'[' + ', '.join(str(arc) for arc in conf.arcs) + ']'}",
-            file=file)
+        conf.advance()
+        conf.add_arc(Relation(w_i, relation, w_j))
+        if trace is not None:
+            trace.record("right_arc", "Right arc " + relation, conf.arcs[-1])
 
     @staticmethod
-    def shift(conf, file=None):
+    def shift(conf, trace=None):
         """
         Push first element in buffer on to the stack
          :param conf: the current configuration, it has 3 elements: stack, buffer, arcs
+        :param trace: the ParseTrace recording the derivation, if any
         """
 
-        conf.stack.append(conf.buffer[0])
-        conf.buffer = conf.buffer[1:]
-        print(
-            f"{'Shift ':<25}  {'[' + ', '.join(item for item in conf.stack) + ']':<40} {'[' + ', '.join(item for item in conf.buffer) + ']':<100} {'[' + ', '.join(str(arc) for arc in conf.arcs) + ']'}",
-            file=file)
+        conf.stack.append(conf.front())
+        conf.advance()
+        if trace is not None:
+            trace.record("shift", "Shift ")
 
     @staticmethod
-    def reduce(conf, file=None):
+    def reduce(conf, trace=None):
         """
         Pop last element of the stack
         :param conf: the current configuration, it has 3 elements: stack, buffer, arcs
+        :param trace: the ParseTrace recording the derivation, if any
         """
 
         # Precondition: The last element must be independent on other words
-        if conf.stack[-1] not in [ele.right for ele in conf.arcs]:
+        if not conf.has_head(conf.stack[-1]):
             return -1
         conf.stack.pop()
-        print(
-            f"{'Reduce ':<25}  {'[' + ', '.join(item for item in conf.stack) + ']':<40} {'[' + ', '.join(item for item in conf.buffer) + ']':<100} {'[' + ', '.join(str(arc) for arc in conf.arcs) + ']'}",
-            file=file)
+        if trace is not None:
+            trace.record("reduce", "Reduce ")
+
+
+class ParsingOracle:
+    """
+    The decisions of the parser compiled from the grammar, one table lookup per step.
+    Words are mapped to classes: every word of the grammar has its own class, except the times which share one
+    for each set of relations they have, the other cities share one, a time or a window of times the grammar does
+    not list takes the class of most times and all other words share class 0.
+    """
+    PREPOSITIONS = ["từ", "đến"]
+    # A time of the normalized question, e.g. 20:15, the grammar only lists the hours and half hours
+    TIME_WORD = re.compile(r"\d{1,2}:\d{2}")
+
+    def __init__(self, grammar):
+        words = set(grammar.by_head) | set(grammar.by_dependent)
+        self.word_class = {}
+        # Relations of a time -> the class of the times with exactly these relations
+        time_classes = {}
+        time_counts = {}
+        for word in sorted(words):
+            if self.TIME_WORD.fullmatch(word):
+                key = self._time_relations(grammar, word)
+                if key not in time_classes:
+                    time_classes[key] = len(self.word_class) + 1
+                self.word_class[word] = time_classes[key]
+                time_counts[key] = time_counts.get(key, 0) + 1
+            else:
+                self.word_class[word] = len(self.word_class) + 1
+        self.time_class = None
+        if time_classes:
+            self.time_class = time_classes[max(time_counts, key=time_counts.get)]
+        city_class = len(self.word_class) + 1
+        for word in grammar.city_set - words:
+            self.word_class[word] = city_class
+        self.size = city_class + 1
+        # Class of w_j -> True if it has a relation at all
+        self.related = [False] * self.size
+        # Flat tables indexed by class(w_i) * size + class(w_j):
+        # arcs gives (transition, relation name, preposition to count) when an arc is added between w_i and w_j,
+        # hidden gives (w_i is the head, head is a preposition) when a word deeper in the stack is related to w_j
+        self.arcs = [None] * (self.size * self.size)
+        self.hidden = [None] * (self.size * self.size)
+        for left, right in grammar.relations:
+            for w_i, w_j in [(left, right), (right, left)]:
+                self._compile(grammar, w_i, w_j)
+
+    @staticmethod
+    def _time_relations(grammar, word):
+        # What the oracle compiles for a time: the relation found with every word related to it
+        related = [relation.right for relation in grammar.by_head.get(word, [])]
+        related += [relation.left for relation in grammar.by_dependent.get(word, [])]
+        found = set()
+        for other in related:
+            relation, is_right = grammar.find(word, other)
+            found.add((other, relation.relation_name, is_right))
+        return frozenset(found)
+
+    def _compile(self, grammar, w_i, w_j):
+        c_i = self.word_class[w_i]
+        c_j = self.word_class[w_j]
+        self.related[c_j] = True
+        relation, is_right = grammar.find(w_i, w_j)
+        head = w_i if is_right else w_j
+        self.hidden[c_i * self.size + c_j] = (is_right, head in self.PREPOSITIONS)
+        # Exclude cases that this somewhat parsing the wrong order
+        # The order is like <from> <at> <to> <at>
+        if w_i in grammar.city_set or w_i in ["lúc", "lúc_nào"] and w_j in self.PREPOSITIONS:
+            return
+        counted = head if head in self.PREPOSITIONS else None
+        if not is_right:
+            self.arcs[c_i * self.size + c_j] = (Transition.left_arc, relation.relation_name, counted)
+        elif relation.relation_name == "nmod":
+            # This part is to solve N - N modifier in Vietnamese
+            self.arcs[c_i * self.size + c_j] = (Transition.right_arc_star, relation.relation_name, counted)
+        else:
+            self.arcs[c_i * self.size + c_j] = (Transition.right_arc, relation.relation_name, counted)
+
+    def classify(self, word):
+        # The class of a word the grammar does not list: any time, e.g. 20:15, and any window of times,
+        # e.g. trước_20:15 or từ_8:15_đến_10:00, are parsed as the times of the grammar
+        if self.time_class is not None and (self.TIME_WORD.fullmatch(word) or read_time_window(word) is not None):
+            return self.time_class
+        return 0
+
+    def sentence_classes(self, words):
+        """
+        :return: the class of every word of a sentence, word_class itself unless the sentence has an unlisted time
+        """
+        learned = {word: self.classify(word) for word in words if word not in self.word_class}
+        if not any(learned.values()):
+            return self.word_class
+        # A copy for this sentence only, so the table does not grow with every time asked
+        word_class = dict(self.word_class)
+        word_class.update(learned)
+        return word_class
 
 
 def city_name_encode(city_name):
-    if city_name == "hồ_chí_minh":
-        return "HCMC"
-    elif city_name == "hà_nội":
-        return "HN"
-    elif city_name == "đà_nẵng":
-        return "DANANG"
-    elif city_name == "huế":
-        return "HUE"
+    # See city_codes.txt
+    return current_models().city_table.encode(city_name)
 
 
 def city_name_decode(city_code):
-    if city_code == "HCMC":
-        return "Hồ Chí Minh"
-    elif city_code == "HN":
-        return "Hà Nội"
-    elif city_code == "DANANG":
-        return "Đà Nẵng"
-    elif city_code == "HUE":
-        return "Huế"
+    return current_models().city_table.decode(city_code)
+
+
+def time_pattern(predicate, place, time_point, place_variable, time_variable):
+    """
+    Merge the place and the time of a departure or an arrival into one pattern
+    :param predicate: DTIME or ATIME
+    :param place: the Source or Destination, None if not asked
+    :param time_point: the Leave or Arrive, None if not asked
+    :return: the Line, e.g. ?dp (DTIME ?tr ?dp ?dt), None if there is neither a place nor a time
+    """
+    if place is None and time_point is None:
+        return None
+    place_info = place_variable if place is None or is_wh(place.city) else city_name_encode(place.city)
+    time_info = time_variable if time_point is None or is_wh(time_point.time) else time_term(time_point.time)
+    marks = ()
+    # A merged pattern only carries the constants, the variable asked for is printed when it stands alone
+    if time_point is None and is_wh(place.city):
+        marks = (place_variable,)
+    elif place is None and is_wh(time_point.time):
+        marks = (time_variable,)
+    return Line(marks, Goal(predicate, ("?tr", place_info, time_info)))
 
 
 class ProcessText:
@@ -176,8 +576,58 @@ class ProcessText:
 
     @staticmethod
     def preprocessing(text):
+        return ProcessText.preprocess_batch([text])[0]
+
+    @staticmethod
+    def preprocess_batch(texts):
+        """
+        Preprocess many questions, the segmenter is called once for all of them
+        :param texts: list of questions
+        :return: list of segmented words for each question
+        """
+        stage = metrics.stage if metrics is not None else no_stage
+        normalized_texts = []
+        for text in texts:
+            with stage("normalize"):
+                normalized_texts.append(ProcessText.normalize(text))
+        # The segmenter is timed once for the batch, it is one round trip to the JVM
+        with stage("segmentation_batch"):
+            segmented_texts = get_segmenter().tokenize_batch(normalized_texts)
+        word_segmented_texts = []
+        for sentences in segmented_texts:
+            with stage("complete_sentence"):
+                word_segmented_texts.append(ProcessText.complete_sentence(sentences[0]))
+        return word_segmented_texts
+
+    @staticmethod
+    def normalize(text):
+        # Bring the question to a normal form before word segmentation
         text = text.lower()
 
+        # This part is made specially for the command "Thời gian .... " -> "... hết bao lâu?"
+        def changeCommandToQuestion(text):
+            if text.startswith("thời gian "):
+                # Erase that part and last character, then add the question suffix
+                text = text.replace("thời gian ", "")[:-1] + "hết bao lâu?"
+            return text
+
+        # Convert some word into normal form for easier to progress, see equivalent.txt
+        def textConvert(text_to_convert):
+            return current_models().normalizer.normalize(text_to_convert)
+
+        # Convert time in VNese to suitable form, see TimeNormalizer
+        def timeConvert(text_to_convert):
+            return get_time_normalizer().normalize(text_to_convert)
+
+        text = textConvert(text)
+        text = timeConvert(text)
+        text = changeCommandToQuestion(text)
+        return text
+
+    @staticmethod
+    def complete_sentence(word_segmented_text):
+        # Fix up the segmented words of a question so it can be parsed
+
         def isHaveVerb(text_list):
             # Only allow 1 word atm (đi)
             for check_word in text_list:
@@ -197,140 +647,6 @@ class ProcessText:
                 idx_to_add = getFistPrepIdx(text_list)
                 text_list.insert(idx_to_add, "đi")
 
-        # This part is made specially for the command "Thời gian .... " -> "... hết bao lâu?"
-        def changeCommandToQuestion(text):
-            if text.startswith("thời gian "):
-                # Erase that part and last character, then add the question suffix
-                text = text.replace("thời gian ", "")[:-1] + "hết bao lâu?"
-            return text
-
-        # Convert some word into normal form for easier to progress, the equivalent file is opened
-        def textConvert(text_to_convert):
-            dict_equiv = dict()
-            with open('../Assignment/Models/equivalent.txt', 'r') as file:
-                info = file.read().splitlines()
-                for line in info:
-                    rough_texts, normal_text = line.split("->")
-                    rough_text = rough_texts.split(',')
-                    for text_part in rough_text:
-                        dict_equiv.setdefault(text_part, normal_text)
-            if "bus" in text_to_convert:
-                text_to_convert = text_to_convert.replace("bus", "buýt")
-            if "city" in text_to_convert:
-                text_to_convert = text_to_convert.replace("city", "")
-            if "giờ" in text_to_convert:
-                text_to_convert = text_to_convert.replace("giờ", "hr")
-            if "chuyến xe buýt" in text_to_convert:
-                text_to_convert = text_to_convert.replace("chuyến xe buýt", "xe buýt")
-            elif "chuyến xe" in text_to_convert:
-                text_to_convert = text_to_convert.replace("chuyến xe", "xe buýt")
-            elif "chuyến buýt" in text_to_convert:
-                text_to_convert = text_to_convert.replace("chuyến buýt", "xe buýt")
-
-            for key in dict_equiv:
-                if key in text_to_convert:
-                    if key == "cố đô":
-                        if "cố đô huế" in text_to_convert:
-                            text_to_convert = text_to_convert.replace("cố đô huế", dict_equiv["cố đô huế"])
-                        else:
-                            text_to_convert = text_to_convert.replace(key, dict_equiv[key])
-                    else:
-                        text_to_convert = text_to_convert.replace(key, dict_equiv[key])
-            return text_to_convert
-
-        # Convert time in VNese to suitable form
-        def timeConvert(text_to_convert):
-            text_convert_split = text_to_convert.split()
-            for idx in range(len(text_convert_split)):
-                if text_convert_split[idx] == "hr":
-                    updated_time = main_time = ""
-                    if idx + 1 < len(text_convert_split):
-                        if text_convert_split[idx + 1] == "rưỡi":
-                            # Have ruoi
-                            text_to_convert = text_to_convert.replace("rưỡi", "")
-                            main_time = text_convert_split[idx - 1]
-
-                            # Have PM part
-                            if "chiều" in text_convert_split or "tối" in text_convert_split or "đêm" in text_convert_split:
-                                if "chiều" in text_to_convert:
-                                    text_to_convert = text_to_convert.replace("chiều", "")
-                                if "tối" in text_to_convert:
-                                    text_to_convert = text_to_convert.replace("tối", "")
-                                if "đêm" in text_to_convert:
-                                    text_to_convert = text_to_convert.replace("đêm", "")
-
-                                if ":" in main_time:
-                                    part = main_time.split(":")[0]
-                                    updated_time = str(int(part) + 12) + ":30"
-                                elif main_time.isdigit():
-                                    updated_time = str(int(main_time) + 12) + ":30"
-                            # Have AM part
-                            elif "sáng" in text_convert_split or "trưa" in text_convert_split:
-                                if "sáng" in text_to_convert:
-                                    text_to_convert = text_to_convert.replace("sáng", "")
-                                if "sáng" in text_to_convert:
-                                    text_to_convert = text_to_convert.replace("trưa", "")
-                                if ":" in main_time:
-                                    part = main_time.split(":")[0]
-                                    updated_time = part + ":30"
-                                elif main_time.isdigit():
-                                    updated_time = main_time + ":30"
-                            # Nothing
-                            else:
-                                if ":" in main_time:
-                                    part = main_time.split(":")[0]
-                                    updated_time = part + ":30"
-                                elif main_time.isdigit():
-                                    updated_time = main_time + ":30"
-                        else:
-                            # No ruoi
-                            main_time = text_convert_split[idx - 1]
-                            if "chiều" in text_convert_split or "tối" in text_convert_split or "đêm" in text_convert_split:
-                                if "chiều" in text_to_convert:
-                                    text_to_convert = text_to_convert.replace("chiều", "")
-                                if "tối" in text_to_convert:
-                                    text_to_convert = text_to_convert.replace("tối", "")
-                                if "đêm" in text_to_convert:
-                                    text_to_convert = text_to_convert.replace("đêm", "")
-
-                                if ":" in main_time:
-                                    part = main_time.split(":")[0]
-                                    updated_time = str(int(part) + 12) + ":00"
-                                elif main_time.isdigit():
-                                    updated_time = str(int(main_time) + 12) + ":00"
-                            elif "sáng" in text_convert_split or "trưa" in text_convert_split:
-                                if "sáng" in text_to_convert:
-                                    text_to_convert = text_to_convert.replace("sáng", "")
-                                if "sáng" in text_to_convert:
-                                    text_to_convert = text_to_convert.replace("trưa", "")
-                                if ":" in main_time:
-                                    part = main_time.split(":")[0]
-                                    updated_time = part + ":00"
-                                elif main_time.isdigit():
-                                    updated_time = main_time + ":00"
-                            else:
-                                if ":" in main_time:
-                                    part = main_time.split(":")[0]
-                                    updated_time = part + ":00"
-                                elif main_time.isdigit():
-                                    updated_time = main_time + ":00"
-
-                    else:
-                        # This part to prevent bugs
-                        if ":" in main_time:
-                            part = main_time.split(":")[0]
-                            updated_time = part + ":00"
-                        elif main_time.isdigit():
-                            updated_time = main_time + ":00"
-
-                    text_to_convert = text_to_convert.replace(main_time, updated_time)
-            return text_to_convert
-
-        text = textConvert(text)
-        text = timeConvert(text)
-        text = changeCommandToQuestion(text)
-        word_segmented_text = annotator.tokenize(text)
-        word_segmented_text = word_segmented_text[0]
         # Check if given sentences have a real main verb and add it to the sentence
         addRealVerb(word_segmented_text)
         # remove useless "thành phố" verb which may cause trouble parsing
@@ -339,114 +655,84 @@ class ProcessText:
         return word_segmented_text
 
     @staticmethod
-    def parsing(word_segmented_text):
-        relations_set = []
-        city_set = []
+    def parsing(word_segmented_text, grammar=None, trace_level=None, sink=None):
+        if grammar is None:
+            grammar = current_models().grammar
+        if trace_level is None:
+            trace_level = default_trace_level
+        oracle = grammar.oracle()
+        arcs, hidden, related, size = oracle.arcs, oracle.hidden, oracle.related, oracle.size
+        word_class = oracle.sentence_classes(word_segmented_text)
         connected_arc = {'từ': 0, 'đến': 0}
 
-        with open('../Assignment/Models/relations.txt', 'r') as file1:
-            for line1 in file1:
-                relate, left_val, right_val = line1.split()
-                relations_set.append(Relation(left_val, relate, right_val))
-
-        with open('../Assignment/Models/city.txt', 'r') as file2:
-            city_set = file2.read().splitlines()
-
-        file_parsing = open("../Assignment/Output/output_a.txt", 'a')
+        file_parsing = sink.stream("a") if sink is not None else None
+        file_arcs = sink.stream("b") if sink is not None else None
 
-        file_arcs = open("../Assignment/Output/output_b.txt", 'a')
-
-        print(
-            f"{'ACTION ':<25}  {'STACK':<40} {'BUFFER':<100} {'ARCS'}",
-            file=file_parsing)
         sentence_conf = Configuration(['root'], word_segmented_text, [])
-        print(
-            f"{'':<25}  {'[' + ', '.join(item for item in sentence_conf.stack) + ']':<40} {'[' + ', '.join(item for item in sentence_conf.buffer) + ']':<100} {'[' + ', '.join(str(arc) for arc in sentence_conf.arcs) + ']'}",
-            file=file_parsing)
+        # Nobody reads the derivation if output_a is turned off
+        if file_parsing is None:
+            trace_level = TRACE_OFF
+        trace = ParseTrace(word_segmented_text, trace_level) if trace_level != TRACE_OFF else None
+        transitions = 0
         while 1:
             # Begin parsing
-            if len(sentence_conf.buffer) == 0:
+            if sentence_conf.buffer_empty():
                 # Complete parsing and write to files
-                print("\n", file=file_parsing)
-                print(", ".join(str(arc) for arc in sentence_conf.arcs) + "\n", file=file_arcs)
+                if trace is not None:
+                    print(trace.render(sentence_conf.arcs), file=file_parsing, end="")
+                if file_arcs is not None:
+                    print(", ".join(str(arc) for arc in sentence_conf.arcs) + "\n", file=file_arcs)
+                if metrics is not None:
+                    metrics.count("parser_transitions", transitions)
 
                 return sentence_conf.arcs
+            transitions += 1
             # As of now, i should only consider on tail and head of these instance
             w_i = sentence_conf.stack[-1]
-            w_j = sentence_conf.buffer[0]
-
-            # Loop through all elements of the set to find relations
-            right_rel = None
-            left_rel = None
-            for relation in relations_set:
-                if Relation(w_i, "", w_j) == relation:
-                    right_rel = relation
-                    if w_i in city_set or w_i in ["lúc", "lúc_nào"] and w_j in ["từ", "đến"]:
-                        right_rel = None
-                    if right_rel is not None:
-                        if w_i in ['từ', 'đến']:
-                            connected_arc[w_i] += 1
-                    break
-                elif Relation(w_j, "", w_i) == relation:
-                    left_rel = relation
-                    # Exclude cases that this somewhat parsing the wrong order
-                    # The order is like <from> <at> <to> <at>
-                    if w_i in city_set or w_i in ["lúc", "lúc_nào"] and w_j in ["từ", "đến"]:
-                        left_rel = None
-                    if left_rel is not None:
-                        if w_j in ['từ', 'đến']:
-                            connected_arc[w_j] += 1
-                    break
-            # If there is no relation between tail and head, the buffer still have elements, shift
-            if right_rel is None and left_rel is None:
-                # We should check if w_j have some relation ship with some elements in stack, going down from tail,
-                # not including root
-                have_hidden_arc = False
-                for word in reversed(sentence_conf.stack[:-1]):
-                    for relation in relations_set:
-                        if Relation(word, "", w_j) == relation:
-                            have_hidden_arc = True
-                            # Check if the relation is already featured in the arcs
-                            for featured in sentence_conf.arcs:
-                                if Relation(word, "", w_j) == featured:
-                                    have_hidden_arc = False
-                            # I think most P should only have 2 connected arcs at most
-                            if word in ['từ', 'đến']:
-                                if connected_arc[word] >= 2:
-                                    have_hidden_arc = False
-                            break
-                        elif Relation(w_j, "", word) == relation:
-                            have_hidden_arc = True
-                            for featured in sentence_conf.arcs:
-                                if Relation(w_j, "", word) == featured:
-                                    have_hidden_arc = False
-                            if w_j in ['từ', 'đến']:
-                                if connected_arc[w_j] >= 2:
-                                    have_hidden_arc = False
-                            break
-                if have_hidden_arc:
-                    # Experience-based reduce
-                    Transition.reduce(sentence_conf, file_parsing)
-                else:
-                    Transition.shift(sentence_conf, file_parsing)
+            w_j = sentence_conf.front()
+            class_j = word_class.get(w_j, 0)
+
+            # Look up the transition between tail and head
+            action = arcs[word_class.get(w_i, 0) * size + class_j]
+            if action is not None:
+                transition, relation_name, counted = action
+                if counted is not None:
+                    connected_arc[counted] += 1
+                if transition(sentence_conf, relation_name, trace) != -1:
+                    continue
 
-            # If there is a relation between head and tail
-            if right_rel is not None:
-                # This part is to solve N - N modifier in Vietnamese
-                if right_rel.relation_name == "nmod":
-                    Transition.right_arc_star(sentence_conf, right_rel.relation_name, file_parsing)
-                else:
-                    Transition.right_arc(sentence_conf, right_rel.relation_name, file_parsing)
-            elif left_rel is not None:
-                Transition.left_arc(sentence_conf, left_rel.relation_name, file_parsing)
+            # If there is no relation between tail and head, the buffer still have elements, shift
+            # We should check if w_j have some relation ship with some elements in stack, going down from tail,
+            # not including root
+            # An arc which cannot be added falls through to shift, so every step makes progress
+            have_hidden_arc = False
+            if action is None and related[class_j]:
+                # The deepest related word decides, so look for it from the bottom up
+                for word in islice(sentence_conf.stack, len(sentence_conf.stack) - 1):
+                    found = hidden[word_class.get(word, 0) * size + class_j]
+                    if found is None:
+                        continue
+                    is_head, is_preposition = found
+                    head, dependent = (word, w_j) if is_head else (w_j, word)
+                    # Check if the relation is already featured in the arcs
+                    have_hidden_arc = (head, dependent) not in sentence_conf.arc_pairs
+                    # I think most P should only have 2 connected arcs at most
+                    if is_preposition and connected_arc[head] >= 2:
+                        have_hidden_arc = False
+                    break
+            # Experience-based reduce, a reduce which cannot pop the stack shifts instead of looping forever
+            if not have_hidden_arc or Transition.reduce(sentence_conf, trace) == -1:
+                Transition.shift(sentence_conf, trace)
 
     @staticmethod
-    def grammar_relation(sentence_conf):
+    def grammar_relation(sentence_conf, sink=None):
         # Create a grammar tree represent the grammatical relation of the sentence
         # Using tree for easier to create a hierarchy tree
         tree = {}
         parent_node = child_node = None
         name_parent = name_child = None
+        # The preposition of the last time, e.g. lúc-to
+        time_parent = None
 
         # Words type deduction base on arcs
         for idx, rel in enumerate(sentence_conf):
@@ -492,6 +778,10 @@ class ProcessText:
                     name_parent = rel.left + "-from"
                 elif rel.left == "hết":
                     name_parent = rel.left
+                elif time_parent is not None and time_parent.startswith(rel.left + "-"):
+                    # Another time of the same preposition, e.g. "sau 18 giờ và trước 21 giờ"
+                    name_parent = time_parent
+                time_parent = name_parent
                 parent_node = Token(name_parent, "P")
                 child_node = Token(name_child, "N")
             elif rel.relation_name == "pobj":
@@ -506,594 +796,130 @@ class ProcessText:
             tree[name_parent].add(tree[name_child])
 
         # Write these to files
-
-        file_grammar_relation = open("../Assignment/Output/output_c.txt", 'a')
-        # print(tree)
-        print("S root [", file=file_grammar_relation)
-        print("SUBJ [" + str(tree["root"].children[0].children[0]) + "]", file=file_grammar_relation)
-        print("[MAIN-" + tree["root"].children[0].type + " " + tree["root"].children[0].word + "]",
-              file=file_grammar_relation)
-        for i in range(1, len(tree["root"].children[0].children)):
-            if str(tree["root"].children[0].children[i]) != "":
-                print("[" + str(tree["root"].children[0].children[i]) + "]", file=file_grammar_relation)
-        print("]", file=file_grammar_relation)
+        file_grammar_relation = sink.stream("c") if sink is not None else None
+        if file_grammar_relation is not None:
+            # print(tree)
+            print("S root [", file=file_grammar_relation)
+            print("SUBJ [" + str(tree["root"].children[0].children[0]) + "]", file=file_grammar_relation)
+            print("[MAIN-" + tree["root"].children[0].type + " " + tree["root"].children[0].word + "]",
+                  file=file_grammar_relation)
+            for i in range(1, len(tree["root"].children[0].children)):
+                if str(tree["root"].children[0].children[i]) != "":
+                    print("[" + str(tree["root"].children[0].children[i]) + "]", file=file_grammar_relation)
+            print("]", file=file_grammar_relation)
 
         # The main tree is this tree
         return tree["root"].children[0]
 
     @staticmethod
-    def logical_form(grammar_relation):
-        # Change to logical form
-
-        question_type = ["WH-QUERY", "Y/N-QUESTION", "COMMAND"]
-        city_set = []
-        bus_name = []
-        with open('../Assignment/Models/city.txt', 'r') as file1:
-            city_set = file1.read().splitlines()
-        with open('../Assignment/Models/BusName.txt', 'r') as file2:
-            bus_name = file2.read().splitlines()
-
-        # Atm, should only concern on WH
-        log_form = {}
-        log_form.setdefault(question_type[0], {})
-        log_form[question_type[0]].setdefault(grammar_relation.word, {})
-        agent = from_loc = to_loc = from_time = to_time = take_time = ""
-
+    def logical_form(grammar_relation, sink=None, city_set=None, bus_names=None):
+        # Change to logical form, atm should only concern on WH
+        models = current_models()
+        if city_set is None:
+            city_set = models.grammar.city_set
+        if bus_names is None:
+            bus_names = models.bus_names
+
+        # role -> part, the first value found for a role is kept
+        parts = {}
         for info in grammar_relation.children:
             if info.word == "xe_buýt":
-                agent += "<TRAIN t1 "
-                if info.children:
-                    for child_subj in info.children:
-                        if child_subj.word == "nào":
-                            agent += "<WH t1 NAME>"
-                        elif child_subj.word in bus_name:
-                            agent += "<NAME t1 \"" + child_subj.word + "\">"
-                agent += ">"
-            elif info.word == "từ":
-                # If have children
-                if info.children:
-                    for child in info.children:
-                        # if this child is a place -> city name:
-                        if child.type == "N":
-                            if child.word in city_set:
-                                from_loc += "<CITY t1<NAME t1 " + child.word + ">>"
-                            elif child.word == "đâu":
-                                from_loc += "<CITY t1<WH t1 NAME>>"
-                        # if this child is a preposition -> time
-                        if child.type == "P":
-                            if child.word == "lúc-from":
-                                # get the time
-                                from_time += "<TIME t1 " + child.children[0].word + ">"
-                            elif child.word == "lúc_nào-from":
-                                from_time += "<TIME t1 <WH t1 TIME>>"
-            elif info.word == "đến":
-                # If have children
-                if info.children:
-                    for child in info.children:
-                        # if this child is a place -> city name:
-                        if child.type == "N":
-                            if child.word in city_set:
-                                to_loc += "<CITY t1<NAME t1 " + child.word + ">>"
-                            elif child.word == "đâu":
-                                to_loc += "<CITY t1<WH t1 NAME>>"
-                        # if this child is a preposition -> time
-                        if child.type == "P":
-                            if child.word == "lúc-to":
-                                # get the time
-                                to_time += "<TIME t1 " + child.children[0].word + ">"
-                            elif child.word == "lúc_nào-to":
-                                to_time += "<TIME t1 <WH t1 TIME>>"
+                name = None
+                for child_subj in info.children:
+                    if child_subj.word == "nào":
+                        name = WH_NAME
+                    elif child_subj.word in bus_names:
+                        name = child_subj.word
+                    if name is not None:
+                        break
+                parts.setdefault(Agent, Agent(name))
+            elif info.word in ["từ", "đến"]:
+                suffix = "-from" if info.word == "từ" else "-to"
+                place_class, time_class = (Source, Leave) if info.word == "từ" else (Destination, Arrive)
+                for child in info.children:
+                    # if this child is a place -> city name
+                    if child.type == "N":
+                        if child.word in city_set:
+                            parts.setdefault(place_class, place_class(child.word))
+                        elif child.word == "đâu":
+                            parts.setdefault(place_class, place_class(WH_NAME))
+                    # if this child is a preposition -> time
+                    if child.type == "P":
+                        if child.word == "lúc" + suffix:
+                            for time_token in child.children:
+                                time = read_time_window(time_token.word) or time_token.word
+                                known = parts.get(time_class)
+                                if known is None:
+                                    parts[time_class] = time_class(time)
+                                elif not is_wh(known.time):
+                                    # Every time given for the departure or the arrival holds
+                                    parts[time_class] = time_class(intersect_times(known.time, time))
+                        elif child.word == "lúc_nào" + suffix:
+                            parts.setdefault(time_class, time_class(WH_TIME))
             elif info.word == "hết":
-                if info.children:
-                    for child in info.children:
-                        # This must be a N
-                        if child.word == "bao_lâu":
-                            take_time += "<TIME t1 <WH t1 TIME>>"
-                        else:
-                            take_time += "<TIME t1 " + child.word + ">"
-
-        # Throw data into the dict
-        if agent != "":
-            log_form[question_type[0]][grammar_relation.word].setdefault("AGENT", agent)
-        if from_loc != "":
-            log_form[question_type[0]][grammar_relation.word].setdefault("SOURCE", from_loc)
-        if from_time != "":
-            log_form[question_type[0]][grammar_relation.word].setdefault("LEAVE", from_time)
-        if to_loc != "":
-            log_form[question_type[0]][grammar_relation.word].setdefault("DESTINATION", to_loc)
-        if to_time != "":
-            log_form[question_type[0]][grammar_relation.word].setdefault("ARRIVE", to_time)
-        if take_time != "":
-            log_form[question_type[0]][grammar_relation.word].setdefault("RUN-TIME", take_time)
+                for child in info.children:
+                    # This must be a N
+                    parts.setdefault(RunTime, RunTime(WH_TIME if child.word == "bao_lâu" else child.word))
+
+        log_form = LogicalForm(grammar_relation.word, parts.get(Agent), parts.get(Source), parts.get(Leave),
+                               parts.get(Destination), parts.get(Arrive), parts.get(RunTime))
 
         # Write to file
-        file_logical_form = open("../Assignment/Output/output_d.txt", 'a')
-        print(log_form, file=file_logical_form)
+        file_logical_form = sink.stream("d") if sink is not None else None
+        if file_logical_form is not None:
+            print(log_form, file=file_logical_form)
 
         return log_form
 
     @staticmethod
-    def procedure_form(logical_form):
-        # Change logical_form (as a dict) to procedure form
-        procedure_str = ""
-        if "WH-QUERY" in logical_form:
-            procedure_str += "PRINT-ALL\n"
-            # at this point, only one verb allow:
-            if "đi" in logical_form["WH-QUERY"]:
-                info_dict = logical_form["WH-QUERY"]["đi"]
-                # Get as much info as possible:
-                agent_query = source_query = dest_query = leave_query = arrive_query = run_time_query = ""
-                for idx, key in enumerate(info_dict):
-                    if key == "AGENT":
-                        # Processing agent
-                        agent_info = info_dict[key][:-2].split("<")[1:]
-                        if "WH" in agent_info[1]:
-                            # Unknown train name
-                            agent_query += "?tr (TRAIN ?tr) "
-                        elif "NAME" in agent_info[1]:
-                            train_name = agent_info[1].split()[2][1:-1].upper()
-                            agent_query += "(TRAIN " + train_name + ") "
-                    elif key == "SOURCE":
-                        source_info = info_dict[key][:-2].split("<")[1:]
-                        if "WH" in source_info[1]:
-                            # Unknow city name
-                            source_query += "?dp (DTIME ?tr ?dp ?dt)"
-                        else:
-                            # Known city name
-                            encoded_city_name = city_name_encode(source_info[1].split()[2])
-                            source_query += "(DTIME ?tr " + encoded_city_name + " ?dt) "
-                    elif key == "DESTINATION":
-                        dest_info = info_dict[key][:-2].split("<")[1:]
-                        if "WH" in dest_info[1]:
-                            # Unknow city name
-                            dest_query += "?ap (ATIME ?tr ?ap ?at)"
-                        else:
-                            encoded_city_name = city_name_encode(dest_info[1].split()[2])
-                            dest_query += "(ATIME ?tr " + encoded_city_name + " ?at)"
-                    elif key == "LEAVE":
-                        leave_info = info_dict[key][1:-1].split()
-                        if "WH" in leave_info[2]:
-                            # Unknow time
-                            leave_query += "?dt (DTIME ?tr ?dp ?dt)"
-                        else:
-                            leave_time = leave_info[2].split()[0] + "HR"
-                            leave_query += "(DTIME ?tr ?dp " + leave_time + ")"
-                    elif key == "ARRIVE":
-                        arrive_info = info_dict[key][1:-1].split()
-                        if "WH" in arrive_info[2]:
-                            arrive_query += "?at (ATIME ?tr ?ap ?at)"
-                        else:
-                            leave_time = arrive_info[2].split()[0] + "HR"
-                            arrive_query += "(ATIME ?tr ?ap " + leave_time + ")"
-                    elif key == "RUN-TIME":
-                        run_time_info = info_dict[key][1:-1].split()
-                        if "WH" in run_time_info[2]:
-                            run_time_query += "?rt (RUN-TIME ?tr ?dp ?ap ?rt)"
-                        else:
-                            run_time = run_time_info[2].split()[0] + "HR"
-                            run_time_query += "(RUN-TIME ?tr ?dp ?ap " + run_time + ")"
-
-                # Combine the query to get a full query
-                full_source_query = full_leave_query = full_run_query = ""
-                dplace_info = "?dp"
-                dtime_info = "?dt"
-                aplace_info = "?ap"
-                atime_info = "?at"
-
-                # First full source query -> replace ? by real info as much as possible
-                if source_query == "" and leave_query != "":
-                    full_source_query = leave_query
-                elif source_query != "" and leave_query == "":
-                    full_source_query = source_query
-                elif source_query == "" and leave_query == "":
-                    full_source_query = ""
+    def procedure_form(logical_form, sink=None):
+        # Change the LogicalForm to procedure form and compile it, at this point only one verb is allowed
+        lines = []
+        if logical_form.verb == "đi":
+            agent = logical_form.agent
+            if agent is not None and is_wh(agent.name):
+                # Unknown train name
+                lines.append(Line(("?tr",), Goal("TRAIN", ("?tr",))))
+            elif agent is not None and agent.name is not None:
+                lines.append(Line((), Goal("TRAIN", (agent.name.upper(),))))
+            departure = time_pattern("DTIME", logical_form.source, logical_form.leave, "?dp", "?dt")
+            arrival = time_pattern("ATIME", logical_form.destination, logical_form.arrive, "?ap", "?at")
+            lines += [line for line in [departure, arrival] if line is not None]
+
+            run_time = logical_form.run_time
+            if run_time is not None:
+                # The places of the run time are the ones known from the departure and the arrival
+                dplace_info = departure.goal.args[1] if departure is not None else "?dp"
+                aplace_info = arrival.goal.args[1] if arrival is not None else "?ap"
+                if is_wh(run_time.time):
+                    lines.append(Line(("?rt",), Goal("RUN-TIME", ("?tr", dplace_info, aplace_info, "?rt"))))
                 else:
-                    # Get the ?info data
-                    question_mark = []
-                    split_source = source_query[1:-1].split()
-                    split_leave = leave_query[1:-1].split()
-                    if "?" in split_source[0]:
-                        question_mark.append(split_source[0])
-                        if "?" not in split_source[3]:
-                            dplace_info = split_source[3]
-                        if "?" not in split_source[4]:
-                            dtime_info = split_source[4]
-                    else:
-                        if "?" not in split_source[2]:
-                            dplace_info = split_source[2]
-                        if "?" not in split_source[3]:
-                            dtime_info = split_source[3]
-                    if "?" in split_leave[0]:
-                        question_mark.append(split_leave[0])
-                        if "?" not in split_leave[3]:
-                            dplace_info = split_leave[3]
-                        if "?" not in split_leave[4]:
-                            dtime_info = split_leave[4]
-                    else:
-                        if "?" not in split_leave[2]:
-                            dplace_info = split_leave[2]
-                        if "?" not in split_leave[3]:
-                            dtime_info = split_leave[3]
-                    full_source_query = " ".join(
-                        x for x in question_mark) + " (DTIME ?tr " + dplace_info + " " + dtime_info
-                    if full_source_query[:-1] != ")": full_source_query += ")"
-
-                # full leave query
-                if dest_query == "" and arrive_query != "":
-                    full_leave_query = arrive_query
-                elif dest_query != "" and arrive_query == "":
-                    full_leave_query = dest_query
-                elif dest_query == "" and arrive_query == "":
-                    full_leave_query = ""
-                else:
-                    # Get the ?info data
-                    question_mark = []
-
-                    split_dest = dest_query[1:-1].split()
-                    split_arrive = arrive_query[1:-1].split()
-                    if "?" in split_dest[0]:
-                        question_mark.append(split_dest[0])
-                        if "?" not in split_dest[3]:
-                            aplace_info = split_dest[3]
-                        if "?" not in split_dest[4]:
-                            atime_info = split_dest[4]
-                    else:
-                        if "?" not in split_dest[2]:
-                            aplace_info = split_dest[2]
-                        if "?" not in split_dest[3]:
-                            atime_info = split_dest[3]
-                    if "?" in split_arrive[0]:
-                        question_mark.append(split_arrive[0])
-                        if "?" not in split_arrive[3]:
-                            aplace_info = split_arrive[3]
-                        if "?" not in split_arrive[4]:
-                            atime_info = split_arrive[4]
-                    else:
-                        if "?" not in split_arrive[2]:
-                            aplace_info = split_arrive[2]
-                        if "?" not in split_arrive[3]:
-                            atime_info = split_arrive[3]
-                    full_leave_query = " ".join(
-                        x for x in question_mark) + " (ATIME ?tr " + aplace_info + " " + atime_info
-                    if full_leave_query[:-1] != ")": full_leave_query += ")"
-
-                # Get the ?dp and ?ap of the run_query
-                if full_source_query != "":
-                    if "?" in full_source_query.split()[0]:
-                        dplace_info = full_source_query.split()[3]
-                    else:
-                        dplace_info = full_source_query.split()[2]
-                if full_leave_query != "":
-                    if "?" in full_leave_query.split()[0]:
-                        aplace_info = full_leave_query.split()[3]
-                    else:
-                        aplace_info = full_leave_query.split()[2]
-                if dplace_info != "?dp" and aplace_info != "?ap":
-                    full_run_query = run_time_query.replace("?dp", dplace_info).replace("?ap", aplace_info)
-                elif dplace_info == "?dp" and aplace_info != "?ap":
-                    full_run_query = run_time_query.replace("?ap", aplace_info)
-                elif dplace_info != "?dp" and aplace_info == "?ap":
-                    full_run_query = run_time_query.replace("?dp", dplace_info)
-                else:
-                    full_run_query = run_time_query
-
-                # Complete the full query and write to file
-                if agent_query != "":
-                    procedure_str += agent_query + "\n"
-                if full_source_query != "":
-                    procedure_str += full_source_query + "\n"
-                if full_leave_query != "":
-                    procedure_str += full_leave_query + "\n"
-                if full_run_query != "":
-                    procedure_str += full_run_query + "\n"
-
-                file_procedure_form = open("../Assignment/Output/output_e.txt", 'a')
-                print(procedure_str, file=file_procedure_form)
-                return procedure_str
+                    lines.append(Line((), Goal("RUN-TIME", ("?tr", dplace_info, aplace_info, run_time.time + "HR"))))
+        procedure = Procedure("PRINT-ALL", tuple(lines))
+
+        file_procedure_form = sink.stream("e") if sink is not None else None
+        if file_procedure_form is not None:
+            print(procedure, file=file_procedure_form)
+        # Questions of the same shape share the compiled plan
+        return compile_plan(procedure)
 
     @staticmethod
-    def get_query_answer(query, question):
-        # read data
-        train_data = []
-        atime_data = []
-        dtime_data = []
-        rtime_data = []
-        have_dtime = have_atime = have_both_da = False
-        with open('../Assignment/Models/data.txt', 'r') as file:
-            lines = [line.rstrip() for line in file]
-            for line in lines:
-                if "TRAIN" in line:
-                    train_data.append(line)
-                elif "ATIME" in line:
-                    atime_data.append(line)
-                elif "DTIME" in line:
-                    dtime_data.append(line)
-                elif "RUN-TIME" in line:
-                    rtime_data.append(line)
-        commands = query.split("\n")
-        # Extract bus name, city name, hour from the given data
-        possible_train_name = [item[1:-1].split()[1] for item in train_data]
-        possible_city_code = ['HCMC', 'HN', 'DANANG', 'HUE']
-        possible_atimes = [item[1:-1].split()[3] for item in atime_data]
-        possible_dtimes = [item[1:-1].split()[3] for item in dtime_data]
-        possible_time = list(set(possible_atimes) | set(possible_dtimes))
-        possible_run_time = [item[1:-1].split()[4] for item in rtime_data]
-        result = []
-        for cmd in commands:
-            if "DTIME" in cmd: have_dtime = True
-            if "ATIME" in cmd: have_atime = True
-        have_both_da = have_dtime & have_atime
-        if commands[0] == "PRINT-ALL":
-            # start matching
-            var_to_get = []     # contain ? marks
-            gotten_train = []   # contain name of the train in the queries
-            result_d = []       # result collected in dtime queries
-            result_a = []       # result collected in atime queries
-            result_r = []       # result collected in rtime queries
-            dtime_appear = atime_appear = False
-            for item in commands[1:]:
-                if item != "":
-                    if "?" in item.split()[0]:
-                        # Have data to collect
-                        question_mark = item.split()[0]
-                        if question_mark == "?tr":
-                            # Train name
-                            # Don't know train -> add all possible train name
-                            var_to_get.append(question_mark)
-                            for train_item in train_data:
-                                gotten_train.append(train_item.split()[1][:-1])
-                        # this query is sure to be second if exist -> only have 1 train name atm
-                        if question_mark == "?dp":
-                            var_to_get.append(question_mark)
-                            # Replace place by place
-                            for city_code in possible_city_code:
-                                # Replace train by train
-                                for train_name in gotten_train:
-                                    # Prepared command
-                                    check_cmd = item[4:].replace("?tr", train_name).replace("?dp", city_code).strip()
-                                    have_mark_unused = False
-                                    parts_check_cmd = check_cmd[1:-1].split()
-                                    for part in parts_check_cmd:
-                                        if "?dt" == part:
-                                            if not part in var_to_get:
-                                                # Have ? which will not be part of the result
-                                                have_mark_unused = True
-                                                break
-                                    if have_mark_unused:
-                                        # 100% to be ?dt -> Replace time by time
-                                        for time_point in possible_time:
-                                            check_cmd = item[4:].replace("?dt", time_point).replace("?tr",
-                                                                                                    train_name).replace(
-                                                "?dp", city_code).strip()
-                                            if check_cmd in dtime_data:
-                                                result_d.append(city_code)
-                                    else:
-                                        # dt known -> check normally
-                                        if check_cmd in dtime_data:
-                                            result_d.append(city_code)
-                        if question_mark == "?ap":
-                            # Same as ?dp, just change some output source
-                            var_to_get.append(question_mark)
-                            for city_code in possible_city_code:
-                                for train_name in gotten_train:
-                                    check_cmd = item[4:].replace("?tr", train_name).replace("?ap", city_code).strip()
-                                    have_mark_unused = False
-                                    parts_check_cmd = check_cmd[1:-1].split()
-                                    for part in parts_check_cmd:
-                                        if "?at" == part:
-                                            if not part in var_to_get:
-                                                have_mark_unused = True
-                                                break
-                                    if have_mark_unused:
-                                        # 100% to be ?at
-                                        for time_point in possible_time:
-                                            check_cmd = item[4:].replace("?at", time_point).replace("?tr",
-                                                                                                    train_name).replace(
-                                                "?ap", city_code).strip()
-                                            if check_cmd in atime_data:
-                                                result_a.append(city_code)
-                                    else:
-                                        if check_cmd in dtime_data:
-                                            result_a.append(city_code)
-                        # Similar
-                        if question_mark == "?at":
-                            var_to_get.append(question_mark)
-                            for time_point in possible_time:
-                                for train_name in gotten_train:
-                                    check_cmd = item[4:].replace("?tr", train_name).replace("?at", time_point).strip()
-                                    have_mark_unused = False
-                                    parts_check_cmd = check_cmd[1:-1].split()
-                                    for part in parts_check_cmd:
-                                        # 100% to be ?ap in this case
-                                        if "?ap" == part:
-                                            if not part in var_to_get:
-                                                have_mark_unused = True
-                                                break
-                                    if have_mark_unused:
-                                        # 100% to be ?ap
-                                        for city_code in possible_city_code:
-                                            check_cmd = item[4:].replace("?at", time_point).replace("?tr",
-                                                                                                    train_name).replace(
-                                                "?ap", city_code).strip()
-                                            if check_cmd in atime_data:
-                                                result_a.append(time_point)
-                                    else:
-                                        if check_cmd in atime_data:
-                                            result_a.append(time_point)
-                        if question_mark == "?dt":
-                            var_to_get.append(question_mark)
-                            for time_point in possible_time:
-                                for train_name in gotten_train:
-                                    check_cmd = item[4:].replace("?tr", train_name).replace("?dt", time_point).strip()
-                                    have_mark_unused = False
-                                    parts_check_cmd = check_cmd[1:-1].split()
-                                    for part in parts_check_cmd:
-                                        # 100% to be ?dp in this case
-                                        if "?dp" == part:
-                                            if not part in var_to_get:
-                                                have_mark_unused = True
-                                                break
-                                    if have_mark_unused:
-                                        # 100% to be ?ap
-                                        for city_code in possible_city_code:
-                                            check_cmd = item[4:].replace("?dt", time_point).replace("?tr",
-                                                                                                    train_name).replace(
-                                                "?dp", city_code).strip()
-                                            if check_cmd in dtime_data:
-                                                result_d.append(time_point)
-                                    else:
-                                        if check_cmd in dtime_data:
-                                            result_d.append(time_point)
-                        # A little differences, not much though, process almost the same
-                        if question_mark == "?rt":
-                            var_to_get.append(question_mark)
-                            for run_time_test in possible_run_time:
-                                for train_name in gotten_train:
-                                    check_cmd = item[4:].replace("?tr", train_name).replace("?rt",
-                                                                                            run_time_test).strip()
-                                    have_mark_unused = False
-                                    list_unused = []
-                                    parts_check_cmd = check_cmd[1:-1].split()
-                                    for part in parts_check_cmd:
-                                        # May be ?dp or ?ap -> Place
-                                        if part in ["?ap", "?dp"]:
-                                            if not part in var_to_get:
-                                                have_mark_unused = True
-                                                list_unused.append(part)
-                                    if have_mark_unused:
-                                        # don't know either cities
-                                        if len(list_unused) == 2:
-                                            for citi1 in possible_city_code:
-                                                for citi2 in possible_city_code:
-                                                    check_cmd = item[4:].replace("?tr", train_name).replace("?rt",
-                                                                                                            run_time_test).replace(
-                                                        list_unused[0], citi1).replace(list_unused[1], citi2).strip()
-                                                    if check_cmd in rtime_data:
-                                                        result_r.append(run_time_test)
-                                        # know one
-                                        elif len(list_unused) == 1:
-                                            for citi1 in possible_city_code:
-                                                check_cmd = item[4:].replace("?tr", train_name).replace("?rt",
-                                                                                                        run_time_test).replace(
-                                                    list_unused[0], citi1).strip()
-                                            if check_cmd in rtime_data:
-                                                result_r.append(run_time_test)
-                                    else:
-                                        # know all
-                                        if check_cmd in rtime_data:
-                                            result_r.append(run_time_test)
-                    else:
-                        # Train name is provided
-                        if item.split()[1][:-1] in possible_train_name:
-                            gotten_train.append(item.split()[1][:-1])
-                        elif gotten_train:
-                            for train_name in gotten_train:
-                                # Replace ?tr in 2 command by train_name
-                                check_cmd = item.replace("?tr", train_name).strip()
-                                have_mark_unused = False
-                                unused_part = ""
-                                # Check dtime condition
-                                if "DTIME" in check_cmd:
-                                    dtime_appear = True
-                                    # print(check_cmd)
-
-                                    # Check if there is ? in the command
-                                    # Remove the parenthesis
-                                    parts_check_cmd = check_cmd[1:-1].split()
-                                    for part in parts_check_cmd:
-                                        if "?" in part:
-                                            # Check if not part is in var_to_get
-                                            if not part in var_to_get:
-                                                have_mark_unused = True
-                                                unused_part = part
-                                                break
-                                    if have_mark_unused:
-                                        # Don't care this in the command -> Make it available for all possible values
-                                        if unused_part == "?dp":
-                                            for citi in possible_city_code:
-                                                check_cmd = item.replace("?dp", citi).replace("?tr", train_name).strip()
-                                                if check_cmd in dtime_data:
-                                                    result_d.append(train_name)
-                                        elif unused_part == "?dt":
-                                            for time_point in possible_time:
-                                                check_cmd = item.replace("?dt", time_point).replace("?tr",
-                                                                                                    train_name).strip()
-                                                if check_cmd in dtime_data:
-                                                    result_d.append(train_name)
-                                    else:
-                                        if check_cmd in dtime_data:
-                                            result_d.append(train_name)
-                                elif "ATIME" in check_cmd:
-                                    atime_appear = True
-                                    parts_check_cmd = check_cmd[1:-1].split()
-                                    for part in parts_check_cmd:
-                                        if "?" in part:
-                                            # Check if not part is in var_to_get
-                                            if not part in var_to_get:
-                                                have_mark_unused = True
-                                                unused_part = part
-                                                break
-                                    if have_mark_unused:
-                                        # Don't care this in the command -> Make it available for all possible values
-                                        if unused_part == "?ap":
-                                            for citi in possible_city_code:
-                                                check_cmd = item.replace("?ap", citi).replace("?tr", train_name).strip()
-                                                if check_cmd in atime_data:
-                                                    result_a.append(train_name)
-                                        elif unused_part == "?at":
-                                            for time_point in possible_time:
-                                                check_cmd = item.replace("?at", time_point).replace("?tr",
-                                                                                                    train_name).strip()
-                                                if check_cmd in atime_data:
-                                                    result_a.append(train_name)
-                                    else:
-                                        if check_cmd in atime_data:
-                                            result_a.append(train_name)
-
-            # Intersection if ?tr is to find
-            if "?tr" in var_to_get:
-                if dtime_appear and atime_appear:
-                    result = list(set(result_a) & set(result_d))
-                elif not dtime_appear and atime_appear:
-                    result = result_a
-                elif dtime_appear and not atime_appear:
-                    result = result_d
-            # ?dp is union
-            elif "?dp" in var_to_get or "?ap" in var_to_get:
-                result = result_d + result_a
-            # ?t is consider by time, if both dtime and atime appears, one of the result have none -> truncate both
-            # Else result be one of them
-            elif "?dt" in var_to_get or "?at" in var_to_get:
-                if "?dt" in var_to_get:
-                    if "?at" in var_to_get:
-                        result = result_d + result_a
-                    else:
-                        # Check if both of the command appear
-                        if have_both_da:
-                            if result_a:
-                                result = result_d + result_a
-                            else:
-                                result = []
-                        else:
-                            result = result_d
-                elif "?at" in var_to_get:
-                    if "?dt" in var_to_get:
-                        result = result_d + result_a
-                    else:
-                        if have_both_da:
-                            if result_d:
-                                result = result_d + result_a
-                            else:
-                                result = []
-                        else:
-                            result = result_a
-            elif "?rt" in var_to_get:
-                result = result_r
+    def get_query_answer(query, question, knowledge_base=None, sink=None):
+        # The timetable is parsed once and shared between questions
+        models = current_models()
+        if knowledge_base is None:
+            knowledge_base = models.knowledge_base
+        city_table = models.city_table
+        stats = {} if metrics is not None else None
+        result = evaluate(query, knowledge_base, stats)
+        if stats is not None:
+            metrics.count("query_candidates", stats.get("candidates", 0))
 
         # Decode the city name if any
         for idx, item in enumerate(result):
-            if item in possible_city_code:
-                result[idx] = city_name_decode(item)
+            city_name = city_table.decode(item)
+            if city_name is not None:
+                result[idx] = city_name
 
         # Write to file
         result_str = ""
@@ -1102,17 +928,256 @@ class ProcessText:
         else:
             result_str += "Không có kết quả thoả mãn."
 
-        file_result = open("../Assignment/Output/output_f.txt", 'a')
+        write_answer(sink, question, result_str)
+        return result_str
+
+
+# The text files compiled into the artifact
+MODEL_SOURCES = [DATA_PATH, RELATIONS_PATH, CITY_PATH, BUS_NAME_PATH, EQUIVALENT_PATH, CITY_CODES_PATH]
+
+
+def compile_models(path=ARTIFACT_PATH, knowledge_base=None):
+    # Parse the text files of Models and write them as one artifact, see write_artifact.
+    # knowledge_base is the timetable to write when it was already read, data.txt is parsed otherwise
+    tables = {
+        "relations": [(relation.relation_name, relation.left, relation.right)
+                      for relation in Grammar.read_relations()],
+        "cities": [(city,) for city in Grammar.read_cities()],
+        "bus_names": [(name,) for name in read_bus_names()],
+        "normalizer_rules": FIXED_RULES + PhraseNormalizer.read_rules(),
+        "city_codes": CityTable.from_file().rows,
+    }
+    if knowledge_base is None:
+        knowledge_base = BusKnowledgeBase.from_file(DATA_PATH)
+    write_artifact(path, knowledge_base, tables, MODEL_SOURCES)
+
+
+def load_artifact(path=ARTIFACT_PATH):
+    """
+    Map the compiled models, compiling them first when the artifact is missing or a text file changed
+    :return: the ModelArtifact, None if it cannot be written, then the text files are read instead
+    """
+    artifact = open_artifact(path, MODEL_SOURCES)
+    if artifact is None:
+        try:
+            compile_models(path)
+        except OSError:
+            return None
+        artifact = open_artifact(path, MODEL_SOURCES)
+    return artifact
+
+
+def load_models(trace_level=None, artifact_path=ARTIFACT_PATH):
+    """
+    Load everything in Models once, before the first question
+    :param artifact_path: the compiled models to map, None to read the text files
+    """
+    global _grammar, _bus_names, _models
+    artifact = load_artifact(artifact_path) if artifact_path is not None else None
+    if artifact is not None:
+        set_knowledge_base(artifact.knowledge_base())
+        _grammar = Grammar([Relation(left, relate, right) for relate, left, right in artifact.table("relations")],
+                           [city for city, in artifact.table("cities")])
+        _bus_names = set(name for name, in artifact.table("bus_names"))
+        set_normalizer(PhraseNormalizer(artifact.table("normalizer_rules")))
+        set_city_table(CityTable(artifact.table("city_codes")))
+    # Every model is read now, not on the first question
+    _models = None
+    current_models()
+    get_time_normalizer()
+    if trace_level is not None:
+        set_trace_level(trace_level)
+
+
+# Cache of analyze results keyed by the normalized question, None when turned off
+answer_cache = None
+# Time of the stages and counters, None when turned off
+metrics = None
+
+
+def enable_metrics(window=10000, profile_rate=0.0, trace_memory=False):
+    """
+    Record the wall and CPU time of every stage, the parser transitions and the facts examined by the queries
+    :param profile_rate: fraction of the questions run under cProfile, their profiles are kept in metrics.profiles
+    :param trace_memory: also take a tracemalloc snapshot of the profiled questions
+    :return: the Metrics, its stats() give the percentiles and add_hook() adds a hook
+    """
+    global metrics
+    metrics = Metrics(window, profile_rate, trace_memory)
+    return metrics
+
+
+def disable_metrics():
+    global metrics
+    metrics = None
+
+
+def enable_answer_cache(max_size=4096, ttl=None):
+    """
+    Cache the answers of repeated questions, the cache is cleared when a file in Models changes
+    :return: the AnswerCache, its stats() give the hits and misses
+    """
+    global answer_cache
+    answer_cache = AnswerCache(max_size, ttl, [DATA_PATH, RELATIONS_PATH, CITY_PATH, CITY_CODES_PATH, EQUIVALENT_PATH,
+                                               BUS_NAME_PATH])
+    return answer_cache
+
+
+def disable_answer_cache():
+    global answer_cache
+    answer_cache = None
+
+
+def write_answer(sink, question, result_str):
+    file_result = sink.stream("f") if sink is not None else None
+    if file_result is not None:
         print("Q: " + question, file=file_result)
         print("A: " + result_str + "\n", file=file_result)
-        return result_str
 
 
-def process(text):
-    preprocessed_text = ProcessText.preprocessing(text)
-    word_relation = ProcessText.parsing(preprocessed_text)
-    grammar_rel = ProcessText.grammar_relation(word_relation)
-    log_form = ProcessText.logical_form(grammar_rel)
-    query_str = ProcessText.procedure_form(log_form)
-    answer = ProcessText.get_query_answer(query_str, text)
-    return answer
+def run_stages(word_segmented_text, text, sink=None):
+    # Every step after the word segmentation, with the form made by each of them
+    if metrics is None:
+        word_relation = ProcessText.parsing(word_segmented_text, sink=sink)
+        grammar_rel = ProcessText.grammar_relation(word_relation, sink=sink)
+        log_form = ProcessText.logical_form(grammar_rel, sink=sink)
+        plan = ProcessText.procedure_form(log_form, sink=sink)
+        answer = ProcessText.get_query_answer(plan, text, sink=sink)
+    else:
+        with metrics.stage("parsing"):
+            word_relation = ProcessText.parsing(word_segmented_text, sink=sink)
+        with metrics.stage("grammar_relation"):
+            grammar_rel = ProcessText.grammar_relation(word_relation, sink=sink)
+        with metrics.stage("logical_form"):
+            log_form = ProcessText.logical_form(grammar_rel, sink=sink)
+        with metrics.stage("procedure_form"):
+            plan = ProcessText.procedure_form(log_form, sink=sink)
+        with metrics.stage("get_query_answer"):
+            answer = ProcessText.get_query_answer(plan, text, sink=sink)
+    return {"question": text, "words": word_segmented_text, "arcs": word_relation, "logical_form": log_form,
+            "procedure_form": plan, "answer": answer}
+
+
+def analyze_batch(texts, sink=None):
+    """
+    Answer many questions and keep what every step made, the segmenter is called once for all of them
+    :param texts: list of questions
+    :param sink: the OutputSink receiving the output of every stage, nothing is written without it
+    :return: list of dict with the question, words, arcs, logical_form, procedure_form and answer
+    """
+    # Every question of the batch is answered with the same models, a reload meanwhile applies to the next batch.
+    # A sampled profile covers the whole batch, its preprocessing and word segmentation included
+    with pinned_models() as models, metrics.sample(len(texts)) if metrics is not None else nullcontext():
+        return answer_batch(texts, sink, models)
+
+
+def answer_batch(texts, sink, models):
+    # analyze_batch with the models pinned
+    cache = answer_cache
+    if cache is None:
+        preprocessed_texts = ProcessText.preprocess_batch(texts)
+        return [run_stages(preprocessed_text, text, sink)
+                for preprocessed_text, text in zip(preprocessed_texts, texts)]
+
+    timer = metrics.stage if metrics is not None else no_stage
+    # Only the stages the sink writes are kept with the answers, nothing without a sink as in the server
+    stages = [stage for stage in STAGES if stage != "f" and sink is not None and sink.enabled(stage)]
+    # Questions which only differ in casing, spacing or synonyms share one entry
+    normalized_texts = []
+    for text in texts:
+        with timer("normalize"):
+            normalized_texts.append(ProcessText.normalize(text))
+    # Answers of older models are never hit, even when they are put after the cache was cleared by a reload
+    keys = [(" ".join(normalized_text.split()), default_trace_level, models.version)
+            for normalized_text in normalized_texts]
+    entries = [cache.get(key) for key in keys]
+    # An entry kept without the output of one of these stages is answered again
+    entries = [entry if entry is None or all(stage in entry[1] for stage in stages) else None
+               for entry in entries]
+    # The first question of each missing key is answered, the repeats in the batch share its entry
+    missing = {}
+    for idx, entry in enumerate(entries):
+        if entry is None:
+            missing.setdefault(keys[idx], idx)
+    if missing:
+        with timer("segmentation_batch"):
+            segmented_texts = get_segmenter().tokenize_batch([normalized_texts[idx] for idx in missing.values()])
+        answered = {}
+        for (key, idx), sentences in zip(missing.items(), segmented_texts):
+            # The output of the stages is kept with the answer, so a hit writes the same files
+            capture = MemorySink(stages) if stages else None
+            with timer("complete_sentence"):
+                words = ProcessText.complete_sentence(sentences[0])
+            result = run_stages(words, texts[idx], capture)
+            answered[key] = (result, capture.getvalues() if capture is not None else {})
+            cache.put(key, answered[key])
+        entries = [entry if entry is not None else answered[key] for key, entry in zip(keys, entries)]
+
+    results = []
+    for text, (result, outputs) in zip(texts, entries):
+        if sink is not None:
+            for stage, output in outputs.items():
+                if output:
+                    sink.write(stage, output)
+            write_answer(sink, text, result["answer"])
+        results.append(dict(result, question=text))
+    return results
+
+
+def analyze(text, sink=None):
+    """
+    Answer one question and keep what every step made
+    :return: dict with the question, words, arcs, logical_form, procedure_form and answer
+    """
+    return analyze_batch([text], sink)[0]
+
+
+def process(text, sink=None):
+    """
+    Answer one question
+    :param sink: the OutputSink receiving the output of every stage, nothing is written without it
+    """
+    return analyze(text, sink)["answer"]
+
+
+def process_batch(texts, sink=None):
+    """
+    Answer many questions, their word segmentation is done in one round trip
+    :param texts: list of questions
+    :param sink: the OutputSink receiving the output of every stage, nothing is written without it
+    :return: list of answers, in the same order
+    """
+    return [result["answer"] for result in analyze_batch(texts, sink)]
+
+
+def question_lines(lines):
+    # Questions of an input, one per line, blank lines are skipped
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line.strip() != "":
+            yield line
+
+
+def batched(items, size):
+    # Group an iterable into lists of at most size items, without reading ahead
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def process_stream(lines, sink=None, batch_size=1):
+    """
+    Answer the questions of any iterable of lines, e.g. sys.stdin or an open file.
+    Lines are read lazily, at most batch_size questions are held at a time.
+    :param lines: iterable of questions, one per line
+    :param sink: the OutputSink receiving the output of every stage, nothing is written without it
+    :param batch_size: questions sent to the segmenter together, 1 answers each line as soon as it is read
+    :return: generator of (question, answer)
+    """
+    for batch in batched(question_lines(lines), batch_size):
+        yield from zip(batch, process_batch(batch, sink))
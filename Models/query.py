@@ -0,0 +1,209 @@
+from collections import namedtuple
+from functools import lru_cache
+
+# One pattern of the procedure form, e.g. (DTIME ?tr HUE ?dt)
+Goal = namedtuple("Goal", ["predicate", "args"])
+# One line of the procedure form, the variables to print and their pattern, e.g. ?tr (TRAIN ?tr)
+Line = namedtuple("Line", ["marks", "goal"])
+
+
+class Procedure(namedtuple("Procedure", ["command", "lines"])):
+    """
+    The procedure form of a question, a command such as PRINT-ALL and its lines
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return "".join([self.command + "\n"] + [" ".join(line.marks + (format_goal(line.goal),)) + "\n"
+                                                for line in self.lines])
+
+
+def is_variable(term):
+    return isinstance(term, str) and term.startswith("?")
+
+
+def time_minutes(time):
+    # 19:00HR or 19:00 -> 1140
+    hour, minute = time.replace("HR", "").split(":")
+    return int(hour) * 60 + int(minute)
+
+
+class TimeRange(namedtuple("TimeRange", ["start", "end", "include_start", "include_end"])):
+    """
+    A window of times in a pattern, in minutes, None for an open end.
+    Written <20:00HR (before), >18:00HR (after) or 8:00HR..10:00HR (between, both ends included).
+    """
+    __slots__ = ()
+
+    def __contains__(self, minutes):
+        if self.start is not None and (minutes < self.start or minutes == self.start and not self.include_start):
+            return False
+        if self.end is not None and (minutes > self.end or minutes == self.end and not self.include_end):
+            return False
+        return True
+
+
+def time_term(time):
+    """
+    :param time: a time of the logical form, e.g. 20:00, <20:00 or 8:00..10:00
+    :return: the same in the procedure form, e.g. 20:00HR, <20:00HR or 8:00HR..10:00HR
+    """
+    return "..".join(part + "HR" for part in time.split(".."))
+
+
+def parse_time_range(term):
+    """
+    :return: the TimeRange of a term such as <20:00HR, None if the term is not a window
+    """
+    if term.startswith("<"):
+        return TimeRange(None, time_minutes(term[1:]), False, False)
+    if term.startswith(">"):
+        return TimeRange(time_minutes(term[1:]), None, False, False)
+    if ".." in term:
+        start, end = term.split("..")
+        return TimeRange(time_minutes(start), time_minutes(end), True, True)
+    return None
+
+
+def format_goal(goal):
+    return "(" + " ".join((goal.predicate,) + tuple(goal.args)) + ")"
+
+
+def parse_goal(pattern):
+    parts = pattern.strip()[1:-1].split()
+    return Goal(parts[0], tuple(parts[1:]))
+
+
+def read_procedure(procedure_str):
+    """
+    :param procedure_str: a procedure form as text, e.g. "PRINT-ALL\n?tr (TRAIN ?tr)\n(DTIME ?tr HUE ?dt)"
+    :return: the Procedure
+    """
+    lines = [line.strip() for line in procedure_str.split("\n") if line.strip() != ""]
+    command = lines[0] if lines else ""
+    return Procedure(command, tuple(Line(tuple(line[:line.index("(")].split()), parse_goal(line[line.index("("):]))
+                                    for line in lines[1:]))
+
+
+def parse_procedure(procedure):
+    """
+    Split the procedure form into its parts
+    :param procedure: a Procedure, or the same as text
+    :return: command, variables to print (in order), goals and the initial bindings
+    """
+    if isinstance(procedure, str):
+        procedure = read_procedure(procedure)
+    projection = []
+    goals = []
+    bindings = {}
+    for marks, goal in procedure.lines:
+        for mark in marks:
+            if mark not in projection:
+                projection.append(mark)
+        time_range = parse_time_range(goal.args[2]) if goal.predicate in ["DTIME", "ATIME"] else None
+        if time_range is not None:
+            # The knowledge base answers a window of times from its sorted times
+            goal = Goal(goal.predicate, goal.args[:2] + (time_range,))
+        if goal.predicate == "TRAIN" and not is_variable(goal.args[0]):
+            # The agent names the train which ?tr stands for in the other patterns
+            bindings["?tr"] = goal.args[0]
+            goal = Goal("TRAIN", ("?tr",))
+        goals.append(goal)
+    return procedure.command, projection, goals, bindings
+
+
+class QueryPlan(namedtuple("QueryPlan", ["command", "goals", "projection", "bindings", "procedure"])):
+    """
+    A procedure form compiled for evaluation: the goals in the order they are joined,
+    the variables to print and the values known before the first goal.
+    Plans are hashable, the same procedure form always gives the same plan.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return str(self.procedure)
+
+
+def order_goals(goals, bound):
+    """
+    Order the goals for a join, the most constrained goal first so the index does the filtering
+    :param bound: the variables known before the first goal
+    """
+    bound = set(bound)
+    remaining = list(goals)
+    ordered = []
+    while remaining:
+        goal = max(remaining, key=lambda item: sum(1 for arg in item.args if not is_variable(arg) or arg in bound))
+        remaining.remove(goal)
+        ordered.append(goal)
+        bound.update(arg for arg in goal.args if is_variable(arg))
+    return ordered
+
+
+@lru_cache(maxsize=4096)
+def compile_plan(procedure):
+    """
+    :param procedure: a Procedure, or the same as text
+    :return: the QueryPlan, plans are cached so a question of the same shape reuses it
+    """
+    if isinstance(procedure, str):
+        procedure = read_procedure(procedure)
+    command, projection, goals, bindings = parse_procedure(procedure)
+    goals = order_goals(goals, bindings)
+    return QueryPlan(command, tuple(goals), tuple(projection), tuple(bindings.items()), procedure)
+
+
+def join(goals, knowledge_base, bindings=None, stats=None):
+    """
+    Join the goals, in the given order, against the indexed facts, sharing variables such as ?tr
+    :param goals: list of Goal
+    :param knowledge_base: the BusKnowledgeBase to match
+    :param bindings: values already known for some variables
+    :param stats: dict counting the facts examined, see BusKnowledgeBase.lookup
+    :return: list of bindings (dict of variable -> value), one for each solution
+    """
+    solutions = [dict(bindings or {})]
+    for goal in goals:
+        if not solutions:
+            break
+        next_solutions = []
+        for solution in solutions:
+            args = tuple(solution.get(arg) if is_variable(arg) else arg for arg in goal.args)
+            for fact in knowledge_base.lookup(goal.predicate, args, stats):
+                extended = dict(solution)
+                for arg, value in zip(goal.args, fact):
+                    if is_variable(arg):
+                        if extended.setdefault(arg, value) != value:
+                            # Same variable twice in one pattern with different values
+                            break
+                else:
+                    next_solutions.append(extended)
+        solutions = next_solutions
+    return solutions
+
+
+def execute(plan, knowledge_base, stats=None):
+    """
+    Answer a compiled plan
+    :param stats: dict counting the facts examined, see BusKnowledgeBase.lookup
+    :return: the values of the printed variables, each variable in turn, without duplicates
+    """
+    if plan.command != "PRINT-ALL" or not plan.goals:
+        return []
+    solutions = join(plan.goals, knowledge_base, dict(plan.bindings), stats)
+    result = []
+    for variable in plan.projection:
+        result += list(dict.fromkeys(solution[variable] for solution in solutions if variable in solution))
+    return result
+
+
+def evaluate(procedure, knowledge_base, stats=None):
+    """
+    Answer a procedure form
+    :param procedure: a QueryPlan, a Procedure, or the same as text
+    :param stats: dict counting the facts examined, see BusKnowledgeBase.lookup
+    :return: the values of the printed variables, each variable in turn, without duplicates
+    """
+    if not isinstance(procedure, QueryPlan):
+        procedure = compile_plan(procedure)
+    return execute(procedure, knowledge_base, stats)
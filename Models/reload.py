@@ -0,0 +1,170 @@
+import os
+import threading
+import zlib
+
+from Models.artifact import open_artifact, ARTIFACT_PATH
+from Models.cities import CityTable, CITY_CODES_PATH
+from Models.dictionary_segmenter import read_domain_words
+from Models.knowledge_base import BusKnowledgeBase, LayeredKnowledgeBase, DATA_PATH
+from Models.normalizer import PhraseNormalizer, EQUIVALENT_PATH
+from Models.parser import Grammar, read_bus_names, current_models, swap_models, compile_models, check_cities, \
+    MODEL_SOURCES, RELATIONS_PATH, CITY_PATH, BUS_NAME_PATH
+from Models.segmenter import get_segmenter
+
+# Appended facts are indexed on their own until they are this share of the timetable, then it is rebuilt
+MAX_APPENDED_SHARE = 0.25
+
+
+def file_state(path):
+    # (mtime, size) of a file, None while it does not exist
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ModelReloader:
+    """
+    Watches the text files of Models by their modification time and reloads the ones which changed,
+    so a running process answers with them without a restart.
+    Lines appended to data.txt are indexed on their own on top of the loaded timetable,
+    any other change only rebuilds the models read from the files which changed.
+    The new models are swapped in at once, the questions already being answered finish with the old ones.
+    """
+
+    def __init__(self, interval=1.0, artifact_path=ARTIFACT_PATH, max_appended_share=MAX_APPENDED_SHARE):
+        """
+        Create it after load_models, the models loaded then are the ones it watches
+        :param interval: seconds between two checks of the files, see start
+        :param artifact_path: the compiled models written again when data.txt is rewritten, None to keep it in memory
+        :param max_appended_share: the timetable is rebuilt once the appended facts are more than this share of it
+        """
+        self.interval = interval
+        self.artifact_path = artifact_path
+        self.max_appended_share = max_appended_share
+        self.states = {path: file_state(path) for path in MODEL_SOURCES}
+        # The timetable loaded in full, the layers of the facts appended to data.txt since, largest first,
+        # and the part of data.txt it was read from
+        self.base = current_models().knowledge_base
+        self.appended = []
+        with open(DATA_PATH, 'rb') as file:
+            data = file.read()
+        self.data_size = len(data)
+        self.data_crc = zlib.crc32(data)
+        self.reloads = self.appends = self.rebuilds = self.errors = 0
+        self.last_error = None
+        # One check at a time, whether it comes from the thread of start or from a caller
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """
+        Reload the models of the files changed since the last check
+        :return: list of the files reloaded
+        """
+        with self._lock:
+            states = {path: file_state(path) for path in MODEL_SOURCES}
+            changed = [path for path in MODEL_SOURCES if states[path] != self.states[path]]
+            if not changed:
+                return []
+            try:
+                models = {}
+                if RELATIONS_PATH in changed or CITY_PATH in changed:
+                    grammar = Grammar.from_files()
+                    # The parser tables are compiled now rather than by the first question after the swap
+                    grammar.oracle()
+                    models["grammar"] = grammar
+                if BUS_NAME_PATH in changed:
+                    models["bus_names"] = read_bus_names()
+                if EQUIVALENT_PATH in changed:
+                    models["normalizer"] = PhraseNormalizer.from_file()
+                if CITY_CODES_PATH in changed:
+                    models["city_table"] = CityTable.from_file()
+                # Also refused while a new city is in city.txt and not yet in city_codes.txt,
+                # before the timetable moves on to the lines appended since the last check
+                current = current_models()
+                check_cities(models.get("grammar", current.grammar), models.get("city_table", current.city_table))
+                knowledge_base = self._reload_timetable() if DATA_PATH in changed else None
+                if knowledge_base is not None:
+                    models["knowledge_base"] = knowledge_base
+            except (OSError, ValueError, IndexError) as error:
+                # Most likely a file caught while it is written, it is read again at the next check
+                self.errors += 1
+                self.last_error = str(error)
+                return []
+            self.states = states
+            if not models:
+                # Only part of a line was appended to data.txt
+                return []
+            swap_models(**models)
+            if "grammar" in models:
+                # New grammar words and cities are known syllables from now on
+                fast_segmenter = get_segmenter().fast_segmenter
+                if fast_segmenter is not None:
+                    fast_segmenter.add_words(read_domain_words())
+            self.reloads += 1
+            return changed
+
+    def _reload_timetable(self):
+        # The knowledge base of data.txt as it is now, None if no whole line was appended
+        with open(DATA_PATH, 'rb') as file:
+            data = file.read()
+        appended_to = (len(data) >= self.data_size and zlib.crc32(data[:self.data_size]) == self.data_crc
+                       and data[self.data_size - 1:self.data_size] in [b"", b"\n"])
+        if appended_to:
+            # A line still being written is left for the next check
+            end = data.rfind(b"\n", self.data_size) + 1 or self.data_size
+            if end == self.data_size:
+                return None
+            layer = BusKnowledgeBase.from_lines(data[self.data_size:end].decode().splitlines())
+            appended = list(self.appended)
+            # Only the new facts are indexed, a layer is merged with the one before once it is as large,
+            # so a fact is indexed again a few times at most and there are few layers to look up
+            while appended and len(appended[-1]) <= len(layer):
+                layer = BusKnowledgeBase.from_layers([appended.pop(), layer])
+            if len(layer):
+                appended.append(layer)
+            if sum(len(layer) for layer in appended) <= self.max_appended_share * len(self.base):
+                # The loaded timetable and the earlier layers are shared by the snapshots
+                knowledge_base = LayeredKnowledgeBase(self.base, *appended) if appended else self.base
+                self.appended = appended
+                self.data_size = end
+                self.data_crc = zlib.crc32(data[:end])
+                self.appends += 1
+                return knowledge_base
+        # Rewritten, or too much was appended: the whole timetable is read again
+        knowledge_base = BusKnowledgeBase.from_lines(data.decode().splitlines())
+        if self.artifact_path is not None:
+            compile_models(self.artifact_path, knowledge_base)
+            artifact = open_artifact(self.artifact_path, MODEL_SOURCES)
+            if artifact is not None:
+                knowledge_base = artifact.knowledge_base()
+        self.base = knowledge_base
+        self.appended = []
+        self.data_size = len(data)
+        self.data_crc = zlib.crc32(data)
+        self.rebuilds += 1
+        return knowledge_base
+
+    def start(self):
+        # Check the files every interval seconds in a daemon thread
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        return {"reloads": self.reloads, "appends": self.appends, "rebuilds": self.rebuilds,
+                "appended_facts": sum(len(layer) for layer in self.appended), "errors": self.errors,
+                "last_error": self.last_error}
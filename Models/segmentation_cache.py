@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SEGMENTER_PATH = "../Assignment/Models/wordsegmenter/"
+SEGMENTATION_CACHE_PATH = SEGMENTER_PATH + "segmentation_cache.sqlite"
+# The segmentation only depends on the text and these files
+MODEL_FILES = [SEGMENTER_PATH + "vi-vocab", SEGMENTER_PATH + "wordsegmenter.rdr"]
+
+
+def model_hash(model_files=MODEL_FILES):
+    digest = hashlib.sha1()
+    for path in model_files:
+        digest.update(os.path.basename(path).encode("utf-8"))
+        try:
+            with open(path, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 16), b""):
+                    digest.update(block)
+        except OSError:
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+
+class SegmentationCache:
+    """
+    Word segmentation results kept in an SQLite file, shared by runs and worker processes.
+    Entries are keyed by the text and a hash of the segmenter model,
+    the least recently used ones are deleted when there are more than max_entries.
+    """
+
+    def __init__(self, path=SEGMENTATION_CACHE_PATH, max_entries=1000000, model_files=MODEL_FILES):
+        self.path = path
+        self.max_entries = max_entries
+        self.model = model_hash(model_files)
+        self.hits = self.misses = 0
+        self._local = threading.local()
+        # Rows added since the size was last checked
+        self._added = 0
+        self._lock = threading.Lock()
+        self._connection().execute("CREATE TABLE IF NOT EXISTS segments ("
+                                   "model TEXT, text TEXT, sentences TEXT, last_used REAL, "
+                                   "PRIMARY KEY (model, text))")
+        self._connection().execute("CREATE INDEX IF NOT EXISTS segments_last_used ON segments (last_used)")
+        self._connection().commit()
+
+    def _connection(self):
+        # One connection per thread and per process, SQLite connections cannot be shared
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get_many(self, texts):
+        """
+        :return: dict text -> sentences for the texts found in the cache
+        """
+        found = {}
+        unique_texts = list(dict.fromkeys(texts))
+        connection = self._connection()
+        # Stay under the SQLite limit of variables in one statement
+        for start in range(0, len(unique_texts), 500):
+            part = unique_texts[start:start + 500]
+            rows = connection.execute("SELECT text, sentences FROM segments WHERE model = ? AND text IN (%s)"
+                                      % ",".join("?" * len(part)), [self.model] + part).fetchall()
+            for text, sentences in rows:
+                found[text] = json.loads(sentences)
+        if found:
+            now = time.time()
+            connection.executemany("UPDATE segments SET last_used = ? WHERE model = ? AND text = ?",
+                                   [(now, self.model, text) for text in found])
+            connection.commit()
+        with self._lock:
+            self.hits += sum(1 for text in texts if text in found)
+            self.misses += sum(1 for text in texts if text not in found)
+        return found
+
+    def put_many(self, segmented):
+        """
+        :param segmented: dict text -> sentences, as the segmenter gave them
+        """
+        if not segmented:
+            return
+        now = time.time()
+        connection = self._connection()
+        connection.executemany("INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?)",
+                               [(self.model, text, json.dumps(sentences, ensure_ascii=False), now)
+                                for text, sentences in segmented.items()])
+        connection.commit()
+        with self._lock:
+            self._added += len(segmented)
+            check_size = self._added >= max(1, self.max_entries // 100)
+            if check_size:
+                self._added = 0
+        if check_size:
+            self.evict()
+
+    def evict(self):
+        # Delete the least recently used rows, down to 90% of max_entries
+        connection = self._connection()
+        count = connection.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+        if count <= self.max_entries:
+            return 0
+        extra = count - int(self.max_entries * 0.9)
+        connection.execute("DELETE FROM segments WHERE rowid IN "
+                           "(SELECT rowid FROM segments ORDER BY last_used LIMIT ?)", (extra,))
+        connection.commit()
+        return extra
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM segments WHERE model = ?", (self.model,)).fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,247 @@
+import atexit
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from Models.dictionary_segmenter import get_dictionary_segmenter
+from Models.segmentation_cache import SegmentationCache, SEGMENTATION_CACHE_PATH
+
+PATH_TO_JAR = "../Assignment/VnCoreNLP-1.1.1.jar"
+# Sentence used to check that a segmenter still answers
+PROBE_TEXT = "xe buýt nào đi từ huế"
+# Word put between the texts of a batch, it is never merged with its neighbours
+BATCH_SEPARATOR = "qqbatchqq"
+
+
+def create_vncorenlp(path_to_jar=PATH_TO_JAR, max_heap_size='-Xmx2g'):
+    # Imported here so that importing the parser does not need the JVM
+    from vncorenlp import VnCoreNLP
+    return VnCoreNLP(path_to_jar, annotators="wseg", max_heap_size=max_heap_size)
+
+
+class SegmenterPool:
+    """
+    A pool of word segmenters, started on first use.
+    Each segmenter is only used by one thread at a time, dead ones are restarted.
+    """
+
+    def __init__(self, size=1, path_to_jar=PATH_TO_JAR, max_heap_size='-Xmx2g', factory=None, cache=None,
+                 fast_segmenter=None):
+        """
+        :param size: number of segmenter instances
+        :param factory: function creating one segmenter, VnCoreNLP by default
+        :param cache: SegmentationCache used by tokenize_batch, None to always segment
+        :param fast_segmenter: DictionarySegmenter tried first by tokenize_batch, the texts it is not sure of go to
+        the cache and the pool, None to segment everything with the pool
+        """
+        if size < 1:
+            raise ValueError("The pool needs at least one segmenter")
+        self.size = size
+        self.factory = factory or (lambda: create_vncorenlp(path_to_jar, max_heap_size))
+        self.cache = cache
+        self.fast_segmenter = fast_segmenter
+        # Texts segmented by fast_segmenter, and the ones it left to the pool
+        self.fast_segmented = 0
+        self.fallbacks = 0
+        self._idle = queue.Queue()
+        self._instances = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    @property
+    def started(self):
+        return self._started
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.size):
+                instance = self.factory()
+                self._instances.append(instance)
+                self._idle.put(instance)
+            self._started = True
+            atexit.register(self.shutdown)
+
+    @contextmanager
+    def instance(self):
+        """
+        Borrow one segmenter, waiting when all of them are busy
+        """
+        if not self._started:
+            self.start()
+        instance = self._idle.get()
+        try:
+            yield instance
+        finally:
+            self._idle.put(instance)
+
+    def tokenize(self, text):
+        """
+        Segment the text, the result is a list of sentences, each a list of words
+        """
+        if not self._started:
+            self.start()
+        instance = self._idle.get()
+        try:
+            return instance.tokenize(text)
+        except Exception:
+            # The backend may have died, restart it and try once more
+            instance = self._restart(instance)
+            return instance.tokenize(text)
+        finally:
+            self._idle.put(instance)
+
+    def tokenize_batch(self, texts, max_batch=256):
+        """
+        Segment many texts with one request per max_batch texts, texts segmented in this process or found in the
+        cache are not sent
+        :param texts: list of texts
+        :return: one list of sentences for each text, as tokenize would give
+        """
+        fast = {}
+        if self.fast_segmenter is not None:
+            for text in dict.fromkeys(texts):
+                sentences = self.fast_segmenter.try_tokenize(text)
+                if sentences is not None:
+                    fast[text] = sentences
+            with self._lock:
+                self.fast_segmented += len(fast)
+                self.fallbacks += len(set(texts)) - len(fast)
+        rest = [text for text in texts if text not in fast]
+        if not rest:
+            return [fast[text] for text in texts]
+        cached = self.cache.get_many(rest) if self.cache is not None and rest else {}
+        missing = [text for text in dict.fromkeys(rest) if text not in cached]
+        segmented = {}
+        for start in range(0, len(missing), max_batch):
+            chunk = missing[start:start + max_batch]
+            segmented.update(zip(chunk, self._tokenize_chunk(chunk)))
+        if self.cache is not None:
+            self.cache.put_many(segmented)
+        return [fast[text] if text in fast else cached[text] if text in cached else segmented[text]
+                for text in texts]
+
+    def _tokenize_chunk(self, texts):
+        if len(texts) == 1:
+            return [self.tokenize(texts[0])]
+        # The separator stands alone on its line so it ends the sentence before it
+        sentences = self.tokenize(("\n" + BATCH_SEPARATOR + "\n").join(texts))
+        results = [[]]
+        for sentence in sentences:
+            current = []
+            for word in sentence:
+                if word == BATCH_SEPARATOR:
+                    if current:
+                        results[-1].append(current)
+                    current = []
+                    results.append([])
+                else:
+                    current.append(word)
+            if current:
+                results[-1].append(current)
+        if len(results) != len(texts):
+            # The separator was not kept as a word, segment the texts one by one
+            return [self.tokenize(text) for text in texts]
+        return results
+
+    def stats(self):
+        return {"size": self.size, "started": self._started, "fast_segmented": self.fast_segmented,
+                "fallbacks": self.fallbacks}
+
+    def health_check(self):
+        """
+        Probe every idle segmenter and restart the ones that do not answer
+        :return: number of restarted segmenters
+        """
+        if not self._started:
+            return 0
+        restarted = 0
+        for _ in range(self.size):
+            try:
+                instance = self._idle.get_nowait()
+            except queue.Empty:
+                # The others are busy, so they are in use right now
+                break
+            try:
+                instance.tokenize(PROBE_TEXT)
+            except Exception:
+                instance = self._restart(instance)
+                restarted += 1
+            finally:
+                self._idle.put(instance)
+        return restarted
+
+    def _restart(self, instance):
+        self._close(instance)
+        new_instance = self.factory()
+        with self._lock:
+            self._instances = [new_instance if item is instance else item for item in self._instances]
+        return new_instance
+
+    @staticmethod
+    def _close(instance):
+        close = getattr(instance, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+    def shutdown(self):
+        with self._lock:
+            if not self._started:
+                return
+            for instance in self._instances:
+                self._close(instance)
+            self._instances = []
+            self._idle = queue.Queue()
+            self._started = False
+        atexit.unregister(self.shutdown)
+
+
+_segmenter = None
+
+
+def open_segmentation_cache(path=SEGMENTATION_CACHE_PATH):
+    # Segmenting still works when the cache file cannot be opened
+    if path is None:
+        return None
+    try:
+        return SegmentationCache(path)
+    except (sqlite3.Error, OSError):
+        return None
+
+
+def open_dictionary_segmenter(fast_path=True):
+    # Without vi-vocab or the rules every text goes to VnCoreNLP
+    if not fast_path:
+        return None
+    try:
+        return get_dictionary_segmenter()
+    except (OSError, ValueError):
+        return None
+
+
+def configure_segmenter(size=1, path_to_jar=PATH_TO_JAR, max_heap_size='-Xmx2g', factory=None,
+                        cache_path=SEGMENTATION_CACHE_PATH, fast_path=True):
+    """
+    Replace the shared segmenter pool, the old one is shut down
+    :param cache_path: SQLite file of the segmentation cache, None to turn the cache off
+    :param fast_path: segment the texts in this process when the dictionary is sure of them, see DictionarySegmenter
+    """
+    global _segmenter
+    if _segmenter is not None:
+        _segmenter.shutdown()
+    _segmenter = SegmenterPool(size, path_to_jar, max_heap_size, factory, open_segmentation_cache(cache_path),
+                               open_dictionary_segmenter(fast_path))
+    return _segmenter
+
+
+def get_segmenter():
+    # Nothing is started until the first sentence is segmented, the JVM only for a text the dictionary is not sure of
+    global _segmenter
+    if _segmenter is None:
+        _segmenter = SegmenterPool(cache=open_segmentation_cache(), fast_segmenter=open_dictionary_segmenter())
+    return _segmenter
@@ -0,0 +1,171 @@
+from Models.knowledge_base import BusKnowledgeBase, DATA_PATH
+from Models.parser import ProcessText, load_models, disable_answer_cache, enable_metrics, disable_metrics, TRACE_OFF
+from Models.segmenter import configure_segmenter
+from benchmarks.generator import Timetable, generate_questions
+from benchmarks.stub_segmenter import StubSegmenter
+from contextlib import redirect_stdout
+from itertools import islice
+import argparse
+import hashlib
+import json
+import os
+import platform
+import sys
+import time
+
+BASELINE_PATH = "../Assignment/benchmarks/baselines/"
+STAGES = ["preprocessing", "parsing", "grammar_relation", "logical_form", "procedure_form", "get_query_answer"]
+
+
+def parse_count(text):
+    # 1000, 10k or 1M
+    multiplier = {"k": 1000, "m": 1000000}.get(text[-1:].lower(), 1)
+    return int(text[:-1] if multiplier > 1 else text) * multiplier
+
+
+def timed(timings, stage, function, items):
+    start = time.perf_counter()
+    results = [function(item) for item in items]
+    timings[stage] += time.perf_counter() - start
+    return results
+
+
+def run_benchmark(questions, knowledge_base, chunk_size=10000):
+    """
+    Answer the questions one stage at a time, chunk_size questions at once
+    :return: seconds spent in each stage, number of questions and a digest of the answers
+    """
+    timings = dict.fromkeys(STAGES, 0.0)
+    digest = hashlib.sha1()
+    count = 0
+    questions = iter(questions)
+    while True:
+        chunk = list(islice(questions, chunk_size))
+        if not chunk:
+            break
+        start = time.perf_counter()
+        # complete_sentence prints every question
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            words = ProcessText.preprocess_batch(chunk)
+        timings["preprocessing"] += time.perf_counter() - start
+        arcs = timed(timings, "parsing", ProcessText.parsing, words)
+        trees = timed(timings, "grammar_relation", ProcessText.grammar_relation, arcs)
+        logical_forms = timed(timings, "logical_form", ProcessText.logical_form, trees)
+        plans = timed(timings, "procedure_form", ProcessText.procedure_form, logical_forms)
+        answers = timed(timings, "get_query_answer",
+                        lambda item: ProcessText.get_query_answer(item[0], item[1], knowledge_base),
+                        list(zip(plans, chunk)))
+        for answer in answers:
+            digest.update(answer.encode("utf-8") + b"\n")
+        count += len(chunk)
+    return timings, count, digest.hexdigest()
+
+
+def fast_segmenter_used(args):
+    # The stub stands for the whole segmenter, the dictionary segmenter would hide it
+    return not args.stub_segmenter and not args.no_fast_segmenter
+
+
+def make_report(timings, count, answers_digest, counters, args):
+    stages = {stage: seconds * 1e6 / max(count, 1) for stage, seconds in timings.items()}
+    return {"questions": count, "seed": args.seed, "data": os.path.basename(args.data),
+            "stub_segmenter": args.stub_segmenter, "fast_segmenter": fast_segmenter_used(args),
+            "python": platform.python_version(),
+            "microseconds_per_question": stages, "total_microseconds_per_question": sum(stages.values()),
+            "answers_sha1": answers_digest, "counters": dict(sorted(counters.items()))}
+
+
+def print_report(report, baseline=None):
+    print(f"{report['questions']} questions, stub segmenter: {report['stub_segmenter']}, "
+          f"fast segmenter: {report.get('fast_segmenter', False)}")
+    header = f"{'STAGE':<20} {'us/question':>12} {'questions/s':>14}"
+    print(header + (f" {'baseline':>12} {'change':>8}" if baseline is not None else ""))
+    stages = report["microseconds_per_question"]
+    for stage in STAGES + ["total"]:
+        value = stages[stage] if stage != "total" else report["total_microseconds_per_question"]
+        line = f"{stage:<20} {value:>12.1f} {1e6 / value if value else 0:>14.0f}"
+        if baseline is not None:
+            base = baseline["microseconds_per_question"][stage] if stage != "total" \
+                else baseline["total_microseconds_per_question"]
+            line += f" {base:>12.1f} {(value / base - 1) * 100 if base else 0:>+7.1f}%"
+        print(line)
+
+
+def compare(report, baseline, tolerance, check_timings=False):
+    """
+    :param check_timings: also compare the time of each stage, only meaningful with a baseline saved on this machine
+    :return: list of problems, different answers to the same questions, counters higher than the baseline,
+             and with check_timings the stages slower than the baseline by more than tolerance
+    """
+    problems = []
+    if check_timings:
+        for stage in STAGES:
+            base = baseline["microseconds_per_question"][stage]
+            value = report["microseconds_per_question"][stage]
+            if base and value > base * (1 + tolerance):
+                problems.append(f"{stage} is {(value / base - 1) * 100:.1f}% slower than the baseline")
+    same_questions = all(report[key] == baseline[key] for key in ["questions", "seed", "data"])
+    if same_questions:
+        if report["answers_sha1"] != baseline["answers_sha1"]:
+            problems.append("the answers differ from the baseline")
+        # The transitions of the parser and the facts looked at do not depend on the machine
+        for name, base in baseline.get("counters", {}).items():
+            value = report["counters"].get(name, 0)
+            if value > base:
+                problems.append(f"{name} is {value} instead of {base} in the baseline")
+    return problems
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(usage="python -m benchmarks.bench [--questions 10k] [--stub-segmenter]")
+    arg_parser.add_argument("--questions", type=parse_count, default=1000)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    # Timetable the questions are made from and answered with
+    arg_parser.add_argument("--data", default=DATA_PATH)
+    # Segment without the JVM, so the other stages are not hidden behind it
+    arg_parser.add_argument("--stub-segmenter", action="store_true")
+    # Segment every question with VnCoreNLP, without the dictionary segmenter in this process
+    arg_parser.add_argument("--no-fast-segmenter", action="store_true")
+    arg_parser.add_argument("--chunk-size", type=int, default=10000)
+    # Compare with / save to benchmarks/baselines/<name>.json
+    arg_parser.add_argument("--baseline")
+    arg_parser.add_argument("--save-baseline")
+    # Also fail when a stage is slower than the baseline, which must then have been saved on this machine
+    arg_parser.add_argument("--check-timings", action="store_true")
+    # Allowed slowdown of a stage before it counts as a regression
+    arg_parser.add_argument("--tolerance", type=float, default=0.2)
+    args = arg_parser.parse_args()
+
+    load_models(TRACE_OFF)
+    disable_answer_cache()
+    # Segmentation cache off, every question is segmented
+    configure_segmenter(1, factory=StubSegmenter if args.stub_segmenter else None, cache_path=None,
+                        fast_path=fast_segmenter_used(args))
+    knowledge_base = BusKnowledgeBase.from_file(args.data)
+    questions = generate_questions(args.questions, Timetable(knowledge_base), args.seed)
+
+    # For the counters, the stages are timed by run_benchmark
+    metrics = enable_metrics()
+    timings, count, answers_digest = run_benchmark(questions, knowledge_base, args.chunk_size)
+    disable_metrics()
+    report = make_report(timings, count, answers_digest, metrics.counters, args)
+
+    baseline = None
+    if args.baseline:
+        with open(BASELINE_PATH + args.baseline + ".json", 'r') as file:
+            baseline = json.load(file)
+    print_report(report, baseline)
+    if args.save_baseline:
+        with open(BASELINE_PATH + args.save_baseline + ".json", 'w') as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+    if baseline is not None:
+        problems = compare(report, baseline, args.tolerance, args.check_timings)
+        for problem in problems:
+            print("REGRESSION: " + problem)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
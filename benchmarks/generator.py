@@ -0,0 +1,78 @@
+import random
+
+from Models.knowledge_base import BusKnowledgeBase, DATA_PATH
+from Models.parser import city_name_decode
+
+# Question forms of Input/1.txt and the README, filled with names and times of the timetable
+TEMPLATES = [
+    "Xe buýt nào đi từ {source}?",
+    "Xe buýt nào đi từ thành phố {source}?",
+    "Xe buýt nào đến thành phố {destination}?",
+    "Xe buýt nào đến thành phố {destination} lúc {arrive} HR?",
+    "Xe buýt nào đến lúc {arrive} HR?",
+    "Xe buýt nào từ {source} lúc {leave} HR?",
+    "Xe buýt nào đi từ lúc {leave} HR?",
+    "Xe buýt nào từ {source} lúc {leave} HR đến thành phố {destination} lúc {arrive} HR ?",
+    "Xe buýt nào đến thành phố {destination} lúc {arrive} HR từ {source} lúc {leave} HR ?",
+    "Xe buýt nào đến {destination} từ {source} ?",
+    "Xe bus nào lăn bánh tới {destination} lúc {spoken_arrive} ?",
+    "Xe buýt {bus} đi từ đâu?",
+    "Xe buýt {bus} đến đâu?",
+    "Xe buýt {bus} đi đến đâu?",
+    "Xe buýt {bus} đi từ đâu đến đâu?",
+    "Xe buýt {bus} đến đâu từ đâu ?",
+    "Xe buýt {bus} đến lúc nào?",
+    "Xe buýt {bus} đi từ lúc nào?",
+    "Xe buýt {bus} đi từ lúc nào đến lúc nào?",
+    "Xe buýt {bus} đi từ thành phố {source} lúc nào?",
+    "Xe buýt {bus} đi từ lúc nào đến {destination}?",
+    "Xe buýt {bus} đi hết bao lâu?",
+    "Xe buýt {bus} đi từ {source} hết bao lâu?",
+    "Xe buýt {bus} đi từ {source} đến {destination} hết bao lâu?",
+    "Thời gian xe buýt {bus} từ {source} đến {destination} ?",
+]
+
+
+def spoken_time(time):
+    # 22:30 -> "10 giờ rưỡi tối", as people say it
+    hour, minute = [int(part) for part in time.split(":")]
+    period = "sáng" if hour < 12 else "chiều" if hour < 18 else "tối"
+    if hour > 12:
+        hour -= 12
+    return str(hour) + " giờ" + (" rưỡi" if minute == 30 else "") + " " + period
+
+
+class Timetable:
+    """
+    The names and times questions are made of, taken from a knowledge base
+    """
+
+    def __init__(self, knowledge_base):
+        self.buses = knowledge_base.train_names
+        # Codes without a name, such as a typo in the data, cannot be asked about
+        self.cities = [city_name_decode(code) for code in knowledge_base.cities if city_name_decode(code)]
+        self.leave_times = list(dict.fromkeys(fact.time[:-2] for fact in knowledge_base.dtimes))
+        self.arrive_times = list(dict.fromkeys(fact.time[:-2] for fact in knowledge_base.atimes))
+
+    @classmethod
+    def from_file(cls, path=DATA_PATH):
+        return cls(BusKnowledgeBase.from_file(path))
+
+
+def generate_questions(count, timetable=None, seed=0, templates=TEMPLATES):
+    """
+    :param count: number of questions
+    :param timetable: the Timetable to ask about, data.txt by default
+    :param seed: the same seed always gives the same questions
+    :return: generator of questions
+    """
+    if timetable is None:
+        timetable = Timetable.from_file()
+    rng = random.Random(seed)
+    for _ in range(count):
+        source, destination = rng.sample(timetable.cities, 2) if len(timetable.cities) > 1 \
+            else timetable.cities * 2
+        arrive = rng.choice(timetable.arrive_times)
+        yield rng.choice(templates).format(source=source, destination=destination, bus=rng.choice(timetable.buses),
+                                           leave=rng.choice(timetable.leave_times), arrive=arrive,
+                                           spoken_arrive=spoken_time(arrive))
@@ -0,0 +1,100 @@
+from benchmarks.bench import parse_count
+from benchmarks.timetable import FACTS_PER_BUS, build_knowledge_base, generate_timetable
+from Models.artifact import ModelArtifact, write_artifact
+from Models.parser import ProcessText, load_models, TRACE_OFF
+from Models.query import compile_plan, evaluate
+import argparse
+import gc
+import random
+import sys
+import time
+
+# Selective questions, their answers do not grow with the timetable
+QUERIES = {
+    "bus source": "PRINT-ALL\n?sr (DTIME {bus} ?sr ?dt)\n",
+    "bus run time": "PRINT-ALL\n?rt (RUN-TIME {bus} ?sr ?de ?rt)\n",
+    "city at time": "PRINT-ALL\n?tr (TRAIN ?tr)\n(DTIME ?tr {source} {leave})\n",
+    "city window": "PRINT-ALL\n?tr (TRAIN ?tr)\n(DTIME ?tr {source} {leave}..{leave})\n",
+    "bus route": "PRINT-ALL\n?sr ?de (RUN-TIME {bus} ?sr ?de ?rt)\n(DTIME {bus} ?sr ?dt)\n(ATIME {bus} ?de ?at)\n",
+}
+
+
+def measure(knowledge_base, queries, count, seed=0, candidates=None):
+    """
+    Answer count questions of each shape about random buses, cities and times of the knowledge base
+    :param candidates: dict filled with shape -> mean number of facts a question looks at, not timed
+    :return: dict of shape -> median microseconds per question
+    """
+    rng = random.Random(seed)
+    departures = knowledge_base.dtimes
+    result = {}
+    for name, template in queries.items():
+        plans = []
+        for _ in range(count):
+            departure = rng.choice(departures)
+            plans.append(compile_plan(template.format(bus=departure.train, source=departure.city,
+                                                      leave=departure.time)))
+        if candidates is not None:
+            stats = {}
+            for plan in plans:
+                evaluate(plan, knowledge_base, stats)
+            candidates[name] = stats.get("candidates", 0) / count
+        times = []
+        for plan in plans:
+            start = time.perf_counter()
+            ProcessText.get_query_answer(plan, "", knowledge_base)
+            times.append(time.perf_counter() - start)
+        times.sort()
+        result[name] = times[len(times) // 2] * 1e6
+    return result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(usage="python -m benchmarks.scaling [--max-facts 1M] [--check 2]")
+    arg_parser.add_argument("--min-facts", type=parse_count, default=10)
+    arg_parser.add_argument("--max-facts", type=parse_count, default=1000000)
+    arg_parser.add_argument("--queries", type=int, default=2000)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    # Write each timetable to this artifact and ask the mapped knowledge base, with the time to map it
+    arg_parser.add_argument("--artifact")
+    # Fail when a question gets this many times slower each time the timetable grows tenfold
+    arg_parser.add_argument("--check", type=float)
+    args = arg_parser.parse_args()
+
+    load_models(TRACE_OFF)
+    sizes = []
+    facts = args.min_facts
+    while facts <= args.max_facts:
+        sizes.append(facts)
+        facts *= 10
+
+    print(f"{'FACTS':>10} " + " ".join(f"{name:>14}" for name in QUERIES) + "  (us/question, median)"
+          + ("  map ms" if args.artifact else ""))
+    results = []
+    for facts in sizes:
+        knowledge_base = build_knowledge_base(generate_timetable(max(1, facts // FACTS_PER_BUS), seed=args.seed))
+        map_time = ""
+        if args.artifact:
+            write_artifact(args.artifact, knowledge_base, {}, [])
+            # The objects of the timetable in memory are not part of the time to map the artifact
+            del knowledge_base
+            gc.collect()
+            start = time.perf_counter()
+            knowledge_base = ModelArtifact(args.artifact).knowledge_base()
+            map_time = f"  {(time.perf_counter() - start) * 1000:>6.2f}"
+        result = measure(knowledge_base, QUERIES, args.queries, args.seed)
+        results.append(result)
+        print(f"{len(knowledge_base):>10} " + " ".join(f"{result[name]:>14.1f}" for name in QUERIES) + map_time)
+
+    if args.check is not None:
+        problems = [f"{name} is {after[name] / before[name]:.1f} times slower on {size} facts than on {size // 10}"
+                    for before, after, size in zip(results, results[1:], sizes[1:])
+                    for name in QUERIES if after[name] > before[name] * args.check]
+        for problem in problems:
+            print("REGRESSION: " + problem)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+from Models.parser import RELATIONS_PATH, CITY_PATH
+
+
+class StubSegmenter:
+    """
+    Word segmenter without the JVM, for measuring the other stages.
+    Joins the longest run of syllables which is a word of relations.txt or city.txt, e.g. "xe buýt" -> xe_buýt,
+    and splits "?" off the last word. It only knows the words of the grammar, which is all the parser needs.
+    """
+
+    def __init__(self, relations_path=RELATIONS_PATH, city_path=CITY_PATH):
+        words = {"thành_phố"}
+        with open(relations_path, 'r') as file:
+            for line in file:
+                words.update(line.split()[1:])
+        with open(city_path, 'r') as file:
+            words.update(file.read().split())
+        # First syllable -> syllable tuples of the compound words starting with it, the longest first
+        self.compounds = {}
+        for word in words:
+            syllables = tuple(word.split("_"))
+            if len(syllables) > 1:
+                self.compounds.setdefault(syllables[0], []).append(syllables)
+        for candidates in self.compounds.values():
+            candidates.sort(key=len, reverse=True)
+
+    def tokenize(self, text):
+        """
+        :return: one sentence for each line of the text, as VnCoreNLP gives them
+        """
+        return [self.segment(line) for line in text.split("\n") if line.strip() != ""]
+
+    def segment(self, line):
+        syllables = line.replace("?", " ? ").split()
+        words = []
+        idx = 0
+        while idx < len(syllables):
+            for candidate in self.compounds.get(syllables[idx], []):
+                if tuple(syllables[idx:idx + len(candidate)]) == candidate:
+                    words.append("_".join(candidate))
+                    idx += len(candidate)
+                    break
+            else:
+                words.append(syllables[idx])
+                idx += 1
+        return words
+
+    def close(self):
+        pass
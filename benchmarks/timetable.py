@@ -0,0 +1,69 @@
+from benchmarks.bench import parse_count
+from Models.knowledge_base import BusKnowledgeBase
+import argparse
+import random
+
+# Codes of city_codes.txt, the first cities of every synthetic timetable so its questions can name them
+REAL_CITIES = ["HCMC", "HN", "HUE", "DANANG"]
+# TRAIN, DTIME, ATIME and RUN-TIME of each bus
+FACTS_PER_BUS = 4
+
+
+def format_time(minutes):
+    # 1350 -> 22:30HR, as written in data.txt
+    return f"{minutes // 60}:{minutes % 60:02d}HR"
+
+
+def city_codes(count):
+    return REAL_CITIES[:count] + [f"C{idx:05d}" for idx in range(count - len(REAL_CITIES))]
+
+
+def default_city_count(bus_count):
+    # About a hundred buses per city, as many cities as a network of that size would have
+    return max(len(REAL_CITIES), bus_count // 100)
+
+
+def generate_timetable(bus_count, city_count=None, seed=0):
+    """
+    A random timetable in the form of data.txt: each bus leaves a city on the hour or half hour
+    and runs to another city in 1 to 12 hours
+    :param bus_count: number of buses, each one gives FACTS_PER_BUS facts
+    :param city_count: number of cities, default_city_count by default
+    :param seed: the same seed always gives the same timetable
+    :return: generator of the lines
+    """
+    rng = random.Random(seed)
+    cities = city_codes(city_count or default_city_count(bus_count))
+    for idx in range(bus_count):
+        bus = f"B{idx + 1}"
+        source, destination = rng.sample(cities, 2)
+        leave = rng.randrange(48) * 30
+        run_time = rng.randrange(2, 25) * 30
+        yield f"(TRAIN {bus})"
+        yield f"(DTIME {bus} {source} {format_time(leave)})"
+        yield f"(ATIME {bus} {destination} {format_time((leave + run_time) % (24 * 60))})"
+        yield f"(RUN-TIME {bus} {source} {destination} {format_time(run_time)})"
+
+
+def build_knowledge_base(lines):
+    knowledge_base = BusKnowledgeBase()
+    for line in lines:
+        knowledge_base.add(BusKnowledgeBase.parse_fact(line))
+    return knowledge_base
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(usage="python -m benchmarks.timetable --facts 1M --out big.txt")
+    arg_parser.add_argument("--facts", type=parse_count, default=1000)
+    arg_parser.add_argument("--cities", type=int)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--out", required=True)
+    args = arg_parser.parse_args()
+
+    with open(args.out, 'w') as file:
+        for line in generate_timetable(max(1, args.facts // FACTS_PER_BUS), args.cities, args.seed):
+            file.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,77 @@
-from Models.parser import process
+from Models.parser import process_batch, process_stream, question_lines, batched, load_models, load_artifact, \
+    enable_answer_cache, enable_metrics, ARTIFACT_PATH, TRACE_LEVELS, TRACE_FULL
+from Models.output import OutputSink, MemorySink, STAGES
+from Models.segmenter import configure_segmenter
+from collections import deque
+from multiprocessing import Pool
+import argparse
 import sys
 
+
+def init_worker(trace_level, cache_size, artifact_path=ARTIFACT_PATH, fast_segmenter=True):
+    # Each worker process has its own segmenter and models, the artifact is mapped by all of them.
+    # With the fast path a worker only starts its JVM for a question the dictionary is not sure of
+    configure_segmenter(1, fast_path=fast_segmenter)
+    load_models(trace_level, artifact_path)
+    if cache_size > 0:
+        enable_answer_cache(cache_size)
+
+
+def answer_chunk(chunk, stages):
+    # Run in a worker, the output is sent back so the parent writes it in input order
+    capture = MemorySink(stages)
+    answers = process_batch(chunk, capture)
+    return answers, capture.getvalues()
+
+
+def answer_in_workers(batches, stages, workers, trace_level, cache_size=0, artifact_path=ARTIFACT_PATH,
+                      fast_segmenter=True):
+    """
+    Answer the batches in a process pool
+    :return: generator of (batch, answers, stage outputs), in input order
+    """
+    if artifact_path is not None:
+        # Compiled once here if out of date, so the workers only map it
+        load_artifact(artifact_path)
+    with Pool(workers, initializer=init_worker, initargs=(trace_level, cache_size, artifact_path,
+                                                                  fast_segmenter)) as pool:
+        # Only a few batches are in flight, so a long input is never read at once
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, pool.apply_async(answer_chunk, (batch, stages))))
+            if len(pending) >= 2 * workers:
+                batch, result = pending.popleft()
+                yield (batch,) + result.get()
+        while pending:
+            batch, result = pending.popleft()
+            yield (batch,) + result.get()
+
+
 def main():
-    if len(sys.argv) < 2:
-        raise Exception("Usage: python main.py <input file name>")
+    arg_parser = argparse.ArgumentParser(usage="python main.py <input file name>")
+    # "-" reads the questions from stdin and prints each answer as soon as it is found
+    arg_parser.add_argument("input_file_name")
+    # The parser derivation table of output_a.txt, "off" skips it
+    arg_parser.add_argument("--trace", choices=TRACE_LEVELS, default=TRACE_FULL)
+    # Output files to write, e.g. --outputs bf for the arcs and the answers only
+    arg_parser.add_argument("--outputs", default="".join(STAGES))
+    # Number of worker processes, the output files stay the same as with one
+    arg_parser.add_argument("--workers", type=int, default=1)
+    # Answers of repeated questions kept in memory, 0 turns the cache off
+    arg_parser.add_argument("--cache-size", type=int, default=0)
+    # Print the time of each stage at the end, and profile a fraction of the questions
+    arg_parser.add_argument("--metrics", action="store_true")
+    arg_parser.add_argument("--profile-rate", type=float, default=0.0)
+    # Read the text files of Models instead of the compiled artifact
+    arg_parser.add_argument("--no-artifact", action="store_true")
+    # Segment every question with VnCoreNLP, without the dictionary segmenter in this process
+    arg_parser.add_argument("--no-fast-segmenter", action="store_true")
+    args = arg_parser.parse_args()
+    artifact_path = None if args.no_artifact else ARTIFACT_PATH
+    if args.metrics and args.workers > 1:
+        arg_parser.error("--metrics only measures questions answered in this process, run it without --workers")
     input_file_path = "../Assignment/Input/"
-    input_file_name = sys.argv[1]
+    input_file_name = args.input_file_name
 
 
     # text = "buýt b1 từ hà nội đến bến nào"
@@ -14,22 +80,45 @@ def main():
     # print(newtext)
     # # print(text.replace("chuyến xe buýt", "chuyến xe buýt"))
 
-    with open(input_file_path+input_file_name, 'r') as input_file:
-        questions = input_file.read().splitlines()
-
-    open("../Assignment/Output/output_a.txt", 'w').close()
-    open("../Assignment/Output/output_b.txt", 'w').close()
-    open("../Assignment/Output/output_c.txt", 'w').close()
-    open("../Assignment/Output/output_d.txt", 'w').close()
-    open("../Assignment/Output/output_e.txt", 'w').close()
-    open("../Assignment/Output/output_f.txt", 'w').close()
+    from_stdin = input_file_name == "-"
+    input_file = sys.stdin if from_stdin else open(input_file_path + input_file_name, 'r')
+    # Questions are sent to the word segmenter in batches, one by one when reading stdin
+    batch_size = 1 if from_stdin else 64
 
     print("Start processing!")
-    for ques in questions:
-        print(ques)
-        process(ques)
+    stages = list(args.outputs)
+    # All output files are opened once for the whole run
+    with input_file, OutputSink(stages=stages) as sink:
+        if args.workers > 1:
+            batches = batched(question_lines(input_file), batch_size)
+            for batch, answers, outputs in answer_in_workers(batches, stages, args.workers, args.trace,
+                                                                   args.cache_size, artifact_path,
+                                                                   not args.no_fast_segmenter):
+                for stage in STAGES:
+                    if outputs.get(stage):
+                        sink.write(stage, outputs[stage])
+                for ques, answer in zip(batch, answers):
+                    print(ques)
+                    if from_stdin:
+                        print(answer, flush=True)
+        else:
+            if args.no_fast_segmenter:
+                configure_segmenter(1, fast_path=False)
+            # Load the timetable once before answering
+            load_models(args.trace, artifact_path)
+            if args.cache_size > 0:
+                enable_answer_cache(args.cache_size)
+            metrics = enable_metrics(profile_rate=args.profile_rate) if args.metrics else None
+            for ques, answer in process_stream(input_file, sink, batch_size):
+                print(ques)
+                if from_stdin:
+                    print(answer, flush=True)
+            if metrics is not None:
+                print(metrics.report(), file=sys.stderr)
+                for event in metrics.profiles:
+                    print(event.profile, file=sys.stderr)
 
     print("Process completed! Please see Ouput folder for the result")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,310 @@
+from Models.parser import analyze, load_models, enable_answer_cache, enable_metrics, ARTIFACT_PATH
+from Models.reload import ModelReloader
+from Models.segmenter import configure_segmenter
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeoutError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import argparse
+import json
+import queue
+import threading
+import time
+
+
+class QuestionTimeout(TimeoutError):
+    # The question took longer than the server allows, its worker was given up
+    pass
+
+
+class QuestionServer:
+    """
+    Answers questions with warm models.
+    Requests wait in a bounded queue for one of the worker threads, a full queue turns requests away.
+    A worker busy with one question for longer than question_timeout is given up: its question fails with
+    QuestionTimeout and a new worker takes its place, up to max_stuck workers given up at once.
+    """
+
+    def __init__(self, workers=2, queue_size=64, health_check_interval=60.0, cache_size=4096, cache_ttl=None,
+                 metrics=True, profile_rate=0.0, artifact_path=ARTIFACT_PATH, fast_segmenter=True,
+                 reload_interval=1.0, question_timeout=10.0, max_stuck=None):
+        """
+        :param question_timeout: seconds a worker may spend on one question
+        :param max_stuck: workers given up and still running before no more are replaced, workers by default
+        """
+        self.workers = workers
+        self.artifact_path = artifact_path
+        self.fast_segmenter = fast_segmenter
+        self.segmenter = None
+        # Seconds between two checks of the files of Models, 0 to keep the models loaded at start
+        self.reload_interval = reload_interval
+        self.reloader = None
+        # Hot questions are answered from the cache without the segmenter
+        self.cache = enable_answer_cache(cache_size, cache_ttl) if cache_size > 0 else None
+        # Percentiles of each stage for /stats, so a slow request can be put down to a stage
+        self.metrics = enable_metrics(profile_rate=profile_rate, trace_memory=profile_rate > 0) if metrics else None
+        self.requests = queue.Queue(maxsize=queue_size)
+        self.health_check_interval = health_check_interval
+        self.question_timeout = question_timeout
+        self.max_stuck = workers if max_stuck is None else max_stuck
+        self.timeouts = 0
+        self._threads = []
+        # Worker thread -> (start time, future) of the question it is answering
+        self._busy = {}
+        # Workers given up on -> True if another one took their place, then they leave once their question returns
+        self._stuck = {}
+        # Last time a worker took a question from the queue, the queue is stalled when this gets old
+        self._last_taken = time.monotonic()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def start(self):
+        # One segmenter per worker thread. Without the fast path all of them are started now instead of on the first
+        # question, with it the JVMs are only started for a question the dictionary is not sure of
+        segmenter = configure_segmenter(self.workers, fast_path=self.fast_segmenter)
+        if segmenter.fast_segmenter is None:
+            segmenter.start()
+        self.segmenter = segmenter
+        load_models(artifact_path=self.artifact_path)
+        if self.reload_interval > 0:
+            # Timetable updates are applied while serving, without a restart
+            self.reloader = ModelReloader(self.reload_interval, self.artifact_path)
+            self.reloader.start()
+        for _ in range(self.workers):
+            self._start_worker()
+        for target, args in [(self._check_segmenters, (segmenter,)), (self._watch_workers, ())]:
+            thread = threading.Thread(target=target, args=args, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _start_worker(self):
+        thread = threading.Thread(target=self._work, daemon=True)
+        thread.start()
+        with self._lock:
+            self._threads.append(thread)
+
+    def submit(self, question):
+        """
+        :return: a Future of the analyze() result
+        :raise queue.Full: when too many questions are waiting
+        """
+        future = Future()
+        self.requests.put_nowait((question, future))
+        return future
+
+    def _work(self):
+        worker = threading.current_thread()
+        while not self._stopped.is_set():
+            try:
+                question, future = self.requests.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                self._last_taken = time.monotonic()
+                self._busy[worker] = (self._last_taken, future)
+            if future.set_running_or_notify_cancel():
+                try:
+                    result, error = analyze(question), None
+                except Exception as raised:
+                    result, error = None, raised
+                try:
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(error)
+                except InvalidStateError:
+                    # Already failed by _watch_workers
+                    pass
+            with self._lock:
+                self._busy.pop(worker, None)
+                given_up = worker in self._stuck
+                replaced = self._stuck.pop(worker, False)
+                if given_up and not replaced:
+                    # Nobody took its place, it is back in the pool
+                    self._threads.append(worker)
+            self.requests.task_done()
+            if replaced:
+                return
+
+    def _watch_workers(self):
+        # Give up the workers stuck on one question, so one bad question cannot take the pool down
+        while not self._stopped.wait(min(1.0, self.question_timeout / 4)):
+            now = time.monotonic()
+            with self._lock:
+                overdue = [(worker, future) for worker, (started, future) in self._busy.items()
+                           if now - started > self.question_timeout]
+                replace = 0
+                for worker, _ in overdue:
+                    del self._busy[worker]
+                    # Past max_stuck the pool shrinks rather than piling up threads which never return
+                    self._stuck[worker] = sum(self._stuck.values()) < self.max_stuck
+                    # Not waited for by stop, replaced or not
+                    self._threads.remove(worker)
+                    if self._stuck[worker]:
+                        replace += 1
+            for _, future in overdue:
+                self.timeouts += 1
+                try:
+                    future.set_exception(QuestionTimeout(f"no answer within {self.question_timeout} seconds"))
+                except InvalidStateError:
+                    pass
+            for _ in range(replace):
+                self._start_worker()
+
+    def health(self):
+        """
+        :return: dict whose status is "ok", or "unhealthy" when workers are stuck or the queue is not drained
+        """
+        with self._lock:
+            stuck = len(self._stuck)
+            stalled = not self.requests.empty() and time.monotonic() - self._last_taken > self.question_timeout
+        healthy = stuck == 0 and not stalled
+        return {"status": "ok" if healthy else "unhealthy", "waiting": self.requests.qsize(), "stuck_workers": stuck,
+                "queue_stalled": stalled, "timeouts": self.timeouts}
+
+    def _check_segmenters(self, segmenter):
+        while not self._stopped.wait(self.health_check_interval):
+            segmenter.health_check()
+
+    def stop(self):
+        self._stopped.set()
+        if self.reloader is not None:
+            self.reloader.stop()
+        # The workers given up on are not waited for, the others at most for the question they are answering
+        with self._lock:
+            threads = list(self._threads)
+        deadline = time.monotonic() + self.question_timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+
+def to_response(result, details):
+    response = {"question": result["question"], "answer": result["answer"]}
+    if details:
+        response["words"] = result["words"]
+        response["arcs"] = [str(arc) for arc in result["arcs"]]
+        response["logical_form"] = result["logical_form"].to_dict()
+        response["procedure_form"] = str(result["procedure_form"])
+    return response
+
+
+def make_handler(question_server, timeout):
+    class QuestionHandler(BaseHTTPRequestHandler):
+        # GET /answer?q=...&details=1 or POST /answer {"question": ..., "details": true}
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/health":
+                health = question_server.health()
+                self._send(200 if health["status"] == "ok" else 503, health)
+            elif url.path == "/stats":
+                cache = question_server.cache
+                metrics = question_server.metrics
+                segmenter = question_server.segmenter
+                reloader = question_server.reloader
+                self._send(200, {"cache": cache.stats() if cache is not None else None,
+                                 "metrics": metrics.stats() if metrics is not None else None,
+                                 "segmenter": segmenter.stats() if segmenter is not None else None,
+                                 "reload": reloader.stats() if reloader is not None else None})
+            elif url.path == "/profiles":
+                metrics = question_server.metrics
+                profiles = list(metrics.profiles) if metrics is not None else []
+                self._send(200, {"profiles": [event._asdict() for event in profiles]})
+            elif url.path == "/answer":
+                params = parse_qs(url.query)
+                question = params.get("q", [""])[0]
+                details = params.get("details", ["0"])[0] in ["1", "true"]
+                self._answer(question, details)
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/answer":
+                self._send(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send(400, {"error": "the body must be JSON"})
+                return
+            self._answer(body.get("question", ""), bool(body.get("details", False)))
+
+        def _answer(self, question, details):
+            if question.strip() == "":
+                self._send(400, {"error": "no question"})
+                return
+            try:
+                future = question_server.submit(question)
+            except queue.Full:
+                # Backpressure: the client should try again later
+                self._send(503, {"error": "too many questions waiting"})
+                return
+            try:
+                result = future.result(timeout)
+            except (TimeoutError, FutureTimeoutError) as error:
+                future.cancel()
+                self._send(504, {"error": str(error) or "no answer in time"})
+                return
+            except Exception as error:
+                self._send(500, {"error": str(error) or type(error).__name__})
+                return
+            self._send(200, to_response(result, details))
+
+        def _send(self, status, content):
+            data = json.dumps(content, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return QuestionHandler
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(usage="python server.py [--port 8000]")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8000)
+    # Worker threads, each with its own segmenter
+    arg_parser.add_argument("--workers", type=int, default=2)
+    # Questions allowed to wait for a worker before new ones are turned away
+    arg_parser.add_argument("--queue-size", type=int, default=64)
+    # Seconds a request waits for its answer
+    arg_parser.add_argument("--timeout", type=float, default=30.0)
+    # Seconds a worker may spend on one question before it is given up and replaced
+    arg_parser.add_argument("--question-timeout", type=float, default=10.0)
+    # Answers kept for repeated questions (0 turns the cache off) and their time to live in seconds
+    arg_parser.add_argument("--cache-size", type=int, default=4096)
+    arg_parser.add_argument("--cache-ttl", type=float, default=None)
+    # Stage timings in /stats, and the fraction of the questions profiled into /profiles
+    arg_parser.add_argument("--no-metrics", action="store_true")
+    arg_parser.add_argument("--profile-rate", type=float, default=0.0)
+    # Read the text files of Models instead of the compiled artifact
+    arg_parser.add_argument("--no-artifact", action="store_true")
+    # Segment every question with VnCoreNLP, without the dictionary segmenter in this process
+    arg_parser.add_argument("--no-fast-segmenter", action="store_true")
+    # Seconds between two checks of the files of Models for a hot reload, 0 turns it off
+    arg_parser.add_argument("--reload-interval", type=float, default=1.0)
+    args = arg_parser.parse_args()
+
+    question_server = QuestionServer(args.workers, args.queue_size, cache_size=args.cache_size,
+                                      cache_ttl=args.cache_ttl, metrics=not args.no_metrics,
+                                      profile_rate=args.profile_rate,
+                                      artifact_path=None if args.no_artifact else ARTIFACT_PATH,
+                                      fast_segmenter=not args.no_fast_segmenter,
+                                      reload_interval=args.reload_interval,
+                                      question_timeout=args.question_timeout)
+    question_server.start()
+    http_server = ThreadingHTTPServer((args.host, args.port), make_handler(question_server, args.timeout))
+    print("Serving on http://" + args.host + ":" + str(args.port) + "/answer")
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        question_server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# The paths of Models are written as ../Assignment/Models/..., relative to the folder of main.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def models():
+    # The models of the text files, questions are segmented in this process rather than by VnCoreNLP
+    from Models.dictionary_segmenter import get_dictionary_segmenter
+    from Models.parser import load_models, current_models
+    from Models.segmenter import configure_segmenter
+    load_models(artifact_path=None)
+    configure_segmenter(factory=get_dictionary_segmenter, cache_path=None)
+    return current_models()
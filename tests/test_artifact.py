@@ -0,0 +1,37 @@
+import random
+
+from benchmarks.timetable import generate_timetable, build_knowledge_base
+from Models.artifact import write_artifact, ModelArtifact
+from Models.knowledge_base import FACT_TYPES, TIMED_PREDICATES
+from Models.query import TimeRange
+
+
+def random_pattern(rng, knowledge_base, predicate):
+    # The values of a fact, each one left free half of the time, a window of times or a value no fact has
+    fact = rng.choice(knowledge_base.facts[predicate])
+    args = tuple(value if rng.random() < 0.5 else None for value in fact)
+    if predicate in TIMED_PREDICATES and rng.random() < 0.4:
+        start = rng.randrange(0, 24 * 60)
+        end = rng.randrange(start, 24 * 60 + 1)
+        window = rng.choice([TimeRange(start, end, True, True), TimeRange(None, start, False, False),
+                             TimeRange(start, None, False, False), TimeRange(start, end, False, True)])
+        args = args[:2] + (window,)
+    if rng.random() < 0.05:
+        position = rng.randrange(len(args))
+        args = args[:position] + ("UNKNOWN",) + args[position + 1:]
+    return args
+
+
+def test_mapped_lookups_match_the_knowledge_base(tmp_path):
+    knowledge_base = build_knowledge_base(generate_timetable(300, seed=1))
+    path = str(tmp_path / "models.bin")
+    write_artifact(path, knowledge_base, {}, [])
+    mapped = ModelArtifact(path).knowledge_base()
+    assert len(mapped) == len(knowledge_base)
+    assert list(mapped.cities) == list(knowledge_base.cities)
+    rng = random.Random(23)
+    predicates = list(FACT_TYPES)
+    for _ in range(20000):
+        predicate = rng.choice(predicates)
+        args = random_pattern(rng, knowledge_base, predicate)
+        assert list(mapped.lookup(predicate, args)) == list(knowledge_base.lookup(predicate, args)), (predicate, args)
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from Models.dictionary_segmenter import get_dictionary_segmenter, split_tokens
+
+# The words of the sample questions of Input/1.txt as VnCoreNLP segmented them, from the parser traces of
+# Output/output_a.txt before the segmenter of this process, one sentence per line
+REFERENCE_PATH = os.path.join(os.path.dirname(__file__), "data", "rdr_segmentation.txt")
+
+
+def reference_sentences():
+    with open(REFERENCE_PATH, 'r', encoding="utf-8") as file:
+        return [line.split() for line in file.read().splitlines() if line.strip() != ""]
+
+
+@pytest.mark.parametrize("words", reference_sentences(), ids=" ".join)
+def test_sample_questions_segment_as_rdrsegmenter(words):
+    segmenter = get_dictionary_segmenter()
+    segmented, confidence = segmenter.segment(" ".join(word.replace("_", " ") for word in words))
+    assert segmented == words
+    # Every syllable is known, so these never go to VnCoreNLP
+    assert confidence == 1.0
+
+
+def test_unknown_syllables_are_left_to_vncorenlp():
+    segmenter = get_dictionary_segmenter()
+    assert segmenter.try_tokenize("xe buýt nào đi từ qwzx ?") is None
+    assert segmenter.try_tokenize("xe buýt nào đi từ huế ?\nxe buýt b1 đi đến đâu ?") == \
+        [["xe_buýt", "nào", "đi", "từ", "huế", "?"], ["xe_buýt", "b1", "đi", "đến", "đâu", "?"]]
+
+
+def test_punctuation_is_split_off_the_words():
+    assert split_tokens("huế? (b1)") == ["huế", "?", "(", "b1", ")"]
@@ -0,0 +1,161 @@
+import random
+
+import pytest
+
+from Models import parser
+from Models.cities import CityTable
+from Models.output import MemorySink, STAGES
+
+QUESTION = "Xe bus nào đến thành phố Huế lúc 20:00HR ?"
+
+
+def test_cache_keeps_only_the_stages_a_sink_writes(models, monkeypatch):
+    answered = []
+    run_stages = parser.run_stages
+    monkeypatch.setattr(parser, "run_stages", lambda *args: answered.append(args) or run_stages(*args))
+    cache = parser.enable_answer_cache()
+    try:
+        answer = parser.analyze(QUESTION)["answer"]
+        ((_, outputs), _), = cache._entries.values()
+        assert outputs == {}
+        # An entry kept without the stages of this sink is answered again, then it writes them as a miss would
+        written = MemorySink()
+        assert parser.analyze(QUESTION, written)["answer"] == answer
+        assert len(answered) == 2
+        # Kept with them now, the next one is a hit
+        hit = MemorySink()
+        parser.analyze(QUESTION, hit)
+        assert len(answered) == 2
+        assert hit.getvalues() == written.getvalues()
+        parser.disable_answer_cache()
+        direct = MemorySink()
+        parser.analyze(QUESTION, direct)
+        assert written.getvalues() == direct.getvalues()
+        # The parser trace of stage a is only written at a higher trace level
+        assert all(written.getvalues()[stage] for stage in STAGES if stage != "a")
+    finally:
+        parser.disable_answer_cache()
+
+
+def scan_parse(words, grammar):
+    # The parser as it was before the oracle, which looks every relation up in the grammar,
+    # with the same shift when a transition cannot be made
+    city_set = grammar.city_set
+    connected_arc = {'từ': 0, 'đến': 0}
+    conf = parser.Configuration(['root'], list(words), [])
+    while not conf.buffer_empty():
+        w_i = conf.stack[-1]
+        w_j = conf.front()
+        found = grammar.find(w_i, w_j)
+        excluded = w_i in city_set or w_i in ["lúc", "lúc_nào"] and w_j in ["từ", "đến"]
+        if found is not None and not excluded:
+            relation, is_right = found
+            counted = w_i if is_right else w_j
+            if counted in connected_arc:
+                connected_arc[counted] += 1
+            if not is_right:
+                transition = parser.Transition.left_arc
+            elif relation.relation_name == "nmod":
+                transition = parser.Transition.right_arc_star
+            else:
+                transition = parser.Transition.right_arc
+            if transition(conf, relation.relation_name) != -1:
+                continue
+            parser.Transition.shift(conf)
+            continue
+        have_hidden_arc = False
+        if w_j in grammar.by_head or w_j in grammar.by_dependent:
+            for word in conf.stack[:-1]:
+                found = grammar.find(word, w_j)
+                if found is None:
+                    continue
+                relation, is_right = found
+                head, dependent = (word, w_j) if is_right else (w_j, word)
+                have_hidden_arc = (head, dependent) not in conf.arc_pairs
+                if head in connected_arc and connected_arc[head] >= 2:
+                    have_hidden_arc = False
+                break
+        if not have_hidden_arc or parser.Transition.reduce(conf) == -1:
+            parser.Transition.shift(conf)
+    return conf.arcs
+
+
+def test_oracle_parses_as_the_grammar_on_random_sentences(models):
+    grammar = models.grammar
+    vocabulary = sorted(set(grammar.by_head) | set(grammar.by_dependent) | grammar.city_set - {"root"})
+    vocabulary += ["xe_khách", "không", "hr", "?"]
+    rng = random.Random(17)
+    for _ in range(3000):
+        words = [rng.choice(vocabulary) for _ in range(rng.randint(1, 14))]
+        assert parser.ProcessText.parsing(words, grammar) == scan_parse(words, grammar), words
+
+
+def test_a_time_with_its_own_relations_has_its_own_class(models):
+    relations = parser.Grammar.read_relations() + [parser.Relation("19:00", "nmod", "tối")]
+    grammar = parser.Grammar(relations, models.grammar.city_set)
+    oracle = grammar.oracle()
+    assert oracle.word_class["19:00"] != oracle.word_class["20:00"]
+    assert oracle.classify("20:15") == oracle.word_class["20:00"]
+    for words in [["lúc", "19:00", "tối"], ["lúc", "20:00", "tối"], ["đến", "lúc", "19:00", "hr", "tối"]]:
+        assert parser.ProcessText.parsing(words, grammar) == scan_parse(words, grammar), words
+
+
+@pytest.mark.parametrize("question, goal", [
+    ("Xe buýt nào đi từ Huế lúc 20:15 giờ?", "(DTIME ?tr HUE 20:15HR)"),
+    ("Xe buýt nào đến Huế lúc 8 giờ 15 ?", "(ATIME ?tr HUE 8:15HR)"),
+    ("Xe buýt nào đến thành phố Hồ Chí Minh lúc 18:30 HR ?", "(ATIME ?tr HCMC 18:30HR)"),
+])
+def test_times_off_the_grammar_are_parsed_as_its_times(models, question, goal):
+    # The grammar only lists the hours and half hours, any other time used to stop the parser
+    result = parser.analyze(question)
+    assert goal in str(result["procedure_form"]).split("\n")
+
+
+@pytest.mark.parametrize("question, goal, answer", [
+    ("Xe buýt nào đến thành phố Hồ Chí Minh trước 20:15 ?", "(ATIME ?tr HCMC <20:15HR)", "Kết quả là B4."),
+    ("Xe buýt nào đi từ Đà Nẵng sau 8 giờ 15 ?", "(DTIME ?tr DANANG >8:15HR)", "Kết quả là B4,B3."),
+    ("Xe buýt nào đi từ Đà Nẵng từ 8 giờ 15 đến 10 giờ ?", "(DTIME ?tr DANANG 8:15HR..10:00HR)", "Kết quả là B4."),
+    ("Xe buýt nào đến Huế trước 20 ?", "(ATIME ?tr HUE <20:00HR)", "Kết quả là B1."),
+    ("Xe buýt nào đến Huế sau 18 giờ và trước 21 giờ ?", "(ATIME ?tr HUE 18:01HR..20:59HR)", "Kết quả là B1,B3."),
+    ("Xe buýt nào đến Huế sau 21 giờ và trước 20 giờ ?", "(ATIME ?tr HUE 21:01HR..19:59HR)",
+     "Không có kết quả thoả mãn."),
+])
+def test_windows_off_the_grammar_are_parsed_as_its_times(models, question, goal, answer):
+    result = parser.analyze(question)
+    assert goal in str(result["procedure_form"]).split("\n")
+    assert result["answer"] == answer
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_metrics_time_every_question_once(models, cached):
+    questions = ["Xe buýt nào đi từ Huế?", "Xe buýt nào đến Huế lúc 8 giờ 15 ?", "Xe buýt nào đi từ Huế?"]
+    metrics = parser.enable_metrics(profile_rate=1.0)
+    if cached:
+        parser.enable_answer_cache()
+    try:
+        parser.analyze_batch(questions)
+        stages = metrics.stats()["stages"]
+        # The repeated question is answered once from the cache
+        answered = 2 if cached else 3
+        assert stages["normalize"]["count"] == 3
+        assert stages["segmentation_batch"]["count"] == 1
+        for stage in ["complete_sentence", "parsing", "get_query_answer"]:
+            assert stages[stage]["count"] == answered
+        # One profile for the whole batch, the word segmentation included
+        (event,) = metrics.profiles
+        assert "tokenize_batch" in event.profile
+    finally:
+        parser.disable_metrics()
+        parser.disable_answer_cache()
+
+
+def test_a_city_without_a_code_is_refused(models):
+    before = parser.current_models()
+    # It would be asked for as any city
+    city_table = CityTable([row for row in models.city_table.rows if row[0] != "huế"])
+    with pytest.raises(ValueError, match="huế"):
+        parser.swap_models(city_table=city_table)
+    grammar = parser.Grammar(parser.Grammar.read_relations(), sorted(models.grammar.city_set) + ["vũng_tàu"])
+    with pytest.raises(ValueError, match="vũng_tàu"):
+        parser.swap_models(grammar=grammar)
+    assert parser.current_models() is before
@@ -0,0 +1,121 @@
+import random
+import shutil
+
+import pytest
+
+from benchmarks.timetable import generate_timetable, build_knowledge_base
+from Models import parser, reload
+from Models.knowledge_base import BusKnowledgeBase, LayeredKnowledgeBase, FACT_TYPES
+from tests.test_artifact import random_pattern
+
+QUESTION = "Xe buýt nào đi từ Đà Nẵng?"
+NEW_BUS = ["(TRAIN B7)", "(DTIME B7 DANANG 7:00HR)", "(ATIME B7 HUE 11:00HR)", "(RUN-TIME B7 DANANG HUE 4:00HR)"]
+
+
+@pytest.fixture
+def data_path(models, tmp_path, monkeypatch):
+    # A copy of data.txt is watched instead of the one in Models, the other files are left alone
+    path = str(tmp_path / "data.txt")
+    shutil.copyfile(reload.DATA_PATH, path)
+    monkeypatch.setattr(reload, "DATA_PATH", path)
+    monkeypatch.setattr(reload, "MODEL_SOURCES", [path])
+    yield path
+    parser.swap_models(knowledge_base=models.knowledge_base)
+
+
+def append(path, lines):
+    with open(path, 'a') as file:
+        file.write(lines)
+
+
+def test_appended_lines_are_layered_on_the_loaded_timetable(data_path):
+    reloader = reload.ModelReloader(artifact_path=None)
+    before = parser.current_models()
+    assert parser.analyze(QUESTION)["answer"] == "Kết quả là B3,B4,B5."
+    # A line still being written is left for the next check
+    append(data_path, NEW_BUS[0] + "\n" + NEW_BUS[1][:8])
+    assert reloader.check() == [data_path]
+    append(data_path, NEW_BUS[1][8:] + "\n" + "\n".join(NEW_BUS[2:]) + "\n")
+    assert reloader.check() == [data_path]
+    models = parser.current_models()
+    assert models.version > before.version
+    assert isinstance(models.knowledge_base, LayeredKnowledgeBase)
+    assert models.knowledge_base.base is before.knowledge_base
+    assert len(models.knowledge_base) == len(before.knowledge_base) + 4
+    assert reloader.stats()["appends"] == 2 and reloader.stats()["rebuilds"] == 0
+    assert parser.analyze(QUESTION)["answer"] == "Kết quả là B3,B4,B5,B7."
+    assert reloader.check() == []
+
+
+def test_questions_being_answered_keep_their_models(data_path):
+    reloader = reload.ModelReloader(artifact_path=None)
+    cache = parser.enable_answer_cache()
+    try:
+        assert parser.analyze(QUESTION)["answer"] == "Kết quả là B3,B4,B5."
+        with parser.pinned_models() as pinned:
+            append(data_path, "\n".join(NEW_BUS) + "\n")
+            reloader.check()
+            assert parser.current_models() is pinned
+            assert parser.analyze(QUESTION)["answer"] == "Kết quả là B3,B4,B5."
+        # The swap dropped the cached answers, and the next questions see the new bus
+        assert cache.invalidations == 1
+        assert parser.analyze(QUESTION)["answer"] == "Kết quả là B3,B4,B5,B7."
+    finally:
+        parser.disable_answer_cache()
+
+
+def test_a_rewritten_timetable_is_read_again(data_path):
+    reloader = reload.ModelReloader(artifact_path=None)
+    with open(data_path, 'r') as file:
+        lines = [line for line in file.read().splitlines() if "B4" not in line]
+    with open(data_path, 'w') as file:
+        file.write("\n".join(lines) + "\n")
+    assert reloader.check() == [data_path]
+    knowledge_base = parser.current_models().knowledge_base
+    assert isinstance(knowledge_base, BusKnowledgeBase)
+    assert reloader.stats()["rebuilds"] == 1
+    assert parser.analyze(QUESTION)["answer"] == "Kết quả là B3,B5."
+    # Appends are layered on the timetable read again
+    append(data_path, "\n".join(NEW_BUS) + "\n")
+    reloader.check()
+    assert parser.current_models().knowledge_base.base is knowledge_base
+
+
+def test_too_many_appended_facts_rebuild_the_timetable(data_path):
+    reloader = reload.ModelReloader(artifact_path=None, max_appended_share=0.1)
+    append(data_path, "\n".join(NEW_BUS) + "\n")
+    reloader.check()
+    assert isinstance(parser.current_models().knowledge_base, BusKnowledgeBase)
+    assert reloader.stats()["rebuilds"] == 1 and reloader.stats()["appended_facts"] == 0
+
+
+def test_appends_are_stacked_in_few_layers(data_path):
+    reloader = reload.ModelReloader(artifact_path=None, max_appended_share=100)
+    base = reloader.base
+    knowledge_bases = []
+    for idx in range(40):
+        append(data_path, f"(TRAIN N{idx})\n")
+        assert reloader.check() == [data_path]
+        knowledge_bases.append(parser.current_models().knowledge_base)
+    # The layers halve in size, and the knowledge bases of earlier snapshots are left as they were
+    assert [len(layer) for layer in reloader.appended] == [32, 8]
+    assert [len(knowledge_base) - len(base) for knowledge_base in knowledge_bases] == list(range(1, 41))
+    assert knowledge_bases[-1].train_names == base.train_names + [f"N{idx}" for idx in range(40)]
+    assert knowledge_bases[9].trains[-1].train == "N9"
+
+
+@pytest.mark.parametrize("cuts", [[4], [2, 3, 4]])
+def test_layered_lookups_match_the_whole_timetable(cuts):
+    lines = list(generate_timetable(300, seed=25))
+    bounds = [0] + [len(lines) * cut // 5 for cut in cuts] + [len(lines)]
+    layered = LayeredKnowledgeBase(*(build_knowledge_base(lines[start:end]) for start, end in zip(bounds, bounds[1:])))
+    whole = build_knowledge_base(lines)
+    assert len(layered) == len(whole)
+    assert list(layered.cities) == list(whole.cities)
+    assert all(list(layered.facts[predicate]) == whole.facts[predicate] for predicate in FACT_TYPES)
+    rng = random.Random(25)
+    predicates = list(FACT_TYPES)
+    for _ in range(20000):
+        predicate = rng.choice(predicates)
+        args = random_pattern(rng, whole, predicate)
+        assert list(layered.lookup(predicate, args)) == list(whole.lookup(predicate, args)), (predicate, args)
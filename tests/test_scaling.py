@@ -0,0 +1,16 @@
+from benchmarks import scaling
+from benchmarks.timetable import generate_timetable, build_knowledge_base
+
+
+def test_selective_questions_look_at_as_many_facts_on_a_larger_timetable(models):
+    # A scan of the timetable would look at ten times as many facts on the larger one
+    results = []
+    for buses in [100, 1000]:
+        knowledge_base = build_knowledge_base(generate_timetable(buses, seed=3))
+        candidates = {}
+        times = scaling.measure(knowledge_base, scaling.QUERIES, 200, seed=3, candidates=candidates)
+        assert set(times) == set(candidates) == set(scaling.QUERIES)
+        results.append(candidates)
+    small, large = results
+    for name in scaling.QUERIES:
+        assert large[name] <= small[name] * 2 + 1, (name, small[name], large[name])
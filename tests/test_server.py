@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import server
+from server import QuestionServer, make_handler
+
+
+@pytest.fixture
+def question_server(monkeypatch):
+    release = threading.Event()
+
+    def analyze(question):
+        if question == "hang":
+            release.wait()
+        if question == "boom":
+            raise ValueError("cannot answer")
+        return {"question": question, "answer": "Kết quả là B1."}
+
+    monkeypatch.setattr(server, "analyze", analyze)
+    question_server = QuestionServer(workers=2, cache_size=0, metrics=False, artifact_path=None, reload_interval=0,
+                                      question_timeout=0.3)
+    question_server.start()
+    http_server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(question_server, timeout=5.0))
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    yield question_server, "http://127.0.0.1:%d" % http_server.server_address[1], release
+    release.set()
+    http_server.shutdown()
+    http_server.server_close()
+    question_server.stop()
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def ask(base_url, question):
+    return get(base_url + "/answer?" + urllib.parse.urlencode({"q": question}))
+
+
+def test_answer_and_error(question_server):
+    _, base_url, _ = question_server
+    assert ask(base_url, "xe buýt nào đi từ huế?") == (200, {"question": "xe buýt nào đi từ huế?",
+                                                          "answer": "Kết quả là B1."})
+    status, body = ask(base_url, "boom")
+    assert status == 500 and body["error"] == "cannot answer"
+    assert get(base_url + "/health")[0] == 200
+
+
+def test_hanging_questions_time_out_without_blocking_the_pool(question_server):
+    _, base_url, release = question_server
+    # More hanging questions than workers
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(ask(base_url, "hang"))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [status for status, _ in results] == [504, 504]
+    # The stuck workers were replaced
+    assert ask(base_url, "xe buýt b1 đến đâu?")[0] == 200
+    status, health = get(base_url + "/health")
+    assert status == 503 and health["stuck_workers"] == 2 and health["timeouts"] == 2
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while get(base_url + "/health")[0] != 200 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert get(base_url + "/health")[1]["stuck_workers"] == 0
+
+
+def test_stalled_queue_is_unhealthy(question_server):
+    question_server_, _, release = question_server
+    question_server_.max_stuck = 0
+    futures = [question_server_.submit("hang") for _ in range(3)]
+    time.sleep(1.0)
+    # Past max_stuck nothing replaces the workers, the third question waits in the queue
+    health = question_server_.health()
+    assert health["status"] == "unhealthy" and health["queue_stalled"]
+    release.set()
+    assert futures[2].result(5)["answer"] == "Kết quả là B1."
+
+
+def test_stop_does_not_wait_for_stuck_workers(question_server):
+    question_server_, _, release = question_server
+    question_server_.max_stuck = 0
+    future = question_server_.submit("hang")
+    with pytest.raises(server.QuestionTimeout):
+        future.result(5)
+    # Still stuck and not replaced
+    assert question_server_.health()["stuck_workers"] == 1
+    stopping = threading.Thread(target=question_server_.stop, daemon=True)
+    stopping.start()
+    stopping.join(1.0)
+    assert not stopping.is_alive()
+    assert not release.is_set()